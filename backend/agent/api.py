@@ -548,6 +548,7 @@ async def run_agent_background(
     # Start a background task to check for stop signals
     stop_signal_received = False
     stop_checker = None
+    agent_consumer = None  # Task consuming the agent generator; cancelled on stop
     
     async def check_for_stop_signal():
         nonlocal stop_signal_received
@@ -564,6 +565,10 @@ async def run_agent_background(
                         if message["data"] == stop_signal or message["data"] == stop_signal.encode('utf-8'):
                             logger.info(f"Received stop signal for agent run: {agent_run_id} (instance: {instance_id})")
                             stop_signal_received = True
+                            # Cancel right away instead of waiting for the next response, so that
+                            # in-flight LLM calls and tool executions are cut short
+                            if agent_consumer and not agent_consumer.done():
+                                agent_consumer.cancel()
                             break
                 except Exception as e:
                     logger.warning(f"Error checking for stop signals: {str(e)}")
@@ -616,25 +621,37 @@ async def run_agent_background(
         # Collect all responses to save to database
         all_responses = []
         
-        async for response in agent_gen:
-            # Check if stop signal received
-            if stop_signal_received:
-                logger.info(f"Agent run stopped due to stop signal: {agent_run_id} (instance: {instance_id})")
-                await update_agent_run_status(client, agent_run_id, "stopped", responses=all_responses)
-                break
-                
-            # Check for billing error status
-            if response.get('type') == 'status' and response.get('status') == 'error':
-                error_msg = response.get('message', '')
-                logger.info(f"Agent run failed with error: {error_msg} (instance: {instance_id})")
-                await update_agent_run_status(client, agent_run_id, "failed", error=error_msg, responses=all_responses)
-                break
-                
-            # Store response in memory
-            if agent_run_id in active_agent_runs:
-                active_agent_runs[agent_run_id].append(response)
-                all_responses.append(response)
-                total_responses += 1
+        async def consume_agent_responses():
+            nonlocal total_responses
+            async for response in agent_gen:
+                # Check if stop signal received
+                if stop_signal_received:
+                    return
+                    
+                # Check for billing error status
+                if response.get('type') == 'status' and response.get('status') == 'error':
+                    error_msg = response.get('message', '')
+                    logger.info(f"Agent run failed with error: {error_msg} (instance: {instance_id})")
+                    await update_agent_run_status(client, agent_run_id, "failed", error=error_msg, responses=all_responses)
+                    return
+                    
+                # Store response in memory
+                if agent_run_id in active_agent_runs:
+                    active_agent_runs[agent_run_id].append(response)
+                    all_responses.append(response)
+                    total_responses += 1
+        
+        agent_consumer = asyncio.create_task(consume_agent_responses())
+        try:
+            await agent_consumer
+        except asyncio.CancelledError:
+            # The stop checker cancels the consumer; any other cancellation is ours
+            if not stop_signal_received:
+                raise
+        
+        if stop_signal_received:
+            logger.info(f"Agent run stopped due to stop signal: {agent_run_id} (instance: {instance_id})")
+            await update_agent_run_status(client, agent_run_id, "stopped", responses=all_responses)
         
         # Signal all done if we weren't stopped
         if not stop_signal_received:
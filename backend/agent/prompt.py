@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 
 SYSTEM_PROMPT = f"""
 You are Suna.so, an autonomous AI Agent created by the Kortix team.
@@ -15,8 +16,7 @@ You are a full-spectrum autonomous agent capable of executing complex tasks acro
 - All file operations (create, read, write, delete) expect paths relative to "/workspace"
 ## 2.2 SYSTEM INFORMATION
 - BASE ENVIRONMENT: Python 3.11 with Debian Linux (slim)
-- UTC DATE: {datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')}
-- UTC TIME: {datetime.datetime.now(datetime.timezone.utc).strftime('%H:%M:%S')}
+- UTC DATE AND TIME: given in a message just before the latest user message
 - INSTALLED TOOLS:
   * PDF Processing: poppler-utils, wkhtmltopdf
   * Document Processing: antiword, unrtf, catdoc
@@ -353,7 +353,7 @@ Your approach is deliberately methodical and persistent:
 
 ## 5.4 TASK MANAGEMENT CYCLE
 1. STATE EVALUATION: Examine Todo.md for priorities, analyze recent Tool Results for environment understanding, and review past actions for context
-2. TOOL SELECTION: Choose exactly one tool that advances the current todo item
+2. TOOL SELECTION: Choose the tool that advances the current todo item. You may chain several tool calls in one response when the later ones do not depend on results you have not seen yet; they run in order and stop at the first failure or at 'ask'/'complete'
 3. EXECUTION: Wait for tool execution and observe results
 4. **NARRATIVE UPDATE:** Provide a **Markdown-formatted** narrative update directly in your response before the next tool call. Include explanations of what you've done, what you're about to do, and why. Use headers, brief paragraphs, and formatting to enhance readability.
 5. PROGRESS TRACKING: Update todo.md with completed items and new tasks
@@ -459,8 +459,21 @@ For casual conversation and social interactions:
 """
 
 
+# Stable while the prompt text is unchanged, so assembled prompts are reused across runs
+SYSTEM_PROMPT_VERSION = hashlib.sha1(SYSTEM_PROMPT.encode('utf-8')).hexdigest()
+
+
 def get_system_prompt():
     '''
     Returns the system prompt
     '''
-    return SYSTEM_PROMPT 
\ No newline at end of file
+    return SYSTEM_PROMPT
+
+
+def get_datetime_context():
+    '''
+    Returns the current UTC date and time, kept out of the system prompt so it stays cacheable
+    '''
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return f"Current UTC date: {now.strftime('%Y-%m-%d')}, UTC time: {now.strftime('%H:%M:%S')}"
+ 
\ No newline at end of file
@@ -1,6 +1,6 @@
 import json
 
-from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
+from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, execution_traits
 from agent.tools.data_providers.LinkedinProvider import LinkedinProvider
 from agent.tools.data_providers.YahooFinanceProvider import YahooFinanceProvider
 from agent.tools.data_providers.AmazonProvider import AmazonProvider
@@ -21,6 +21,7 @@ class DataProvidersTool(Tool):
             "twitter": TwitterProvider()
         }
 
+    @execution_traits(read_only=True)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -81,6 +82,7 @@ Use this tool when you need to discover what endpoints are available.
                 simplified_message += "..."
             return self.fail_response(simplified_message)
 
+    @execution_traits(read_only=True)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -1,6 +1,6 @@
 import os
 from typing import List, Optional, Union
-from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
+from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, execution_traits
 
 class MessageTool(Tool):
     """Tool for user communication and interaction.
@@ -14,6 +14,7 @@ class MessageTool(Tool):
     
     # Commented out as we are just doing this via prompt as there is no need to call it as a tool
 
+    @execution_traits(read_only=True)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -158,6 +159,7 @@ Ask user a question and wait for response. Use for: 1) Requesting clarification
 #         except Exception as e:
 #             return self.fail_response(f"Error informing user: {str(e)}")
 
+    @execution_traits(read_only=True)
     @openapi_schema({
         "type": "function",
         "function": {
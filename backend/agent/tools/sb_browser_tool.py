@@ -1,7 +1,7 @@
 import traceback
 import json
 
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, ToolExecutionTraits, ToolExecutionLimits, openapi_schema, xml_schema
 from agentpress.thread_manager import ThreadManager
 from sandbox.sandbox import SandboxToolsBase, Sandbox
 from utils.logger import logger
@@ -9,6 +9,11 @@ from utils.logger import logger
 
 class SandboxBrowserTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities."""
+
+    # All actions drive the same browser page, so they must never overlap
+    default_execution_traits = ToolExecutionTraits(exclusive_resources=("browser",))
+    # A hung browser action must not hold the run (and the browser) indefinitely
+    default_execution_limits = ToolExecutionLimits(timeout=90)
     
     def __init__(self, sandbox: Sandbox, thread_id: str, thread_manager: ThreadManager):
         super().__init__(sandbox)
@@ -43,7 +48,8 @@ class SandboxBrowserTool(SandboxToolsBase):
             print(f"\033[95mExecuting curl command:\033[0m")
             print(f"{curl_cmd}")
             
-            response = self.sandbox.process.exec(curl_cmd, timeout=30)
+            # Run the blocking sandbox call in a thread; it is bounded by its own 30s timeout
+            response = await self.run_blocking(self.sandbox.process.exec, curl_cmd, timeout=30)
             
             if response.exit_code == 0:
                 try:
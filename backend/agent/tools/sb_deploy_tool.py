@@ -1,6 +1,7 @@
 import os
+from typing import AsyncGenerator, Union
 from dotenv import load_dotenv
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, ToolProgress, openapi_schema, xml_schema, execution_traits
 from sandbox.sandbox import SandboxToolsBase, Sandbox
 from utils.files_utils import clean_path
 from agent.tools.sb_shell_tool import SandboxShellTool
@@ -21,6 +22,7 @@ class SandboxDeployTool(SandboxToolsBase):
         """Clean and normalize a path to be relative to /workspace"""
         return clean_path(path, self.workspace_path)
 
+    @execution_traits(exclusive_resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -44,6 +46,7 @@ class SandboxDeployTool(SandboxToolsBase):
     })
     @xml_schema(
         tag_name="deploy",
+        timeout=600,
         mappings=[
             {"param_name": "name", "node_type": "attribute", "path": "name"},
             {"param_name": "directory_path", "node_type": "attribute", "path": "directory_path"}
@@ -61,17 +64,18 @@ class SandboxDeployTool(SandboxToolsBase):
         </deploy>
         '''
     )
-    async def deploy(self, name: str, directory_path: str) -> ToolResult:
+    async def deploy(self, name: str, directory_path: str) -> AsyncGenerator[Union[ToolProgress, ToolResult], None]:
         """
         Deploy a static website (HTML+CSS+JS) from the sandbox to Cloudflare Pages.
         Only use this tool when permanent deployment to a production environment is needed.
+        Progress updates are yielded while the deployment runs.
         
         Args:
             name: Name for the deployment, will be used in the URL as {name}.kortix.cloud
             directory_path: Path to the directory to deploy, relative to /workspace
             
-        Returns:
-            ToolResult containing:
+        Yields:
+            ToolProgress updates, then a ToolResult containing:
             - Success: Deployment information including URL
             - Failure: Error message if deployment fails
         """
@@ -80,18 +84,22 @@ class SandboxDeployTool(SandboxToolsBase):
             full_path = f"{self.workspace_path}/{directory_path}"
             
             # Verify the directory exists
+            yield self.progress(f"Checking directory '{directory_path}'")
             try:
                 dir_info = self.sandbox.fs.get_file_info(full_path)
                 if not dir_info.is_dir:
-                    return self.fail_response(f"'{directory_path}' is not a directory")
+                    yield self.fail_response(f"'{directory_path}' is not a directory")
+                    return
             except Exception as e:
-                return self.fail_response(f"Directory '{directory_path}' does not exist: {str(e)}")
+                yield self.fail_response(f"Directory '{directory_path}' does not exist: {str(e)}")
+                return
             
             # Deploy to Cloudflare Pages directly from the container
             try:
                 # Get Cloudflare API token from environment
                 if not self.cloudflare_api_token:
-                    return self.fail_response("CLOUDFLARE_API_TOKEN environment variable not set")
+                    yield self.fail_response("CLOUDFLARE_API_TOKEN environment variable not set")
+                    return
                     
                 # Single command that creates the project if it doesn't exist and then deploys
                 project_name = f"{self.sandbox_id}-{name}"
@@ -100,26 +108,32 @@ class SandboxDeployTool(SandboxToolsBase):
                     (npx wrangler pages project create {project_name} --production-branch production && 
                     npx wrangler pages deploy {full_path} --project-name {project_name}))'''
 
-                # Execute command using shell_tool.execute_command
-                response = await self.shell_tool.execute_command(
+                # Execute command using shell_tool.execute_command, forwarding its output as it arrives
+                yield self.progress(f"Deploying '{directory_path}' to Cloudflare Pages project {project_name}")
+                response = None
+                async for update in self.shell_tool.execute_command(
                     command=deploy_cmd,
                     folder=None,  # Use the workspace root
                     timeout=300   # Increased timeout for deployments
-                )
+                ):
+                    if isinstance(update, ToolProgress):
+                        yield update
+                    else:
+                        response = update
                 
                 print(f"Deployment response: {response}")
                 
                 if response.success:
-                    return self.success_response({
+                    yield self.success_response({
                         "message": f"Website deployed successfully",
                         "output": response.output
                     })
                 else:
-                    return self.fail_response(f"Deployment failed: {response.output}")
+                    yield self.fail_response(f"Deployment failed: {response.output}")
             except Exception as e:
-                return self.fail_response(f"Error during deployment: {str(e)}")
+                yield self.fail_response(f"Error during deployment: {str(e)}")
         except Exception as e:
-            return self.fail_response(f"Error deploying website: {str(e)}")
+            yield self.fail_response(f"Error deploying website: {str(e)}")
 
 if __name__ == "__main__":
     import asyncio
@@ -134,11 +148,11 @@ if __name__ == "__main__":
         deploy_tool = SandboxDeployTool(sandbox_id, password)
         
         # Test deployment - replace with actual directory path and site name
-        result = await deploy_tool.deploy(
+        async for update in deploy_tool.deploy(
             name="test-site-1x",
             directory_path="website"  # Directory containing static site files
-        )
-        print(f"Deployment result: {result}")
+        ):
+            print(f"Deployment update: {update}")
             
     asyncio.run(test_deploy())
 
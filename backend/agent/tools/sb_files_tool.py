@@ -1,7 +1,7 @@
 from daytona_sdk.process import SessionExecuteRequest
 from typing import Optional
 
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, openapi_schema, xml_schema, execution_traits
 from sandbox.sandbox import SandboxToolsBase, Sandbox
 from utils.files_utils import EXCLUDED_FILES, EXCLUDED_DIRS, EXCLUDED_EXT, should_exclude_file, clean_path
 import os
@@ -62,6 +62,7 @@ class SandboxFilesTool(SandboxToolsBase):
             print(f"Error getting workspace state: {str(e)}")
             return {}
 
+    @execution_traits(path_param="file_path", shared_resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -120,6 +121,7 @@ class SandboxFilesTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error creating file: {str(e)}")
 
+    @execution_traits(path_param="file_path", shared_resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -192,6 +194,7 @@ class SandboxFilesTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error replacing string: {str(e)}")
 
+    @execution_traits(path_param="file_path", shared_resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -247,6 +250,7 @@ class SandboxFilesTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error rewriting file: {str(e)}")
 
+    @execution_traits(path_param="file_path", shared_resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -1,8 +1,13 @@
-from typing import Optional, Dict, List
+import asyncio
+import time
+from typing import AsyncGenerator, Optional, Dict, List, Set, Union
 from uuid import uuid4
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, ToolProgress, openapi_schema, xml_schema, execution_traits
 from sandbox.sandbox import SandboxToolsBase, Sandbox
 
+# Seconds between polls of a running command's exit code and output
+COMMAND_POLL_INTERVAL = 1.0
+
 class SandboxShellTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities. 
     Uses sessions for maintaining state between commands and provides comprehensive process management."""
@@ -10,6 +15,7 @@ class SandboxShellTool(SandboxToolsBase):
     def __init__(self, sandbox: Sandbox):
         super().__init__(sandbox)
         self._sessions: Dict[str, str] = {}  # Maps session names to session IDs
+        self._kill_tasks: Set[asyncio.Task] = set()  # Session kills still running; the loop only keeps weak references
         self.workspace_path = "/workspace"  # Ensure we're always operating in /workspace
 
     async def _ensure_session(self, session_name: str = "default") -> str:
@@ -32,6 +38,14 @@ class SandboxShellTool(SandboxToolsBase):
             except Exception as e:
                 print(f"Warning: Failed to cleanup session {session_name}: {str(e)}")
 
+    async def _kill_session(self, session_id: str):
+        """Delete a session whose command was cut short by a timeout or stop request."""
+        try:
+            await self.run_blocking(self.sandbox.process.delete_session, session_id)
+        except Exception as e:
+            print(f"Warning: Failed to kill session {session_id}: {str(e)}")
+
+    @execution_traits(exclusive_resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -104,7 +118,17 @@ class SandboxShellTool(SandboxToolsBase):
         folder: Optional[str] = None,
         session_name: str = "default",
         timeout: int = 60
-    ) -> ToolResult:
+    ) -> AsyncGenerator[Union[ToolProgress, ToolResult], None]:
+        """Run a command in a session and stream its output while it runs.
+
+        The command is started in the background and polled until it exits or
+        the timeout passes; a timed out or stopped command is killed by deleting
+        its session.
+
+        Yields:
+            ToolProgress with each new part of the command's output, then a
+            ToolResult with the whole output and exit code
+        """
         try:
             # Ensure session exists
             session_id = await self._ensure_session(session_name)
@@ -122,36 +146,71 @@ class SandboxShellTool(SandboxToolsBase):
             from sandbox.sandbox import SessionExecuteRequest
             req = SessionExecuteRequest(
                 command=command,
-                var_async=False,
+                var_async=True,
                 cwd=cwd  # Still set the working directory for reference
             )
             
-            response = self.sandbox.process.execute_session_command(
-                session_id=session_id,
-                req=req,
-                timeout=timeout
-            )
-            
-            # Get detailed logs
-            logs = self.sandbox.process.get_session_command_logs(
-                session_id=session_id,
-                command_id=response.cmd_id
-            )
+            # Run the blocking sandbox calls in a thread so they do not block the event loop
+            deadline = time.monotonic() + timeout
+            logs = ""
+            try:
+                response = await self.run_blocking(
+                    self.sandbox.process.execute_session_command,
+                    session_id=session_id,
+                    req=req
+                )
+                while True:
+                    # The exit code is read before the logs, so the logs of a finished command are complete
+                    command_info = await self.run_blocking(
+                        self.sandbox.process.get_session_command,
+                        session_id=session_id,
+                        command_id=response.cmd_id
+                    )
+                    current_logs = await self.run_blocking(
+                        self.sandbox.process.get_session_command_logs,
+                        session_id=session_id,
+                        command_id=response.cmd_id
+                    ) or ""
+                    if len(current_logs) > len(logs):
+                        yield self.progress(current_logs[len(logs):])
+                        logs = current_logs
+                    if command_info.exit_code is not None:
+                        break
+                    if time.monotonic() >= deadline:
+                        self._kill_command(session_name, session_id)
+                        break
+                    await asyncio.sleep(COMMAND_POLL_INTERVAL)
+            except (asyncio.CancelledError, GeneratorExit):
+                # Stopped while the command runs; deleting the session kills it
+                self._kill_command(session_name, session_id)
+                raise
             
-            if response.exit_code == 0:
-                return self.success_response({
+            if command_info.exit_code is None:
+                error_msg = f"Command timed out after {timeout} seconds"
+                if logs:
+                    error_msg += f": {logs}"
+                yield self.fail_response(error_msg)
+            elif command_info.exit_code == 0:
+                yield self.success_response({
                     "output": logs,
-                    "exit_code": response.exit_code,
+                    "exit_code": command_info.exit_code,
                     "cwd": cwd
                 })
             else:
-                error_msg = f"Command failed with exit code {response.exit_code}"
+                error_msg = f"Command failed with exit code {command_info.exit_code}"
                 if logs:
                     error_msg += f": {logs}"
-                return self.fail_response(error_msg)
+                yield self.fail_response(error_msg)
                 
         except Exception as e:
-            return self.fail_response(f"Error executing command: {str(e)}")
+            yield self.fail_response(f"Error executing command: {str(e)}")
+
+    def _kill_command(self, session_name: str, session_id: str) -> None:
+        """Kill a running command by deleting its session in the background."""
+        self._sessions.pop(session_name, None)
+        kill_task = asyncio.ensure_future(self._kill_session(session_id))
+        self._kill_tasks.add(kill_task)
+        kill_task.add_done_callback(self._kill_tasks.discard)
 
     async def cleanup(self):
         """Clean up all sessions."""
@@ -4,7 +4,7 @@ from typing import List, Optional
 from datetime import datetime
 import os
 from dotenv import load_dotenv
-from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
+from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, execution_traits
 
 # TODO: add subpages, etc... in filters as sometimes its necessary 
 
@@ -23,6 +23,7 @@ class WebSearchTool(Tool):
         # Tavily asynchronous search client
         self.tavily_client = AsyncTavilyClient(api_key=self.api_key)
 
+    @execution_traits(read_only=True)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -52,6 +53,8 @@ class WebSearchTool(Tool):
     })
     @xml_schema(
         tag_name="web-search",
+        timeout=60,
+        max_concurrency=10,
         mappings=[
             {"param_name": "query", "node_type": "attribute", "path": "."},
             {"param_name": "summary", "node_type": "attribute", "path": "."},
@@ -168,6 +171,7 @@ class WebSearchTool(Tool):
                 simplified_message += "..."
             return self.fail_response(simplified_message)
 
+    @execution_traits(read_only=True)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -187,6 +191,8 @@ class WebSearchTool(Tool):
     })
     @xml_schema(
         tag_name="crawl-webpage",
+        timeout=120,
+        max_concurrency=5,
         mappings=[
             {"param_name": "url", "node_type": "attribute", "path": "."}
         ],
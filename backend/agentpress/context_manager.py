@@ -2,13 +2,22 @@
 Context Management for AgentPress Threads.
 
 This module handles token counting and thread summarization to prevent
-reaching the context window limitations of LLM models.
+reaching the context window limitations of LLM models. Threads approaching
+the threshold are summarized in the background while the agent keeps running,
+so the summary is usually in place before the threshold is reached. Long
+histories are summarized map-reduce style in token-bounded segments, or
+offline by an extractive summarizer when configured.
 """
 
+import asyncio
+import hashlib
 import json
+from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
 from litellm import token_counter, completion, completion_cost
+from agentpress.summarizers import Summarizer, create_summarizer
+from agentpress.token_counting import count_message_tokens, count_prompt_tokens, message_digest
 from services.supabase import DBConnection
 from services.llm import make_llm_api_call
 from utils.logger import logger
@@ -17,24 +26,90 @@ from utils.logger import logger
 DEFAULT_TOKEN_THRESHOLD = 120000  # 80k tokens threshold for summarization
 SUMMARY_TARGET_TOKENS = 10000    # Target ~10k tokens for the summary message
 RESERVE_TOKENS = 5000            # Reserve tokens for new messages
+PROACTIVE_SUMMARY_RATIO = 0.7    # Share of the threshold at which a background summary starts
+SUMMARY_SEGMENT_TOKENS = 40000   # Histories above this are summarized in segments of this size
+SEGMENT_SUMMARY_TARGET_TOKENS = 2000  # Target size of each segment summary
+SUMMARY_MAX_PARALLEL_SEGMENTS = 4     # Segments summarized at once
+
+SUMMARY_PROMPT = """You are a specialized summarization assistant. Your task is to create a concise but comprehensive summary of the conversation history.
+
+The summary should:
+1. Preserve all key information including decisions, conclusions, and important context
+2. Include any tools that were used and their results
+3. Maintain chronological order of events
+4. Be presented as a narrated list of key points with section headers
+5. Include only factual information from the conversation (no new information)
+6. Be concise but detailed enough that the conversation can continue with this summary as context
+
+VERY IMPORTANT: This summary will replace older parts of the conversation in the LLM's context window, so ensure it contains ALL key information and LATEST STATE OF THE CONVERSATION - SO WE WILL KNOW HOW TO PICK UP WHERE WE LEFT OFF.
+
+
+THE CONVERSATION HISTORY TO SUMMARIZE IS AS FOLLOWS:
+===============================================================
+==================== CONVERSATION HISTORY ====================
+{history}
+==================== END OF CONVERSATION HISTORY ====================
+===============================================================
+"""
+
+SEGMENT_SUMMARY_PROMPT = """You are a specialized summarization assistant. Below is part {index} of {count} of a long conversation history, in chronological order.
+
+Summarize this part only:
+1. Preserve decisions, conclusions, tool calls and their results, file paths, URLs and errors
+2. Maintain chronological order of events
+3. Include only factual information from this part (no new information)
+4. Note the state things were left in at the end of this part
+
+==================== CONVERSATION HISTORY (PART {index} OF {count}) ====================
+{history}
+==================== END OF PART {index} ====================
+"""
+
+REDUCE_SUMMARY_PROMPT = """You are a specialized summarization assistant. Below are summaries of consecutive parts of one conversation, in chronological order.
+
+Merge them into a single summary that:
+1. Preserves all key information including decisions, conclusions, and important context
+2. Includes any tools that were used and their results
+3. Maintains chronological order of events
+4. Is presented as a narrated list of key points with section headers
+5. Makes the LATEST STATE OF THE CONVERSATION clear, so we will know how to pick up where we left off
+
+==================== PART SUMMARIES ====================
+{summaries}
+==================== END OF PART SUMMARIES ====================
+"""
 
 class ContextManager:
     """Manages thread context including token counting and summarization."""
     
-    def __init__(self, token_threshold: int = DEFAULT_TOKEN_THRESHOLD):
+    def __init__(
+        self,
+        token_threshold: int = DEFAULT_TOKEN_THRESHOLD,
+        proactive_ratio: float = PROACTIVE_SUMMARY_RATIO,
+        summarizer_backend: Optional[str] = None
+    ):
         """Initialize the ContextManager.
         
         Args:
             token_threshold: Token count threshold to trigger summarization
+            proactive_ratio: Share of the threshold at which a background summary starts
+            summarizer_backend: "llm", "extractive" or "tiered"; read from CONTEXT_SUMMARIZER_BACKEND if omitted
         """
         self.db = DBConnection()
         self.token_threshold = token_threshold
+        self.proactive_threshold = int(token_threshold * proactive_ratio)
+        self._background_summaries: Dict[str, asyncio.Task] = {} # thread_id -> running summary task
+        self.summarizer: Summarizer = create_summarizer(self.summarize_with_llm, summarizer_backend)
     
-    async def get_thread_token_count(self, thread_id: str) -> int:
+    async def get_thread_token_count(self, thread_id: str, model: str = "gpt-4") -> int:
         """Get the current token count for a thread using LiteLLM.
         
+        Per-message counts are memoized, so only messages not counted before
+        are tokenized (in a worker thread for large batches).
+        
         Args:
             thread_id: ID of the thread to analyze
+            model: Model whose tokenizer is used
             
         Returns:
             The total token count for relevant messages in the thread
@@ -51,7 +126,7 @@ class ContextManager:
             
             # Use litellm's token_counter for accurate model-specific counting
             # This is much more accurate than the SQL-based estimation
-            token_count = token_counter(model="gpt-4", messages=messages)
+            token_count = await count_prompt_tokens(model, messages)
             
             logger.info(f"Thread {thread_id} has {token_count} tokens (calculated with litellm)")
             return token_count
@@ -147,6 +222,9 @@ class ContextManager:
     ) -> Optional[Dict[str, Any]]:
         """Generate a summary of conversation messages.
         
+        The summary text comes from the configured summarizer backend (see
+        agentpress.summarizers); by default that is summarize_with_llm.
+        
         Args:
             thread_id: ID of the thread to summarize
             messages: Messages to summarize
@@ -159,79 +237,206 @@ class ContextManager:
             logger.warning("No messages to summarize")
             return None
         
-        logger.info(f"Creating summary for thread {thread_id} with {len(messages)} messages")
+        logger.info(f"Creating summary for thread {thread_id} with {len(messages)} messages ({self.summarizer.name} summarizer)")
         
-        # Create system message with summarization instructions
-        system_message = {
-            "role": "system",
-            "content": f"""You are a specialized summarization assistant. Your task is to create a concise but comprehensive summary of the conversation history.
-
-The summary should:
-1. Preserve all key information including decisions, conclusions, and important context
-2. Include any tools that were used and their results
-3. Maintain chronological order of events
-4. Be presented as a narrated list of key points with section headers
-5. Include only factual information from the conversation (no new information)
-6. Be concise but detailed enough that the conversation can continue with this summary as context
+        summary_content = await self.summarizer.summarize(thread_id, messages, model, SUMMARY_TARGET_TOKENS)
+        
+        if not summary_content:
+            logger.error("Failed to generate summary: Invalid response")
+            return None
+        
+        # Format the summary message with clear beginning and end markers
+        formatted_summary = f"""
+======== CONVERSATION HISTORY SUMMARY ========
 
-VERY IMPORTANT: This summary will replace older parts of the conversation in the LLM's context window, so ensure it contains ALL key information and LATEST STATE OF THE CONVERSATION - SO WE WILL KNOW HOW TO PICK UP WHERE WE LEFT OFF.
+{summary_content}
 
+======== END OF SUMMARY ========
 
-THE CONVERSATION HISTORY TO SUMMARIZE IS AS FOLLOWS:
-===============================================================
-==================== CONVERSATION HISTORY ====================
-{messages}
-==================== END OF CONVERSATION HISTORY ====================
-===============================================================
+The above is a summary of the conversation history. The conversation continues below.
 """
+        
+        # Format the summary message
+        summary_message = {
+            "role": "user",
+            "content": formatted_summary
         }
         
+        return summary_message
+    
+    async def summarize_with_llm(self, thread_id: str, messages: List[Dict[str, Any]], model: str) -> Optional[str]:
+        """Summarize messages with the LLM and return the summary text.
+        
+        Histories longer than SUMMARY_SEGMENT_TOKENS are summarized map-reduce
+        style: the messages are split into token-bounded segments, the segments
+        are summarized concurrently, and the partial summaries are merged. Segment
+        summaries are persisted, so a later summary over the same messages (e.g.
+        after a failed merge) reuses them.
+        
+        Args:
+            thread_id: ID of the thread to summarize
+            messages: Messages to summarize
+            model: LLM model to use for summarization
+            
+        Returns:
+            Summary text or None if summarization failed
+        """
+        segments = await self._split_into_segments(messages, model)
+        if len(segments) == 1:
+            return await self._call_summarizer(SUMMARY_PROMPT.format(history=messages), model, SUMMARY_TARGET_TOKENS)
+        
+        logger.info(f"Summarizing {len(messages)} messages of thread {thread_id} in {len(segments)} segments")
+        partial_summaries = await self._summarize_segments(thread_id, segments, model)
+        return await self._reduce_summaries(partial_summaries, model) if partial_summaries else None
+    
+    async def _call_summarizer(self, system_content: str, model: str, max_tokens: int) -> Optional[str]:
+        """Make one summarization call and return the summary text, or None on failure."""
         try:
             # Call LLM to generate summary
             response = await make_llm_api_call(
                 model_name=model,
-                messages=[system_message, {"role": "user", "content": "PLEASE PROVIDE THE SUMMARY NOW."}],
+                messages=[{"role": "system", "content": system_content}, {"role": "user", "content": "PLEASE PROVIDE THE SUMMARY NOW."}],
                 temperature=0,
-                max_tokens=SUMMARY_TARGET_TOKENS,
+                max_tokens=max_tokens,
                 stream=False
             )
             
-            if response and hasattr(response, 'choices') and response.choices:
-                summary_content = response.choices[0].message.content
-                
-                # Track token usage
-                try:
-                    token_count = token_counter(model=model, messages=[{"role": "user", "content": summary_content}])
-                    cost = completion_cost(model=model, prompt="", completion=summary_content)
-                    logger.info(f"Summary generated with {token_count} tokens at cost ${cost:.6f}")
-                except Exception as e:
-                    logger.error(f"Error calculating token usage: {str(e)}")
-                
-                # Format the summary message with clear beginning and end markers
-                formatted_summary = f"""
-======== CONVERSATION HISTORY SUMMARY ========
-
-{summary_content}
-
-======== END OF SUMMARY ========
-
-The above is a summary of the conversation history. The conversation continues below.
-"""
-                
-                # Format the summary message
-                summary_message = {
-                    "role": "user",
-                    "content": formatted_summary
-                }
-                
-                return summary_message
-            else:
-                logger.error("Failed to generate summary: Invalid response")
+            if not (response and hasattr(response, 'choices') and response.choices):
+                logger.error("Summarization call returned an invalid response")
                 return None
+            summary_content = response.choices[0].message.content
+            
+            # Track token usage
+            try:
+                token_count = token_counter(model=model, messages=[{"role": "user", "content": summary_content}])
+                cost = completion_cost(model=model, prompt="", completion=summary_content)
+                logger.info(f"Summary generated with {token_count} tokens at cost ${cost:.6f}")
+            except Exception as e:
+                logger.error(f"Error calculating token usage: {str(e)}")
+            
+            return summary_content
                 
         except Exception as e:
             logger.error(f"Error creating summary: {str(e)}", exc_info=True)
             return None
+    
+    async def _split_into_segments(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        max_tokens: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Split messages into consecutive segments of at most max_tokens each.
+        
+        The split is greedy from the first message, so the complete segments of a
+        history stay the same as messages are appended and their persisted
+        summaries can be reused. A single message larger than the budget forms
+        its own segment.
+        """
+        max_tokens = max_tokens or SUMMARY_SEGMENT_TOKENS
+        counts = await count_message_tokens(model, messages)
+        segments: List[List[Dict[str, Any]]] = []
+        current: List[Dict[str, Any]] = []
+        current_tokens = 0
+        for message, count in zip(messages, counts):
+            if current and current_tokens + count > max_tokens:
+                segments.append(current)
+                current, current_tokens = [], 0
+            current.append(message)
+            current_tokens += count
+        if current:
+            segments.append(current)
+        return segments
+    
+    async def _summarize_segments(
+        self,
+        thread_id: str,
+        segments: List[List[Dict[str, Any]]],
+        model: str
+    ) -> Optional[List[str]]:
+        """Summarize segments concurrently (bounded), reusing persisted segment summaries.
+        
+        Returns:
+            Summaries in segment order, or None if a segment could not be summarized
+        """
+        persisted = await self._load_segment_summaries(thread_id)
+        semaphore = asyncio.Semaphore(SUMMARY_MAX_PARALLEL_SEGMENTS)
+        
+        async def summarize(index: int, segment: List[Dict[str, Any]]) -> Optional[str]:
+            segment_key = hashlib.sha1("".join(message_digest(message) for message in segment).encode('utf-8')).hexdigest()
+            if segment_key in persisted:
+                logger.debug(f"Reusing persisted summary of segment {index + 1}/{len(segments)} of thread {thread_id}")
+                return persisted[segment_key]
+            async with semaphore:
+                prompt = SEGMENT_SUMMARY_PROMPT.format(index=index + 1, count=len(segments), history=segment)
+                summary = await self._call_summarizer(prompt, model, SEGMENT_SUMMARY_TARGET_TOKENS)
+            if summary:
+                await self._save_segment_summary(thread_id, segment_key, summary, len(segment))
+            return summary
+        
+        summaries = await asyncio.gather(*(summarize(index, segment) for index, segment in enumerate(segments)))
+        if not all(summaries):
+            logger.error(f"Failed to summarize {summaries.count(None)} of {len(segments)} segments of thread {thread_id}")
+            return None
+        return list(summaries)
+    
+    async def _reduce_summaries(self, summaries: List[str], model: str) -> Optional[str]:
+        """Merge partial summaries into one, in several rounds if they exceed a segment."""
+        while len(summaries) > 1:
+            groups = await self._split_into_segments(
+                [{"role": "user", "content": summary} for summary in summaries], model
+            )
+            if len(groups) == len(summaries):
+                # Every summary fills a segment on its own; merge them in pairs to make progress
+                groups = [sum(groups[i:i + 2], []) for i in range(0, len(groups), 2)]
+            merged = await asyncio.gather(*(
+                self._call_summarizer(
+                    REDUCE_SUMMARY_PROMPT.format(summaries="\n\n".join(message["content"] for message in group)),
+                    model,
+                    SUMMARY_TARGET_TOKENS
+                )
+                for group in groups
+            ))
+            if not all(merged):
+                return None
+            summaries = list(merged)
+        return summaries[0]
+    
+    async def _load_segment_summaries(self, thread_id: str) -> Dict[str, str]:
+        """Load the persisted segment summaries of a thread, keyed by segment digest."""
+        try:
+            client = await self.db.client
+            result = await client.table('messages').select('content, metadata') \
+                .eq('thread_id', thread_id) \
+                .eq('type', 'summary_segment') \
+                .execute()
+        except Exception as e:
+            logger.warning(f"Failed to load segment summaries of thread {thread_id}: {str(e)}")
+            return {}
+        
+        summaries = {}
+        for row in result.data or []:
+            try:
+                content = json.loads(row['content']) if isinstance(row['content'], str) else row['content']
+                metadata = json.loads(row['metadata']) if isinstance(row['metadata'], str) else row['metadata']
+                summaries[metadata['segment_key']] = content['summary']
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+        return summaries
+    
+    async def _save_segment_summary(self, thread_id: str, segment_key: str, summary: str, message_count: int) -> None:
+        """Persist a segment summary as a non-LLM summary_segment message."""
+        try:
+            client = await self.db.client
+            await client.table('messages').insert({
+                'thread_id': thread_id,
+                'type': 'summary_segment',
+                'content': json.dumps({"summary": summary}),
+                'is_llm_message': False, # Building block of summaries, never sent to the LLM
+                'metadata': json.dumps({"segment_key": segment_key, "message_count": message_count}),
+            }).execute()
+        except Exception as e:
+            logger.warning(f"Failed to persist segment summary of thread {thread_id}: {str(e)}")
         
     async def check_and_summarize_if_needed(
         self, 
@@ -253,7 +458,7 @@ The above is a summary of the conversation history. The conversation continues b
         """
         try:
             # Get token count using LiteLLM (accurate model-specific counting)
-            token_count = await self.get_thread_token_count(thread_id)
+            token_count = await self.get_thread_token_count(thread_id, model)
             
             # If token count is below threshold and not forcing, no summarization needed
             if token_count < self.token_threshold and not force:
@@ -295,4 +500,92 @@ The above is a summary of the conversation history. The conversation continues b
                 
         except Exception as e:
             logger.error(f"Error in check_and_summarize_if_needed: {str(e)}", exc_info=True)
-            return False 
\ No newline at end of file
+            return False 
+
+    def start_background_summary(
+        self,
+        thread_id: str,
+        messages: List[Dict[str, Any]],
+        summarized_until: datetime,
+        add_message_callback,
+        model: str = "gpt-4o-mini",
+        token_count: Optional[int] = None
+    ) -> bool:
+        """Start summarizing a thread in the background while the agent keeps running.
+        
+        The summary covers the given messages and is inserted with a created_at
+        just after summarized_until, so it replaces exactly those messages while
+        messages added during summarization stay in context. The insert is a
+        single row, so readers see either the old context or the summarized one.
+        
+        Args:
+            thread_id: ID of the thread to summarize
+            messages: The thread's current LLM messages (starting at its latest summary)
+            summarized_until: created_at of the newest of these messages
+            add_message_callback: Callback to add the summary message to the thread
+            model: LLM model to use for summarization
+            token_count: Token count of the thread, stored with the summary
+            
+        Returns:
+            True if a summary was started, False if one is already running or too few messages
+        """
+        if thread_id in self._background_summaries:
+            return False
+        if len(messages) < 3:
+            logger.debug(f"Thread {thread_id} has too few messages ({len(messages)}) to summarize in the background")
+            return False
+        
+        logger.info(f"Thread {thread_id} passed the proactive threshold ({token_count} >= {self.proactive_threshold}), summarizing in the background")
+        task = asyncio.create_task(self._summarize_in_background(
+            thread_id, messages, summarized_until, add_message_callback, model, token_count
+        ))
+        self._background_summaries[thread_id] = task
+        
+        def _forget(finished: asyncio.Task) -> None:
+            if self._background_summaries.get(thread_id) is finished:
+                del self._background_summaries[thread_id]
+        task.add_done_callback(_forget)
+        return True
+    
+    async def wait_for_background_summary(self, thread_id: str) -> Optional[bool]:
+        """Wait for a running background summary of a thread.
+        
+        Returns:
+            Whether the summary was installed, or None if no summary is running
+        """
+        task = self._background_summaries.get(thread_id)
+        if task is None:
+            return None
+        logger.info(f"Waiting for the background summary of thread {thread_id}")
+        # Shielded: a cancelled run must not abort a summary other runs will use
+        return await asyncio.shield(task)
+    
+    async def _summarize_in_background(
+        self,
+        thread_id: str,
+        messages: List[Dict[str, Any]],
+        summarized_until: datetime,
+        add_message_callback,
+        model: str,
+        token_count: Optional[int]
+    ) -> bool:
+        """Create a summary of messages and install it right after the last of them."""
+        try:
+            summary = await self.create_summary(thread_id, messages, model)
+            if not summary:
+                logger.error(f"Failed to create background summary for thread {thread_id}")
+                return False
+            
+            await add_message_callback(
+                thread_id=thread_id,
+                type="summary",
+                content=summary,
+                is_llm_message=True,
+                metadata={"token_count": token_count, "summarized_until": summarized_until.isoformat()},
+                created_at=(summarized_until + timedelta(microseconds=1)).isoformat()
+            )
+            logger.info(f"Installed background summary of {len(messages)} messages in thread {thread_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error in background summary of thread {thread_id}: {str(e)}", exc_info=True)
+            return False
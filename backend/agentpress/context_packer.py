@@ -0,0 +1,181 @@
+"""
+Deterministic, LLM-free packing of thread messages into a token budget.
+
+Summarization shrinks context with an extra LLM call. The packer instead fits
+the messages of one call into the model's budget by policy, in this order,
+oldest messages first, until the budget is met:
+- Results of browser actions superseded by a later browser action become stubs
+- Large tool results outside the recent turns are cut to their head and tail
+- Tool results outside the recent turns become short stubs
+The last turns are always kept verbatim. Messages within budget are returned
+unchanged, so the common case costs one pass over memoized token counts and
+keeps prompt cache prefixes stable.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from agentpress.token_counting import count_message_tokens
+from utils.logger import logger
+
+# Tool result messages as added by ResponseProcessor._add_tool_result
+_XML_TOOL_RESULT = re.compile(r"^\s*<tool_result>\s*<([\w\-]+)>")
+_TOOL_SUCCESS = re.compile(r"ToolResult\(success=(True|False)")
+
+# XML tags of browser tools; each action replaces the browser state of the previous one
+BROWSER_TOOL_PREFIX = "browser-"
+
+
+@dataclass(frozen=True)
+class PackingPolicy:
+    """How the packer shrinks messages.
+
+    Attributes:
+        keep_recent_turns (int): Assistant turns, with the messages after them, kept verbatim
+        truncate_above_chars (int): Tool results longer than this are cut to head and tail
+        head_chars (int): Characters kept from the start of a truncated tool result
+        tail_chars (int): Characters kept from the end of a truncated tool result
+        stub_above_chars (int): Tool results up to this long are not worth masking
+    """
+    keep_recent_turns: int = 4
+    truncate_above_chars: int = 4000
+    head_chars: int = 1500
+    tail_chars: int = 1000
+    stub_above_chars: int = 300
+
+
+@dataclass
+class PackedContext:
+    """Result of packing messages into a budget.
+
+    Attributes:
+        messages (List[Dict[str, Any]]): Messages to send; unchanged messages are the caller's objects
+        tokens_before (int): Tokens of the messages before packing
+        tokens_after (int): Tokens of the packed messages
+        actions (Dict[str, int]): Number of messages changed per policy step
+    """
+    messages: List[Dict[str, Any]]
+    tokens_before: int
+    tokens_after: int
+    actions: Dict[str, int] = field(default_factory=dict)
+
+
+def tool_result_tag(message: Dict[str, Any]) -> Optional[str]:
+    """Return the tool name of a tool result message, or None for other messages."""
+    content = message.get('content')
+    if not isinstance(content, str):
+        return None
+    if message.get('role') == 'tool':
+        return message.get('name') or 'tool'
+    if message.get('role') == 'user':
+        match = _XML_TOOL_RESULT.match(content)
+        if match:
+            return match.group(1)
+        if content.startswith("Result for "):
+            return content[len("Result for "):].split(":", 1)[0]
+    return None
+
+
+def _replace_output(message: Dict[str, Any], tag: str, output: str) -> Dict[str, Any]:
+    """Return a copy of a tool result message with its output replaced."""
+    content = message['content']
+    success = _TOOL_SUCCESS.search(content)
+    result = f"ToolResult(success={success.group(1)}, output={output!r})" if success else output
+    if message.get('role') == 'tool':
+        return {**message, 'content': output}
+    if _XML_TOOL_RESULT.match(content):
+        return {**message, 'content': f"<tool_result> <{tag}> {result} </{tag}> </tool_result>"}
+    return {**message, 'content': f"Result for {tag}: {result}"}
+
+
+def stub_tool_result(message: Dict[str, Any], tag: str, reason: str, omitted_chars: int) -> Dict[str, Any]:
+    """Replace the output of a tool result message with a short note."""
+    return _replace_output(message, tag, f"[{omitted_chars} characters omitted: {reason}]")
+
+
+def truncate_tool_result(message: Dict[str, Any], policy: PackingPolicy) -> Dict[str, Any]:
+    """Keep the head and tail of a long message's content."""
+    content = message['content']
+    omitted = len(content) - policy.head_chars - policy.tail_chars
+    return {
+        **message,
+        'content': f"{content[:policy.head_chars]}\n... [{omitted} characters omitted] ...\n{content[-policy.tail_chars:]}"
+    }
+
+
+def _recent_turns_start(messages: List[Dict[str, Any]], keep_recent_turns: int) -> int:
+    """Index of the first message of the last keep_recent_turns assistant turns."""
+    if keep_recent_turns <= 0:
+        return len(messages)
+    seen = 0
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].get('role') == 'assistant':
+            seen += 1
+            if seen == keep_recent_turns:
+                return index
+    return 0
+
+
+async def pack_messages(
+    messages: List[Dict[str, Any]],
+    model: str,
+    budget: int,
+    policy: PackingPolicy = PackingPolicy()
+) -> PackedContext:
+    """Fit messages into a token budget without calling an LLM.
+
+    Args:
+        messages: Thread messages of the call (without the system prompt); not modified
+        model: Model whose tokenizer measures the budget
+        budget: Tokens the messages may use
+        policy: How messages are shrunk
+
+    Returns:
+        The packed messages and what was done to them
+    """
+    counts = await count_message_tokens(model, messages)
+    tokens_before = total = sum(counts)
+    if total <= budget:
+        return PackedContext(messages, tokens_before, total)
+
+    packed = list(messages)
+    actions: Dict[str, int] = {}
+    protected_from = _recent_turns_start(packed, policy.keep_recent_turns)
+    tool_results = [(index, tag) for index, tag in ((i, tool_result_tag(m)) for i, m in enumerate(packed)) if tag]
+
+    async def replace(index: int, message: Dict[str, Any], action: str) -> None:
+        nonlocal total
+        new_count = (await count_message_tokens(model, [message]))[0]
+        total += new_count - counts[index]
+        counts[index] = new_count
+        packed[index] = message
+        actions[action] = actions.get(action, 0) + 1
+
+    # 1. Browser results superseded by a later browser action
+    browser_results = [(index, tag) for index, tag in tool_results if tag.startswith(BROWSER_TOOL_PREFIX)]
+    for index, tag in browser_results[:-1]:
+        if total <= budget or index >= protected_from:
+            break
+        original_chars = len(messages[index]['content'])
+        await replace(index, stub_tool_result(packed[index], tag, "superseded by a later browser action", original_chars), "superseded_browser_results")
+
+    # 2. Large tool results outside the recent turns, cut to head and tail
+    for index, tag in tool_results:
+        if total <= budget or index >= protected_from:
+            break
+        if packed[index] is messages[index] and len(packed[index]['content']) > policy.truncate_above_chars:
+            await replace(index, truncate_tool_result(packed[index], policy), "truncated_tool_results")
+
+    # 3. Tool results outside the recent turns, masked to stubs
+    for index, tag in tool_results:
+        if total <= budget or index >= protected_from:
+            break
+        original_chars = len(messages[index]['content'])
+        if original_chars > policy.stub_above_chars and "characters omitted: " not in packed[index]['content']:
+            await replace(index, stub_tool_result(packed[index], tag, "older tool output", original_chars), "masked_tool_results")
+
+    if total > budget:
+        logger.warning(f"Packed context still has {total} tokens, over the budget of {budget}")
+    logger.info(f"Packed context from {tokens_before} to {total} tokens (budget {budget}): {actions}")
+    return PackedContext(packed, tokens_before, total, actions)
@@ -0,0 +1,122 @@
+"""
+Incremental assembly of streamed JSON tool-call arguments.
+
+Native function calls arrive as argument fragments spread over many deltas.
+This module tracks the structure of the growing argument string so that:
+- Completion of the top-level JSON value is detected without reparsing
+- Each fragment is inspected exactly once (string, escape and depth state carry over)
+- The argument string is joined and parsed a single time, once complete
+"""
+
+import json
+import re
+from typing import Any, List, Optional
+
+# Characters that change state outside of / inside of a JSON string
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+_STRING_SPECIAL = re.compile(r'[\\"]')
+
+
+class JSONStreamAssembler:
+    """Tracks one streamed JSON value and reports when it has closed.
+
+    Only the characters that change structural state are visited: quotes,
+    backslashes inside strings, and brackets/braces outside of strings.
+    Scalar top-level values (numbers, true/false/null) are never reported
+    complete; they can only be parsed once the stream has ended.
+
+    Attributes:
+        complete (bool): Whether the top-level JSON value has been closed
+    """
+
+    def __init__(self):
+        """Initialize an empty assembler."""
+        self._parts: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+        self.complete = False
+        self._parsed: Any = None
+        self._parse_attempted = False
+
+    def feed(self, fragment: str) -> bool:
+        """Consume an argument fragment.
+
+        Args:
+            fragment: Newly received part of the argument string
+
+        Returns:
+            True if the JSON value is complete after this fragment
+        """
+        if not fragment:
+            return self.complete
+        self._parts.append(fragment)
+        self._parse_attempted = False
+        if self.complete:
+            # Trailing data after the value; kept so that parsing reports the error
+            return True
+
+        if not self._started and fragment.strip():
+            self._started = True
+
+        pos = 0
+        while True:
+            if self._in_string:
+                if self._escaped:
+                    # The escaped character may be the first one of this fragment
+                    if pos >= len(fragment):
+                        break
+                    self._escaped = False
+                    pos += 1
+                    continue
+                match = _STRING_SPECIAL.search(fragment, pos)
+                if not match:
+                    break
+                pos = match.end()
+                if match.group(0) == '\\':
+                    self._escaped = True
+                    continue
+                self._in_string = False
+                if self._depth == 0:
+                    # Top-level string value
+                    self.complete = True
+                    break
+            else:
+                match = _STRUCTURAL.search(fragment, pos)
+                if not match:
+                    break
+                pos = match.end()
+                char = match.group(0)
+                if char == '"':
+                    self._in_string = True
+                elif char in '{[':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth <= 0:
+                        self.complete = True
+                        break
+
+        return self.complete
+
+    @property
+    def text(self) -> str:
+        """The argument string received so far."""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def parse(self) -> Optional[Any]:
+        """Parse the assembled value once and cache the result.
+
+        Returns:
+            The parsed JSON value, or None if it is incomplete or invalid
+        """
+        if not self._parse_attempted:
+            self._parse_attempted = True
+            try:
+                self._parsed = json.loads(self.text) if self._started else None
+            except json.JSONDecodeError:
+                self._parsed = None
+        return self._parsed
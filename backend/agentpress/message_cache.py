@@ -0,0 +1,303 @@
+"""
+In-process cache of the LLM messages of recently used threads.
+
+Reading a thread's LLM context from the database re-aggregates the whole
+thread on every call. This module keeps the normalized messages per thread:
+- Rows written through ThreadManager.add_message are appended directly
+- Reads only fetch rows newer than the cache's high-water mark (the delta)
+- A summary message drops everything before it, as the database read does
+- Token counts per message and model are kept with the messages, so the thread
+  total is a running sum instead of a recount
+- Threads are evicted least-recently-used once a thread or byte budget is exceeded
+"""
+
+import bisect
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.logger import logger
+
+# Defaults for the cache budget
+DEFAULT_MAX_THREADS = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # Estimated size of the cached message JSON
+
+# Rows up to this much older than the high-water mark are re-read by delta fetches,
+# so rows committed late by other writers (or with skewed clocks) are not missed
+DELTA_FETCH_OVERLAP = timedelta(seconds=5)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse a created_at value as returned by the database or the write-behind queue."""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def to_llm_message(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Convert a messages row into the message sent to the LLM.
+
+    Content stored as a JSON string is parsed, and tool_call arguments are
+    normalized to strings, as for the get_llm_formatted_messages RPC.
+
+    Args:
+        row: Row of the messages table
+
+    Returns:
+        The LLM message, or None if the content cannot be parsed
+    """
+    message = row.get('content')
+    if isinstance(message, str):
+        try:
+            message = json.loads(message)
+        except json.JSONDecodeError:
+            logger.error(f"Failed to parse message: {message}")
+            return None
+    if not isinstance(message, dict):
+        return message
+
+    if message.get('tool_calls'):
+        for tool_call in message['tool_calls']:
+            if isinstance(tool_call, dict) and 'function' in tool_call:
+                # Ensure function.arguments is a string
+                if 'arguments' in tool_call['function'] and not isinstance(tool_call['function']['arguments'], str):
+                    tool_call['function']['arguments'] = json.dumps(tool_call['function']['arguments'])
+    return message
+
+
+def stored_token_counts(row: Dict[str, Any]) -> Dict[str, int]:
+    """Read the per-model token counts stored in a row's metadata, if any."""
+    metadata = row.get('metadata')
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            return {}
+    counts = metadata.get('token_counts') if isinstance(metadata, dict) else None
+    return dict(counts) if isinstance(counts, dict) else {}
+
+
+@dataclass
+class _CachedThread:
+    """Messages of one thread, ordered by created_at."""
+    keys: List[Tuple[datetime, str]] = field(default_factory=list)  # (created_at, message_id), sorted
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    sizes: List[int] = field(default_factory=list)
+    token_counts: List[Dict[str, int]] = field(default_factory=list)  # model -> tokens, per message
+    token_totals: Dict[str, int] = field(default_factory=dict)  # model -> tokens of the counted messages
+    counted: Dict[str, int] = field(default_factory=dict)  # model -> number of counted messages
+    message_ids: set = field(default_factory=set)  # Ids of the cached messages, for deduplication
+    summary_key: Optional[Tuple[datetime, str]] = None  # Latest summary; older rows are not in context
+    high_water_mark: Optional[datetime] = None
+    size_bytes: int = 0
+
+
+class ThreadMessageCache:
+    """Bounded LRU cache of normalized LLM messages per thread.
+
+    Messages are kept in created_at order; rows arriving out of order (late
+    commits found by a delta fetch) are inserted at their position. Rows seen
+    twice, once from add_message and once from a delta fetch, are deduplicated
+    by message_id.
+
+    Attributes:
+        max_threads (int): Number of threads kept before the least recently used is evicted
+        max_bytes (int): Estimated total message size kept before threads are evicted
+    """
+
+    def __init__(self, max_threads: int = DEFAULT_MAX_THREADS, max_bytes: int = DEFAULT_MAX_BYTES):
+        """Initialize an empty cache.
+
+        Args:
+            max_threads: Number of threads kept before the least recently used is evicted
+            max_bytes: Estimated total message size kept before threads are evicted
+        """
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self._threads: "OrderedDict[str, _CachedThread]" = OrderedDict()
+        self._size_bytes = 0
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._threads
+
+    def delta_since(self, thread_id: str) -> Optional[str]:
+        """Return the created_at value a delta fetch for the thread should start from.
+
+        Returns:
+            ISO timestamp, or None if the thread is not cached (a full load is needed)
+        """
+        entry = self._threads.get(thread_id)
+        if entry is None:
+            return None
+        if entry.high_water_mark is None:
+            return datetime.min.isoformat()
+        return (entry.high_water_mark - DELTA_FETCH_OVERLAP).isoformat()
+
+    def load(self, thread_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Replace the cached messages of a thread with a full load.
+
+        Args:
+            thread_id: Thread the rows belong to
+            rows: LLM message rows starting at the latest summary, in created_at order
+        """
+        self.invalidate(thread_id)
+        self._threads[thread_id] = _CachedThread()
+        self.add_rows(thread_id, rows)
+
+    def add_rows(self, thread_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Merge new LLM message rows into a cached thread.
+
+        Rows of uncached threads are ignored; the next read loads them in full.
+        A summary row drops every message created before it.
+
+        Args:
+            thread_id: Thread the rows belong to
+            rows: Rows with message_id, type, content and created_at
+        """
+        entry = self._threads.get(thread_id)
+        if entry is None:
+            return
+
+        for row in rows:
+            message_id = row.get('message_id')
+            created_at = row.get('created_at')
+            if not message_id or not created_at or message_id in entry.message_ids:
+                continue
+            message = to_llm_message(row)
+            if message is None:
+                continue
+
+            key = (parse_timestamp(created_at), message_id)
+            if entry.high_water_mark is None or key[0] > entry.high_water_mark:
+                entry.high_water_mark = key[0]
+            if entry.summary_key and key < entry.summary_key:
+                # Older than the latest summary; not part of the context
+                continue
+
+            if row.get('type') == 'summary':
+                position = bisect.bisect_left(entry.keys, key)
+                if position > 0:
+                    logger.debug(f"Summary in thread {thread_id} replaces {position} cached messages")
+                    self._drop_before(entry, position)
+                entry.summary_key = key
+
+            size = len(json.dumps(message))
+            token_counts = stored_token_counts(row)
+            position = bisect.bisect_right(entry.keys, key)
+            entry.keys.insert(position, key)
+            entry.messages.insert(position, message)
+            entry.sizes.insert(position, size)
+            entry.token_counts.insert(position, token_counts)
+            for model, count in token_counts.items():
+                entry.token_totals[model] = entry.token_totals.get(model, 0) + count
+                entry.counted[model] = entry.counted.get(model, 0) + 1
+            entry.message_ids.add(message_id)
+            entry.size_bytes += size
+            self._size_bytes += size
+
+        self._threads.move_to_end(thread_id)
+        self._evict()
+
+    def high_water_mark(self, thread_id: str) -> Optional[datetime]:
+        """Get the created_at of the newest row seen for a thread, or None if unknown."""
+        entry = self._threads.get(thread_id)
+        return entry.high_water_mark if entry else None
+
+    def summary_created_at(self, thread_id: str) -> Optional[datetime]:
+        """Get the created_at of the summary a cached thread's context starts with, or None."""
+        entry = self._threads.get(thread_id)
+        return entry.summary_key[0] if entry and entry.summary_key else None
+
+    def get(self, thread_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Get the cached messages of a thread.
+
+        The list is a copy, but the messages are shared with the cache: callers
+        must copy a message before changing it, as apply_cache_breakpoints does.
+
+        Returns:
+            The messages, or None if the thread is not cached
+        """
+        entry = self._threads.get(thread_id)
+        if entry is None:
+            return None
+        self._threads.move_to_end(thread_id)
+        return list(entry.messages)
+
+    def uncounted_messages(self, thread_id: str, model: str) -> List[Tuple[Tuple[datetime, str], Dict[str, Any]]]:
+        """Get the cached messages of a thread without a token count for a model.
+
+        Returns:
+            (key, message) pairs to pass back to set_token_counts once counted
+        """
+        entry = self._threads.get(thread_id)
+        if entry is None or entry.counted.get(model, 0) == len(entry.messages):
+            return []
+        return [
+            (key, message)
+            for key, message, token_counts in zip(entry.keys, entry.messages, entry.token_counts)
+            if model not in token_counts
+        ]
+
+    def set_token_counts(self, thread_id: str, model: str, counts: List[Tuple[Tuple[datetime, str], int]]) -> None:
+        """Store token counts of cached messages, as returned by uncounted_messages.
+
+        Args:
+            thread_id: Thread the messages belong to
+            model: Model whose tokenizer produced the counts
+            counts: (key, token count) pairs
+        """
+        entry = self._threads.get(thread_id)
+        if entry is None:
+            return
+        for key, count in counts:
+            position = bisect.bisect_left(entry.keys, key)
+            if position == len(entry.keys) or entry.keys[position] != key:
+                continue  # Dropped by a summary meanwhile
+            token_counts = entry.token_counts[position]
+            if model in token_counts:
+                continue
+            token_counts[model] = count
+            entry.token_totals[model] = entry.token_totals.get(model, 0) + count
+            entry.counted[model] = entry.counted.get(model, 0) + 1
+
+    def token_total(self, thread_id: str, model: str) -> Optional[int]:
+        """Get the running token total of a cached thread for a model.
+
+        Returns:
+            Sum of the per-message counts, or None if a message has no count for the model
+        """
+        entry = self._threads.get(thread_id)
+        if entry is None or entry.counted.get(model, 0) != len(entry.messages):
+            return None
+        return entry.token_totals.get(model, 0)
+
+    def invalidate(self, thread_id: str) -> None:
+        """Drop a thread from the cache."""
+        entry = self._threads.pop(thread_id, None)
+        if entry is not None:
+            self._size_bytes -= entry.size_bytes
+
+    def _drop_before(self, entry: _CachedThread, position: int) -> None:
+        """Remove the first position messages of a cached thread."""
+        dropped = sum(entry.sizes[:position])
+        # Rows older than the summary are skipped by key, so their ids are not needed for deduplication
+        entry.message_ids.difference_update(message_id for _, message_id in entry.keys[:position])
+        for token_counts in entry.token_counts[:position]:
+            for model, count in token_counts.items():
+                entry.token_totals[model] -= count
+                entry.counted[model] -= 1
+        del entry.keys[:position]
+        del entry.messages[:position]
+        del entry.sizes[:position]
+        del entry.token_counts[:position]
+        entry.size_bytes -= dropped
+        self._size_bytes -= dropped
+
+    def _evict(self) -> None:
+        """Evict least recently used threads until the cache is within budget."""
+        while len(self._threads) > 1 and (
+            len(self._threads) > self.max_threads or self._size_bytes > self.max_bytes
+        ):
+            thread_id, entry = self._threads.popitem(last=False)
+            self._size_bytes -= entry.size_bytes
+            logger.debug(f"Evicted thread {thread_id} from the message cache ({entry.size_bytes} bytes)")
@@ -0,0 +1,224 @@
+"""
+Write-behind persistence of thread messages for AgentPress.
+
+During a thread run, status and message rows are produced faster than they
+need to reach the database. This module provides an ordered write-behind
+queue that:
+- Returns the row to the caller immediately, with a client-generated message_id
+- Assigns strictly increasing created_at timestamps so insertion order is preserved
+- Flushes rows to the messages table in bulk inserts on a timer or batch size
+- Flushes the remaining rows on run end or on error, retrying before giving up
+"""
+
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Union
+
+from services.supabase import DBConnection
+from utils.logger import logger
+
+# Defaults for flushing queued rows
+DEFAULT_FLUSH_INTERVAL = 0.25  # Seconds between timer-based flushes
+DEFAULT_MAX_BATCH_SIZE = 25    # Rows that trigger an immediate flush
+CLOSE_FLUSH_ATTEMPTS = 3       # Bulk flush attempts when the queue is closed
+CLOSE_FLUSH_BACKOFF = 0.5      # Seconds before the first retry, doubled on each retry
+
+
+class MessageFlushError(Exception):
+    """Raised when queued rows could not be written when the queue was closed."""
+    pass
+
+
+class MessageWriteBehindQueue:
+    """Ordered write-behind queue for the messages of one thread run.
+
+    Rows are flushed in the order they were enqueued; a flush never starts
+    before the previous one has finished. Rows of a failed flush stay at the
+    front of the queue and are retried by the next flush. Ordering on read
+    relies on the client-generated created_at values, which are strictly
+    increasing within a run.
+
+    Attributes:
+        thread_id (str): Thread whose messages are queued
+        flush_interval (float): Seconds between timer-based flushes
+        max_batch_size (int): Queue length that triggers an immediate flush
+    """
+
+    def __init__(
+        self,
+        db: DBConnection,
+        thread_id: str,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE
+    ):
+        """Initialize the queue.
+
+        Args:
+            db: Database connection used for the bulk inserts
+            thread_id: Thread whose messages are queued
+            flush_interval: Seconds between timer-based flushes
+            max_batch_size: Queue length that triggers an immediate flush
+        """
+        self.db = db
+        self.thread_id = thread_id
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._last_created_at: Optional[datetime] = None
+        self._closed = False
+
+    def _next_created_at(self) -> str:
+        """Return a timestamp strictly greater than every one handed out before."""
+        now = datetime.now(timezone.utc)
+        if self._last_created_at and now <= self._last_created_at:
+            now = self._last_created_at + timedelta(microseconds=1)
+        self._last_created_at = now
+        return now.isoformat()
+
+    def enqueue(
+        self,
+        type: str,
+        content: Union[Dict[str, Any], List[Any], str],
+        is_llm_message: bool = False,
+        metadata: Optional[Dict[str, Any]] = None,
+        created_at: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Queue a message row and return it as it will be stored.
+
+        Args:
+            type: The type of the message
+            content: The content of the message, stored as JSONB
+            is_llm_message: Flag indicating if the message originated from the LLM
+            metadata: Optional dictionary for additional message metadata
+            created_at: Optional explicit position of the row in the thread (ISO timestamp);
+                        by default the row is ordered after every row queued before it
+
+        Returns:
+            The row, including its client-generated message_id and timestamps
+        """
+        if self._closed:
+            raise RuntimeError(f"Write-behind queue for thread {self.thread_id} is closed")
+
+        created_at = created_at or self._next_created_at()
+        row = {
+            'message_id': str(uuid.uuid4()),
+            'thread_id': self.thread_id,
+            'type': type,
+            'content': json.dumps(content) if isinstance(content, (dict, list)) else content,
+            'is_llm_message': is_llm_message,
+            'metadata': json.dumps(metadata or {}),
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+        self._pending.append(row)
+
+        if self._flusher_task is None:
+            self._flusher_task = asyncio.create_task(self._flush_periodically())
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_requested.set()
+
+        return dict(row)
+
+    async def _flush_periodically(self) -> None:
+        """Flush on every interval, or sooner when a full batch is queued."""
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # Already logged; the rows stay queued for the next attempt
+                pass
+
+    async def flush(self) -> int:
+        """Write all queued rows in one bulk insert, preserving their order.
+
+        Returns:
+            Number of rows written
+
+        Raises:
+            Exception: If the insert fails; the rows remain queued
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            batch = self._pending
+            self._pending = []
+            try:
+                client = await self.db.client
+                # Upsert on the client-generated message_id keeps retries of a partially acknowledged batch idempotent
+                await client.table('messages').upsert(batch, returning='minimal').execute()
+                logger.debug(f"Flushed {len(batch)} messages to thread {self.thread_id}")
+                return len(batch)
+            except asyncio.CancelledError:
+                self._pending = batch + self._pending
+                raise
+            except Exception as e:
+                # Put the batch back in front of anything queued meanwhile
+                self._pending = batch + self._pending
+                logger.error(f"Failed to flush {len(batch)} messages to thread {self.thread_id}: {str(e)}", exc_info=True)
+                raise
+
+    async def close(self) -> None:
+        """Stop the flush timer and write the remaining rows.
+
+        The final bulk flush is retried with backoff, then the rows are written
+        one at a time before any are given up.
+
+        Raises:
+            MessageFlushError: If some rows could still not be written
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._flusher_task:
+            # Wake the flusher so it finishes its current flush and exits
+            self._flush_requested.set()
+            try:
+                await self._flusher_task
+            except asyncio.CancelledError:
+                pass
+            self._flusher_task = None
+
+        for attempt in range(CLOSE_FLUSH_ATTEMPTS):
+            try:
+                await self.flush()
+                return
+            except Exception:
+                if attempt < CLOSE_FLUSH_ATTEMPTS - 1:
+                    await asyncio.sleep(CLOSE_FLUSH_BACKOFF * (2 ** attempt))
+
+        # Bulk writes keep failing; write row by row so one bad row cannot sink the rest
+        failed = await self._write_rows_individually()
+        if failed:
+            raise MessageFlushError(f"Failed to persist {failed} messages for thread {self.thread_id}")
+
+    async def _write_rows_individually(self) -> int:
+        """Write the queued rows one at a time, in order.
+
+        Returns:
+            Number of rows that could not be written
+        """
+        async with self._flush_lock:
+            rows = self._pending
+            self._pending = []
+            client = await self.db.client
+            failed = 0
+            for row in rows:
+                try:
+                    await client.table('messages').upsert([row], returning='minimal').execute()
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Failed to write message {row['message_id']} to thread {self.thread_id}: {str(e)}")
+            return failed
@@ -0,0 +1,172 @@
+"""
+Versioned cache of assembled system prompts and tool schemas for AgentPress.
+
+Every thread run used to copy the system prompt, rebuild the XML tool examples
+block and the OpenAPI schema list, and recount the prompt's tokens. This module
+assembles them once per prompt version, tool set and model:
+- The key is the prompt version (a digest of the content unless given), the
+  registry's tool set hash, whether XML examples are included and the model
+- An entry holds the system message, the schema list and its token count
+- Entries are immutable; callers get a fresh message dict to send
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from agentpress.token_counting import count_message_tokens
+from agentpress.tool_registry import ToolRegistry
+from utils.logger import logger
+
+# Number of assembled prompts kept before the least recently used is dropped
+DEFAULT_MAX_ENTRIES = 32
+
+XML_TOOL_CALLING_HEADER = """
+--- XML TOOL CALLING ---
+
+In this environment you have access to a set of tools you can use to answer the user's question. The tools are specified in XML format.
+Format your tool calls using the specified XML tags. Place parameters marked as 'attribute' within the opening tag (e.g., `<tag attribute='value'>`). Place parameters marked as 'content' between the opening and closing tags. Place parameters marked as 'element' within their own child tags (e.g., `<tag><element>value</element></tag>`). Refer to the examples provided below for the exact structure of each tool.
+String and scalar parameters should be specified as attributes, while content goes between tags.
+Note that spaces for string values are not stripped. The output is parsed with regular expressions.
+
+Here are the XML tools available with examples:
+"""
+
+
+def prompt_version_of(system_prompt: Dict[str, Any]) -> str:
+    """Derive a version for a system prompt from a digest of its content."""
+    return hashlib.sha1(json.dumps(system_prompt, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+@dataclass(frozen=True)
+class AssembledPrompt:
+    """System message and tool schemas prepared for one prompt version, tool set and model.
+
+    Attributes:
+        role (str): Role of the system message
+        content (str or tuple): Message content; list content is kept as a tuple of text blocks
+        tool_schemas (Tuple[Dict[str, Any], ...]): OpenAPI schemas of the registered tools
+        token_count (int): Tokens of the system message for the model
+    """
+    role: str
+    content: Any
+    tool_schemas: Tuple[Dict[str, Any], ...]
+    token_count: int
+
+    def system_message(self) -> Dict[str, Any]:
+        """Get a message dict to send; it is never shared with the cache or other callers."""
+        if isinstance(self.content, tuple):
+            return {"role": self.role, "content": [dict(block) for block in self.content]}
+        return {"role": self.role, "content": self.content}
+
+    def openapi_schemas(self) -> List[Dict[str, Any]]:
+        """Get the OpenAPI schemas as the list the LLM call expects."""
+        return list(self.tool_schemas)
+
+
+def _append_xml_examples(system_prompt: Dict[str, Any], xml_examples: Dict[str, str]) -> Dict[str, Any]:
+    """Return a copy of the system prompt with the XML examples block appended to its text."""
+    examples_content = XML_TOOL_CALLING_HEADER
+    for tag_name, example in xml_examples.items():
+        examples_content += f"<{tag_name}> Example: {example}\\n"
+
+    message = dict(system_prompt)
+    system_content = message.get('content')
+    if isinstance(system_content, str):
+        message['content'] = system_content + examples_content
+        logger.debug("Appended XML examples to string system prompt content.")
+    elif isinstance(system_content, list):
+        message['content'] = [dict(item) if isinstance(item, dict) else item for item in system_content]
+        for item in message['content']:
+            if isinstance(item, dict) and item.get('type') == 'text' and 'text' in item:
+                item['text'] += examples_content
+                logger.debug("Appended XML examples to the first text block in list system prompt content.")
+                break
+        else:
+            logger.warning("System prompt content is a list but no text block found to append XML examples.")
+    else:
+        logger.warning(f"System prompt content is of unexpected type ({type(system_content)}), cannot add XML examples.")
+    return message
+
+
+class PromptAssemblyCache:
+    """LRU cache of assembled prompts keyed by prompt version, tool set, examples flag and model.
+
+    Attributes:
+        max_entries (int): Number of assembled prompts kept
+        hits (int): Lookups served from the cache
+        misses (int): Lookups that assembled a prompt
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """Initialize an empty cache.
+
+        Args:
+            max_entries: Number of assembled prompts kept
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str, bool, str], AssembledPrompt]" = OrderedDict()
+
+    async def get(
+        self,
+        system_prompt: Dict[str, Any],
+        tool_registry: ToolRegistry,
+        model: str,
+        include_xml_examples: bool = False,
+        prompt_version: Optional[str] = None
+    ) -> AssembledPrompt:
+        """Get the assembled prompt for a system prompt and the registry's tools.
+
+        Args:
+            system_prompt: System message as passed to run_thread
+            tool_registry: Registry whose tools are exposed to the LLM
+            model: Model whose tokenizer counts the system message
+            include_xml_examples: Whether the XML tool examples are appended
+            prompt_version: Version of the system prompt; a digest of its content if omitted
+
+        Returns:
+            The cached or newly assembled prompt
+        """
+        key = (
+            prompt_version or prompt_version_of(system_prompt),
+            tool_registry.get_tool_set_hash(),
+            include_xml_examples,
+            model,
+        )
+        assembled = self._entries.get(key)
+        if assembled is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return assembled
+
+        self.misses += 1
+        message = dict(system_prompt)
+        if include_xml_examples:
+            xml_examples = tool_registry.get_xml_examples()
+            if xml_examples:
+                message = _append_xml_examples(system_prompt, xml_examples)
+
+        content = message.get('content')
+        if isinstance(content, list):
+            content = tuple(dict(block) if isinstance(block, dict) else block for block in content)
+        token_count = (await count_message_tokens(model, [message]))[0]
+        assembled = AssembledPrompt(
+            role=message.get('role', 'system'),
+            content=content,
+            tool_schemas=tuple(tool_registry.get_openapi_schemas()),
+            token_count=token_count,
+        )
+        logger.debug(f"Assembled system prompt for {model}: {token_count} tokens, {len(assembled.tool_schemas)} OpenAPI schemas")
+
+        self._entries[key] = assembled
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return assembled
+
+
+# Shared by all thread managers of the process; the tool set and prompt rarely change between runs
+prompt_assembly_cache = PromptAssemblyCache()
@@ -10,23 +10,67 @@ This module handles processing of LLM responses including:
 
 import json
 import asyncio
+import inspect
 import re
+import time
 import uuid
+import weakref
 from typing import List, Dict, Any, Optional, Tuple, AsyncGenerator, Callable, Union, Literal
 from dataclasses import dataclass
 from datetime import datetime, timezone
 
-from litellm import completion_cost, token_counter
+from litellm import token_counter
 
-from agentpress.tool import Tool, ToolResult
+from agentpress.tool import Tool, ToolResult, ToolProgress, tool_call_workers
 from agentpress.tool_registry import ToolRegistry
+from agentpress.xml_stream_scanner import XMLStreamScanner, extract_xml_chunks
+from agentpress.json_stream import JSONStreamAssembler
+from agentpress.tool_scheduler import ToolScheduler
+from agentpress.tool_batch import ToolCallBatch, TERMINAL_TOOL_NAMES
+from agentpress.token_counting import count_prompt_tokens
+from services.llm import calculate_cost, normalize_usage, prompt_cache_hit_rate, prompt_cache_stats
 from utils.logger import logger
 
 # Type alias for XML result adding strategy
 XmlAddingStrategy = Literal["user_message", "assistant_message", "inline_edit"]
 
 # Type alias for tool execution strategy
-ToolExecutionStrategy = Literal["sequential", "parallel"]
+ToolExecutionStrategy = Literal["sequential", "parallel", "scheduled"]
+
+# Matches the tag name at the start of an XML tool call chunk
+XML_TAG_NAME_PATTERN = re.compile(r'<([^\s>]+)')
+
+# Seconds to wait for cancelled tool tasks to unwind before recording them as cancelled
+TOOL_CANCEL_GRACE_PERIOD = 0.5
+
+# Error recorded for tool calls cancelled by a stop request
+TOOL_CANCELLED_MESSAGE = "Tool execution cancelled"
+
+# Per event loop: (tool class, max_concurrency) -> semaphore shared by all thread runs
+_tool_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, int], asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+def _get_tool_semaphore(tool_class: str, max_concurrency: int) -> asyncio.Semaphore:
+    """Get the process-wide semaphore capping concurrent calls of a tool class."""
+    semaphores = _tool_semaphores.setdefault(asyncio.get_running_loop(), {})
+    key = (tool_class, max_concurrency)
+    if key not in semaphores:
+        semaphores[key] = asyncio.Semaphore(max_concurrency)
+    return semaphores[key]
+
+def _release_after(semaphore: asyncio.Semaphore, workers: List[asyncio.Future]) -> None:
+    """Release a tool slot once every worker thread of the call has returned."""
+    remaining = {worker for worker in workers if not worker.done()}
+    if not remaining:
+        semaphore.release()
+        return
+
+    def on_worker_done(worker: asyncio.Future) -> None:
+        remaining.discard(worker)
+        if not remaining:
+            semaphore.release()
+
+    for worker in remaining:
+        worker.add_done_callback(on_worker_done)
 
 @dataclass
 class ToolExecutionContext:
@@ -53,9 +97,18 @@ class ProcessorConfig:
         native_tool_calling: Enable OpenAI-style function calling format
         execute_tools: Whether to automatically execute detected tool calls
         execute_on_stream: For streaming, execute tools as they appear vs. at the end
-        tool_execution_strategy: How to execute multiple tools ("sequential" or "parallel")
+        tool_execution_strategy: How to execute multiple tools ("sequential", "parallel", or
+            "scheduled" to run calls concurrently unless their declared execution traits conflict)
         xml_adding_strategy: How to add XML tool results to the conversation
         max_xml_tool_calls: Maximum number of XML tool calls to process (0 = no limit)
+        tool_call_batching: Run the tool calls of one response as a batch, skipping the calls
+            not yet started after a terminal tool (ask/complete) or a failed call. With the
+            "scheduled" strategy, calls whose traits do not conflict run concurrently; otherwise
+            they run one at a time in call order. max_xml_tool_calls caps the batch size.
+        content_coalesce_ms: For streaming, merge adjacent content chunks into one frame
+            per this many milliseconds (0 = no time window)
+        content_coalesce_bytes: For streaming, emit a merged content frame once it reaches
+            this many bytes (0 = no size window). Coalescing is off when both are 0.
     """
 
     xml_tool_calling: bool = True  
@@ -66,6 +119,9 @@ class ProcessorConfig:
     tool_execution_strategy: ToolExecutionStrategy = "sequential"
     xml_adding_strategy: XmlAddingStrategy = "assistant_message"
     max_xml_tool_calls: int = 0  # 0 means no limit
+    tool_call_batching: bool = False
+    content_coalesce_ms: int = 0  # 0 means no time window
+    content_coalesce_bytes: int = 0  # 0 means no size window
     
     def __post_init__(self):
         """Validate configuration after initialization."""
@@ -78,6 +134,14 @@ class ProcessorConfig:
         if self.max_xml_tool_calls < 0:
             raise ValueError("max_xml_tool_calls must be a non-negative integer (0 = no limit)")
 
+        if self.content_coalesce_ms < 0 or self.content_coalesce_bytes < 0:
+            raise ValueError("content_coalesce_ms and content_coalesce_bytes must be non-negative (0 = disabled)")
+
+    @property
+    def coalesce_content(self) -> bool:
+        """Whether streamed content chunks are merged into larger frames."""
+        return self.content_coalesce_ms > 0 or self.content_coalesce_bytes > 0
+
 class ResponseProcessor:
     """Processes LLM responses, extracting and executing tool calls."""
     
@@ -99,6 +163,7 @@ class ResponseProcessor:
         prompt_messages: List[Dict[str, Any]],
         llm_model: str,
         config: ProcessorConfig = ProcessorConfig(),
+        prompt_token_count: Optional[int] = None,
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Process a streaming LLM response, handling tool calls and execution.
         
@@ -108,13 +173,20 @@ class ResponseProcessor:
             prompt_messages: List of messages sent to the LLM (the prompt)
             llm_model: The name of the LLM model used
             config: Configuration for parsing and execution
+            prompt_token_count: Token count of the prompt, already computed by the caller.
+                Used for cost accounting when the provider sends no usage block.
             
         Yields:
             Complete message objects matching the DB schema, except for content chunks.
         """
         accumulated_content = ""
-        tool_calls_buffer = {}
-        current_xml_content = ""
+        tool_calls_buffer = {} # idx -> {'id', 'type', 'function': {'name'}, 'arguments': JSONStreamAssembler}
+        executed_native_indices = set() # Native tool call indices already started during the stream
+        xml_scanner = XMLStreamScanner(self.tool_registry.xml_tools.keys())
+        # Batches run in call order; otherwise streamed tools start as detected and the scheduler holds back only conflicting calls
+        tool_batch = self._create_tool_batch(config)
+        tool_executor = tool_batch or (ToolScheduler(self.tool_registry, self._execute_tool) if config.tool_execution_strategy == "scheduled" else None)
+        progress_queue: asyncio.Queue = asyncio.Queue() # (context, ToolProgress) from streaming tools
         xml_chunks_buffer = []
         pending_tool_executions = []
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
@@ -123,12 +195,28 @@ class ResponseProcessor:
         finish_reason = None
         last_assistant_message_object = None # Store the final saved assistant message object
         tool_result_message_objects = {} # tool_index -> full saved message object
+        stream_usage = None # Normalized usage block reported by the provider
+        stream_cache_hit = False # Replayed from the LLM response cache
+        cancelled = False # Set when the run is stopped; nothing may be yielded afterwards
+        coalesced_parts = [] # Content deltas not yet yielded when coalescing is enabled
+        coalesced_bytes = 0
+        coalesce_window_start = 0.0
+        next_chunk: Optional[asyncio.Future] = None # Pending read of the stream, kept across a window deadline
 
         logger.info(f"Streaming Config: XML={config.xml_tool_calling}, Native={config.native_tool_calling}, "
                    f"Execute on stream={config.execute_on_stream}, Strategy={config.tool_execution_strategy}")
 
         thread_run_id = str(uuid.uuid4())
 
+        def flush_coalesced_content() -> Optional[Dict[str, Any]]:
+            """Return the pending coalesced content as one chunk frame, if any."""
+            nonlocal coalesced_parts, coalesced_bytes
+            if not coalesced_parts:
+                return None
+            frame = self._content_chunk_message(thread_id, thread_run_id, "".join(coalesced_parts))
+            coalesced_parts, coalesced_bytes = [], 0
+            return frame
+
         try:
             # --- Save and Yield Start Events ---
             start_content = {"status_type": "thread_run_start", "thread_run_id": thread_run_id}
@@ -146,7 +234,36 @@ class ResponseProcessor:
             if assist_start_msg_obj: yield assist_start_msg_obj
             # --- End Start Events ---
 
-            async for chunk in llm_response:
+            chunk_iterator = llm_response.__aiter__()
+            while True:
+                # The coalescing time window is a deadline: a provider pause does not hold back buffered content
+                if coalesced_parts and config.content_coalesce_ms:
+                    if next_chunk is None:
+                        next_chunk = asyncio.ensure_future(chunk_iterator.__anext__())
+                    remaining = config.content_coalesce_ms / 1000 - (time.monotonic() - coalesce_window_start)
+                    done, _ = await asyncio.wait({next_chunk}, timeout=max(0.0, remaining))
+                    if not done:
+                        yield flush_coalesced_content()
+                        continue
+                try:
+                    chunk = await (next_chunk if next_chunk is not None else chunk_iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_chunk = None
+
+                # Forward progress of tools started earlier in the stream
+                while not progress_queue.empty():
+                    content_frame = flush_coalesced_content()
+                    if content_frame: yield content_frame
+                    yield self._tool_progress_message(*progress_queue.get_nowait(), thread_id, thread_run_id)
+
+                # The usage block arrives with the final chunk when stream_options.include_usage is set
+                if getattr(chunk, 'usage', None):
+                    stream_usage = normalize_usage(chunk.usage)
+                if (getattr(chunk, '_hidden_params', None) or {}).get('cache_hit'):
+                    stream_cache_hit = True
+
                 if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'finish_reason') and chunk.choices[0].finish_reason:
                     finish_reason = chunk.choices[0].finish_reason
                     logger.debug(f"Detected finish_reason: {finish_reason}")
@@ -164,26 +281,29 @@ class ResponseProcessor:
                     if delta and hasattr(delta, 'content') and delta.content:
                         chunk_content = delta.content
                         accumulated_content += chunk_content
-                        current_xml_content += chunk_content
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
                             # Yield ONLY content chunk (don't save)
-                            now_chunk = datetime.now(timezone.utc).isoformat()
-                            yield {
-                                "message_id": None, "thread_id": thread_id, "type": "assistant",
-                                "is_llm_message": True,
-                                "content": json.dumps({"role": "assistant", "content": chunk_content}),
-                                "metadata": json.dumps({"stream_status": "chunk", "thread_run_id": thread_run_id}),
-                                "created_at": now_chunk, "updated_at": now_chunk
-                            }
+                            if not config.coalesce_content:
+                                yield self._content_chunk_message(thread_id, thread_run_id, chunk_content)
+                            else:
+                                # Merge adjacent deltas; emit once the time or size window is full
+                                if not coalesced_parts:
+                                    coalesce_window_start = time.monotonic()
+                                coalesced_parts.append(chunk_content)
+                                coalesced_bytes += len(chunk_content.encode('utf-8'))
+                                if ((config.content_coalesce_bytes and coalesced_bytes >= config.content_coalesce_bytes) or
+                                        (config.content_coalesce_ms and
+                                         (time.monotonic() - coalesce_window_start) * 1000 >= config.content_coalesce_ms)):
+                                    yield flush_coalesced_content()
                         else:
                             logger.info("XML tool call limit reached - not yielding more content chunks")
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
                         if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
+                            # Only the new delta is scanned; complete chunks are emitted exactly once
+                            xml_chunks = xml_scanner.feed(chunk_content)
                             for xml_chunk in xml_chunks:
-                                current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
                                 xml_chunks_buffer.append(xml_chunk)
                                 result = self._parse_xml_tool_call(xml_chunk)
                                 if result:
@@ -195,12 +315,16 @@ class ResponseProcessor:
                                     )
 
                                     if config.execute_tools and config.execute_on_stream:
+                                        # Content up to the tool call goes out before its tool_started event
+                                        content_frame = flush_coalesced_content()
+                                        if content_frame: yield content_frame
+
                                         # Save and Yield tool_started status
                                         started_msg_obj = await self._yield_and_save_tool_started(context, thread_id, thread_run_id)
                                         if started_msg_obj: yield started_msg_obj
                                         yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                        execution_task = asyncio.create_task(self._execute_tool(tool_call))
+                                        execution_task = self._start_tool_execution(tool_call, context, tool_executor, progress_queue)
                                         pending_tool_executions.append({
                                             "task": execution_task, "tool_call": tool_call,
                                             "tool_index": tool_index, "context": context
@@ -229,6 +353,9 @@ class ResponseProcessor:
                                     if hasattr(tool_call_chunk.function, 'arguments'): tool_call_data_chunk['function']['arguments'] = tool_call_chunk.function.arguments
 
 
+                            content_frame = flush_coalesced_content()
+                            if content_frame: yield content_frame
+
                             now_tool_chunk = datetime.now(timezone.utc).isoformat()
                             yield {
                                 "message_id": None, "thread_id": thread_id, "type": "status", "is_llm_message": True,
@@ -239,25 +366,40 @@ class ResponseProcessor:
 
                             # --- Buffer and Execute Complete Native Tool Calls ---
                             if not hasattr(tool_call_chunk, 'function'): continue
-                            idx = tool_call_chunk.index if hasattr(tool_call_chunk, 'index') else 0
-                            # ... (buffer update logic remains same) ...
-                            # ... (check complete logic remains same) ...
-                            has_complete_tool_call = False # Placeholder
-                            if (tool_calls_buffer.get(idx) and
-                                tool_calls_buffer[idx]['id'] and
-                                tool_calls_buffer[idx]['function']['name'] and
-                                tool_calls_buffer[idx]['function']['arguments']):
-                                try:
-                                    json.loads(tool_calls_buffer[idx]['function']['arguments'])
-                                    has_complete_tool_call = True
-                                except json.JSONDecodeError: pass
-
+                            idx = tool_call_chunk.index if hasattr(tool_call_chunk, 'index') and tool_call_chunk.index is not None else 0
+                            if idx not in tool_calls_buffer:
+                                tool_calls_buffer[idx] = {
+                                    'id': None, 'type': 'function',
+                                    'function': {'name': None}, 'arguments': JSONStreamAssembler()
+                                }
+                            current_tool = tool_calls_buffer[idx]
+                            if getattr(tool_call_chunk, 'id', None):
+                                current_tool['id'] = tool_call_chunk.id
+                            function_chunk = tool_call_chunk.function
+                            if function_chunk is not None:
+                                if getattr(function_chunk, 'name', None):
+                                    current_tool['function']['name'] = function_chunk.name
+                                if getattr(function_chunk, 'arguments', None):
+                                    # Only the new fragment is scanned; completion is known without json.loads
+                                    current_tool['arguments'].feed(function_chunk.arguments)
+
+                            has_complete_tool_call = (
+                                idx not in executed_native_indices and
+                                current_tool['id'] and
+                                current_tool['function']['name'] and
+                                current_tool['arguments'].complete
+                            )
 
                             if has_complete_tool_call and config.execute_tools and config.execute_on_stream:
-                                current_tool = tool_calls_buffer[idx]
+                                arguments = current_tool['arguments'].parse()
+                                if arguments is None:
+                                    logger.error(f"Invalid JSON arguments for native tool call {current_tool['id']}: {current_tool['arguments'].text}")
+                                    executed_native_indices.add(idx)
+                                    continue
+                                executed_native_indices.add(idx)
                                 tool_call_data = {
                                     "function_name": current_tool['function']['name'],
-                                    "arguments": json.loads(current_tool['function']['arguments']),
+                                    "arguments": arguments,
                                     "id": current_tool['id']
                                 }
                                 current_assistant_id = last_assistant_message_object['message_id'] if last_assistant_message_object else None
@@ -270,7 +412,7 @@ class ResponseProcessor:
                                 if started_msg_obj: yield started_msg_obj
                                 yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                execution_task = asyncio.create_task(self._execute_tool(tool_call_data))
+                                execution_task = self._start_tool_execution(tool_call_data, context, tool_executor, progress_queue)
                                 pending_tool_executions.append({
                                     "task": execution_task, "tool_call": tool_call_data,
                                     "tool_index": tool_index, "context": context
@@ -282,14 +424,28 @@ class ResponseProcessor:
                     break
 
             # --- After Streaming Loop ---
+            content_frame = flush_coalesced_content()
+            if content_frame: yield content_frame
 
             # Wait for pending tool executions from streaming phase
             tool_results_buffer = [] # Stores (tool_call, result, tool_index, context)
             if pending_tool_executions:
                 logger.info(f"Waiting for {len(pending_tool_executions)} pending streamed tool executions")
                 # ... (asyncio.wait logic) ...
-                pending_tasks = [execution["task"] for execution in pending_tool_executions]
-                done, _ = await asyncio.wait(pending_tasks)
+                pending_tasks = {execution["task"] for execution in pending_tool_executions}
+                # Wait for the tools while forwarding their progress as it arrives
+                while True:
+                    while not progress_queue.empty():
+                        yield self._tool_progress_message(*progress_queue.get_nowait(), thread_id, thread_run_id)
+                    pending_tasks = {task for task in pending_tasks if not task.done()}
+                    if not pending_tasks:
+                        break
+                    progress_getter = asyncio.ensure_future(progress_queue.get())
+                    await asyncio.wait(pending_tasks | {progress_getter}, return_when=asyncio.FIRST_COMPLETED)
+                    if not progress_getter.done():
+                        progress_getter.cancel()
+                    elif not progress_getter.cancelled():
+                        yield self._tool_progress_message(*progress_getter.result(), thread_id, thread_run_id)
 
                 for execution in pending_tool_executions:
                     tool_idx = execution.get("tool_index", -1)
@@ -345,7 +501,20 @@ class ResponseProcessor:
                 logger.info(f"Stream finished with reason: xml_tool_limit_reached after {xml_tool_call_count} XML tool calls")
 
             # --- SAVE and YIELD Final Assistant Message ---
-            if accumulated_content:
+            # Collect native tool calls whose arguments were fully assembled (parsed once)
+            complete_native_tool_calls = []
+            if config.native_tool_calling:
+                for idx in sorted(tool_calls_buffer):
+                    tc_buf = tool_calls_buffer[idx]
+                    if tc_buf['id'] and tc_buf['function']['name']:
+                        args = tc_buf['arguments'].parse()
+                        if args is None: continue
+                        complete_native_tool_calls.append({
+                            "id": tc_buf['id'], "type": "function",
+                            "function": {"name": tc_buf['function']['name'], "arguments": args}
+                        })
+
+            if accumulated_content or complete_native_tool_calls:
                 # ... (Truncate accumulated_content logic) ...
                 if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls and xml_chunks_buffer:
                     last_xml_chunk = xml_chunks_buffer[-1]
@@ -353,22 +522,13 @@ class ResponseProcessor:
                     if last_chunk_end_pos > 0:
                         accumulated_content = accumulated_content[:last_chunk_end_pos]
 
-                # ... (Extract complete_native_tool_calls logic) ...
-                complete_native_tool_calls = []
-                if config.native_tool_calling:
-                    for idx, tc_buf in tool_calls_buffer.items():
-                        if tc_buf['id'] and tc_buf['function']['name'] and tc_buf['function']['arguments']:
-                            try:
-                                args = json.loads(tc_buf['function']['arguments'])
-                                complete_native_tool_calls.append({
-                                    "id": tc_buf['id'], "type": "function",
-                                    "function": {"name": tc_buf['function']['name'],"arguments": args}
-                                })
-                            except json.JSONDecodeError: continue
-
                 message_data = { # Dict to be saved in 'content'
                     "role": "assistant", "content": accumulated_content,
-                    "tool_calls": complete_native_tool_calls or None
+                    # Arguments are stored as JSON strings, as in the non-streaming path
+                    "tool_calls": [
+                        {**tc, "function": {**tc["function"], "arguments": json.dumps(tc["function"]["arguments"])}}
+                        for tc in complete_native_tool_calls
+                    ] or None
                 }
 
                 last_assistant_message_object = await self.add_message(
@@ -406,9 +566,7 @@ class ResponseProcessor:
                  # Gather XML tool calls from buffer (up to limit)
                 parsed_xml_data = []
                 if config.xml_tool_calling:
-                    # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
-                    xml_chunks_buffer.extend(xml_chunks)
+                    # The stream scanner has already emitted every complete chunk into xml_chunks_buffer
                     # Process only chunks not already handled in the stream loop
                     remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
                     xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
@@ -456,7 +614,7 @@ class ResponseProcessor:
                 # Or execute now if not streamed
                 elif final_tool_calls_to_process and not config.execute_on_stream:
                     logger.info(f"Executing {len(final_tool_calls_to_process)} tools ({config.tool_execution_strategy}) after stream")
-                    results_list = await self._execute_tools(final_tool_calls_to_process, config.tool_execution_strategy)
+                    results_list = await self._execute_tools(final_tool_calls_to_process, config.tool_execution_strategy, tool_batch)
                     current_tool_idx = 0
                     for tc, res in results_list:
                        # Map back using all_tool_data_map which has correct indices
@@ -510,27 +668,28 @@ class ResponseProcessor:
                              logger.error(f"Failed to save tool result for index {tool_idx}, not yielding result message.")
                              # Optionally yield error status for saving failure?
 
+                # Report what batching the tool calls of this response saved
+                if tool_batch and (tool_batch.executed or tool_batch.skipped):
+                    batch_msg_obj = await self._yield_and_save_tool_batch(tool_batch, thread_id, thread_run_id)
+                    if batch_msg_obj: yield batch_msg_obj
+
             # --- Calculate and Store Cost ---
             if last_assistant_message_object: # Only calculate if assistant message was saved
                 try:
-                    # Use accumulated_content for streaming cost calculation
-                    final_cost = completion_cost(
-                        model=llm_model,
-                        messages=prompt_messages, # Use the prompt messages provided
-                        completion=accumulated_content
-                    )
-                    if final_cost is not None and final_cost > 0:
-                        logger.info(f"Calculated final cost for stream: {final_cost}")
-                        await self.add_message(
-                            thread_id=thread_id,
-                            type="cost",
-                            content={"cost": final_cost},
-                            is_llm_message=False, # Cost is metadata
-                            metadata={"thread_run_id": thread_run_id} # Keep track of the run
-                        )
-                        logger.info(f"Cost message saved for stream: {final_cost}")
-                    else:
-                         logger.info("Stream cost calculation resulted in zero or None, not storing cost message.")
+                    usage, usage_source = stream_usage, "provider"
+                    if not usage or not usage["prompt_tokens"]:
+                        # No usage block: reuse the caller's prompt count and only count the completion
+                        usage_source = "estimated"
+                        usage = {
+                            "prompt_tokens": prompt_token_count if prompt_token_count is not None
+                                else await count_prompt_tokens(llm_model, prompt_messages),
+                            "completion_tokens": token_counter(model=llm_model, text=accumulated_content),
+                            "cache_read_input_tokens": 0,
+                            "cache_creation_input_tokens": 0,
+                        }
+                    if stream_cache_hit:
+                        usage_source = "cache"
+                    await self._save_cost_message(thread_id, thread_run_id, llm_model, usage, usage_source)
                 except Exception as e:
                     logger.error(f"Error calculating final cost for stream: {str(e)}")
 
@@ -544,8 +703,18 @@ class ResponseProcessor:
                 )
                 if finish_msg_obj: yield finish_msg_obj
 
+        except asyncio.CancelledError:
+            # Stop requested: cut the streamed tools short and record them, then let the cancellation through
+            cancelled = True
+            logger.info(f"Stream processing cancelled for thread {thread_id}")
+            cancelled_contexts = await self._cancel_tool_executions(pending_tool_executions)
+            await self._save_cancelled_tool_errors(cancelled_contexts, thread_id, thread_run_id)
+            raise
+
         except Exception as e:
             logger.error(f"Error processing stream: {str(e)}", exc_info=True)
+            content_frame = flush_coalesced_content()
+            if content_frame: yield content_frame
             # Save and yield error status message
             err_content = {"role": "system", "status_type": "error", "message": str(e)}
             err_msg_obj = await self.add_message(
@@ -555,13 +724,16 @@ class ResponseProcessor:
             if err_msg_obj: yield err_msg_obj # Yield the saved error message
 
         finally:
+            if next_chunk is not None:
+                next_chunk.cancel()
             # Save and Yield the final thread_run_end status
             end_content = {"status_type": "thread_run_end"}
             end_msg_obj = await self.add_message(
                 thread_id=thread_id, type="status", content=end_content, 
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
             )
-            if end_msg_obj: yield end_msg_obj
+            # Yielding would swallow a cancellation, so the row is only saved then
+            if end_msg_obj and not cancelled: yield end_msg_obj
 
     async def process_non_streaming_response(
         self,
@@ -569,7 +741,8 @@ class ResponseProcessor:
         thread_id: str,
         prompt_messages: List[Dict[str, Any]],
         llm_model: str,
-        config: ProcessorConfig = ProcessorConfig()
+        config: ProcessorConfig = ProcessorConfig(),
+        prompt_token_count: Optional[int] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Process a non-streaming LLM response, handling tool calls and execution.
         
@@ -579,6 +752,8 @@ class ResponseProcessor:
             prompt_messages: List of messages sent to the LLM (the prompt)
             llm_model: The name of the LLM model used
             config: Configuration for parsing and execution
+            prompt_token_count: Token count of the prompt, already computed by the caller.
+                                Used for cost estimation if the provider reports no usage.
             
         Yields:
             Complete message objects matching the DB schema.
@@ -591,6 +766,8 @@ class ResponseProcessor:
         tool_result_message_objects = {}
         finish_reason = None
         native_tool_calls_for_message = []
+        executing_contexts = [] # Contexts of tool calls running in _execute_tools
+        cancelled = False # Set when the run is stopped; nothing may be yielded afterwards
 
         try:
             # Save and Yield thread_run_start status message
@@ -613,14 +790,10 @@ class ResponseProcessor:
                          if config.xml_tool_calling:
                              parsed_xml_data = self._parse_xml_tool_calls(content)
                              if config.max_xml_tool_calls > 0 and len(parsed_xml_data) > config.max_xml_tool_calls:
-                                 # Truncate content and tool data if limit exceeded
-                                 # ... (Truncation logic similar to streaming) ...
-                                 if parsed_xml_data:
-                                     xml_chunks = self._extract_xml_chunks(content)[:config.max_xml_tool_calls]
-                                     if xml_chunks:
-                                         last_chunk = xml_chunks[-1]
-                                         last_chunk_pos = content.find(last_chunk)
-                                         if last_chunk_pos >= 0: content = content[:last_chunk_pos + len(last_chunk)]
+                                 # Truncate content after the last allowed chunk (kept in parsing_details)
+                                 last_chunk = parsed_xml_data[config.max_xml_tool_calls - 1]['parsing_details']['raw_chunk']
+                                 last_chunk_pos = content.find(last_chunk)
+                                 if last_chunk_pos >= 0: content = content[:last_chunk_pos + len(last_chunk)]
                                  parsed_xml_data = parsed_xml_data[:config.max_xml_tool_calls]
                                  finish_reason = "xml_tool_limit_reached"
                              all_tool_data.extend(parsed_xml_data)
@@ -663,34 +836,26 @@ class ResponseProcessor:
             # --- Calculate and Store Cost ---
             if assistant_message_object: # Only calculate if assistant message was saved
                 try:
-                    # Use the full llm_response object for potentially more accurate cost calculation
-                    final_cost = None
-                    if hasattr(llm_response, '_hidden_params') and 'response_cost' in llm_response._hidden_params and llm_response._hidden_params['response_cost'] is not None and llm_response._hidden_params['response_cost'] != 0.0:
-                        final_cost = llm_response._hidden_params['response_cost']
-                        logger.info(f"Using response_cost from _hidden_params: {final_cost}")
-
-                    if final_cost is None: # Fall back to calculating cost if direct cost not available or zero
-                        logger.info("Calculating cost using completion_cost function.")
-                        # Note: litellm might need 'messages' kwarg depending on model/provider
-                        final_cost = completion_cost(
-                            completion_response=llm_response,
-                            model=llm_model, # Explicitly pass the model name
-                            # messages=prompt_messages # Pass prompt messages if needed by litellm for this model
-                        )
-
-                    if final_cost is not None and final_cost > 0:
-                        logger.info(f"Calculated final cost for non-stream: {final_cost}")
-                        await self.add_message(
-                            thread_id=thread_id,
-                            type="cost",
-                            content={"cost": final_cost},
-                            is_llm_message=False, # Cost is metadata
-                            metadata={"thread_run_id": thread_run_id} # Keep track of the run
-                        )
-                        logger.info(f"Cost message saved for non-stream: {final_cost}")
-                    else:
-                        logger.info("Non-stream cost calculation resulted in zero or None, not storing cost message.")
-
+                    # LiteLLM's own price for the call, used for models missing from the price tables
+                    hidden_params = getattr(llm_response, '_hidden_params', None) or {}
+                    response_cost = hidden_params.get('response_cost') or None
+                    usage = normalize_usage(llm_response.usage) if getattr(llm_response, 'usage', None) else None
+                    usage_source = "provider"
+                    if not usage or not usage["prompt_tokens"]:
+                        # No usage block: reuse the caller's prompt count and only count the completion
+                        usage_source = "estimated"
+                        usage = {
+                            "prompt_tokens": prompt_token_count if prompt_token_count is not None
+                                else await count_prompt_tokens(llm_model, prompt_messages),
+                            "completion_tokens": token_counter(model=llm_model, text=content) if content else 0,
+                            "cache_read_input_tokens": 0,
+                            "cache_creation_input_tokens": 0,
+                        }
+                    if hidden_params.get('cache_hit'):
+                        usage_source = "cache"
+                    await self._save_cost_message(
+                        thread_id, thread_run_id, llm_model, usage, usage_source, fallback_cost=response_cost
+                    )
                 except Exception as e:
                     logger.error(f"Error calculating final cost for non-stream: {str(e)}")
 
@@ -698,7 +863,17 @@ class ResponseProcessor:
             tool_calls_to_execute = [item['tool_call'] for item in all_tool_data]
             if config.execute_tools and tool_calls_to_execute:
                 logger.info(f"Executing {len(tool_calls_to_execute)} tools with strategy: {config.tool_execution_strategy}")
-                tool_results = await self._execute_tools(tool_calls_to_execute, config.tool_execution_strategy)
+                executing_contexts = [
+                    self._create_tool_context(
+                        item['tool_call'], tool_index + offset,
+                        assistant_message_object['message_id'] if assistant_message_object else None,
+                        item['parsing_details']
+                    )
+                    for offset, item in enumerate(all_tool_data)
+                ]
+                tool_batch = self._create_tool_batch(config)
+                tool_results = await self._execute_tools(tool_calls_to_execute, config.tool_execution_strategy, tool_batch)
+                executing_contexts = []
 
                 for i, (returned_tool_call, result) in enumerate(tool_results):
                     original_data = all_tool_data[i]
@@ -738,6 +913,11 @@ class ResponseProcessor:
 
                     tool_index += 1
 
+                # Report what batching the tool calls of this response saved
+                if tool_batch:
+                    batch_msg_obj = await self._yield_and_save_tool_batch(tool_batch, thread_id, thread_run_id)
+                    if batch_msg_obj: yield batch_msg_obj
+
             # --- Save and Yield Final Status ---
             if finish_reason:
                 finish_content = {"status_type": "finish", "finish_reason": finish_reason}
@@ -747,6 +927,13 @@ class ResponseProcessor:
                 )
                 if finish_msg_obj: yield finish_msg_obj
 
+        except asyncio.CancelledError:
+            # Stop requested: the tool gather is cancelled with us; record the calls it cut short
+            cancelled = True
+            logger.info(f"Response processing cancelled for thread {thread_id}")
+            await self._save_cancelled_tool_errors(executing_contexts, thread_id, thread_run_id)
+            raise
+
         except Exception as e:
              logger.error(f"Error processing non-streaming response: {str(e)}", exc_info=True)
              # Save and yield error status
@@ -764,149 +951,112 @@ class ResponseProcessor:
                 thread_id=thread_id, type="status", content=end_content, 
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
             )
-            if end_msg_obj: yield end_msg_obj
+            if end_msg_obj and not cancelled: yield end_msg_obj
 
-    # XML parsing methods
-    def _extract_tag_content(self, xml_chunk: str, tag_name: str) -> Tuple[Optional[str], Optional[str]]:
-        """Extract content between opening and closing tags, handling nested tags."""
-        start_tag = f'<{tag_name}'
-        end_tag = f'</{tag_name}>'
-        
-        try:
-            # Find start tag position
-            start_pos = xml_chunk.find(start_tag)
-            if start_pos == -1:
-                return None, xml_chunk
-                
-            # Find end of opening tag
-            tag_end = xml_chunk.find('>', start_pos)
-            if tag_end == -1:
-                return None, xml_chunk
-                
-            # Find matching closing tag
-            content_start = tag_end + 1
-            nesting_level = 1
-            pos = content_start
-            
-            while nesting_level > 0 and pos < len(xml_chunk):
-                next_start = xml_chunk.find(start_tag, pos)
-                next_end = xml_chunk.find(end_tag, pos)
-                
-                if next_end == -1:
-                    return None, xml_chunk
-                    
-                if next_start != -1 and next_start < next_end:
-                    nesting_level += 1
-                    pos = next_start + len(start_tag)
-                else:
-                    nesting_level -= 1
-                    if nesting_level == 0:
-                        content = xml_chunk[content_start:next_end]
-                        remaining = xml_chunk[next_end + len(end_tag):]
-                        return content, remaining
-                    else:
-                        pos = next_end + len(end_tag)
-            
-            return None, xml_chunk
-            
-        except Exception as e:
-            logger.error(f"Error extracting tag content: {e}")
-            return None, xml_chunk
+    async def _save_cost_message(
+        self,
+        thread_id: str,
+        thread_run_id: str,
+        llm_model: str,
+        usage: Dict[str, int],
+        usage_source: str,
+        fallback_cost: Optional[float] = None
+    ) -> None:
+        """Price the token usage of a turn and save it as a cost message.
 
-    def _extract_attribute(self, opening_tag: str, attr_name: str) -> Optional[str]:
-        """Extract attribute value from opening tag."""
-        try:
-            # Handle both single and double quotes with raw strings
-            patterns = [
-                fr'{attr_name}="([^"]*)"',  # Double quotes
-                fr"{attr_name}='([^']*)'",  # Single quotes
-                fr'{attr_name}=([^\s/>;]+)'  # No quotes - fixed escape sequence
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, opening_tag)
-                if match:
-                    value = match.group(1)
-                    # Unescape common XML entities
-                    value = value.replace('&quot;', '"').replace('&apos;', "'")
-                    value = value.replace('&lt;', '<').replace('&gt;', '>')
-                    value = value.replace('&amp;', '&')
-                    return value
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error extracting attribute: {e}")
-            return None
+        Provider-reported usage is also added to the process-wide prompt cache
+        stats, and the cost message records the call's cache hit rate. Responses
+        served from the LLM response cache cost nothing and are kept out of the stats.
+
+        Args:
+            thread_id: ID of the conversation thread
+            thread_run_id: ID of the current thread run
+            llm_model: The name of the LLM model used
+            usage: Normalized token counts (see services.llm.normalize_usage)
+            usage_source: "provider" for reported usage, "estimated" for local counts,
+                "cache" for the usage of a cached response replayed without a provider call
+            fallback_cost: Cost reported by LiteLLM, used when the model has no known pricing
+        """
+        cache_hit_rate = None
+        if usage_source == "provider":
+            prompt_cache_stats.record(llm_model, usage)
+            cache_hit_rate = prompt_cache_hit_rate(usage)
+            if usage["cache_read_input_tokens"] or usage["cache_creation_input_tokens"]:
+                logger.info(
+                    f"Prompt cache for {llm_model}: {usage['cache_read_input_tokens']} read, "
+                    f"{usage['cache_creation_input_tokens']} written, call hit rate {cache_hit_rate:.1%}, "
+                    f"process hit rate {prompt_cache_stats.hit_rate(llm_model):.1%}"
+                )
+
+        if usage_source == "cache":
+            final_cost = 0.0
+        else:
+            final_cost = calculate_cost(llm_model, usage)
+            if final_cost is None:
+                final_cost = fallback_cost
+            if not final_cost:
+                logger.info(f"No cost calculated for model {llm_model} (usage: {usage}), not storing cost message.")
+                return
+
+        logger.info(f"Calculated cost: {final_cost} ({usage_source} usage: {usage})")
+        await self.add_message(
+            thread_id=thread_id,
+            type="cost",
+            content={"cost": final_cost, **usage, "cache_hit_rate": cache_hit_rate, "usage_source": usage_source},
+            is_llm_message=False, # Cost is metadata
+            metadata={"thread_run_id": thread_run_id} # Keep track of the run
+        )
 
+    def _tool_progress_message(
+        self,
+        context: ToolExecutionContext,
+        progress: ToolProgress,
+        thread_id: str,
+        thread_run_id: str
+    ) -> Dict[str, Any]:
+        """Build a transient (unsaved) tool_progress status frame."""
+        now_progress = datetime.now(timezone.utc).isoformat()
+        content = {
+            "role": "assistant", "status_type": "tool_progress",
+            "function_name": context.function_name,
+            "xml_tag_name": context.xml_tag_name,
+            "tool_index": context.tool_index,
+            "tool_call_id": context.tool_call.get("id"), # Include tool_call ID if native
+            "output": progress.output
+        }
+        return {
+            "message_id": None, "thread_id": thread_id, "type": "status", "is_llm_message": False,
+            "content": json.dumps(content),
+            "metadata": json.dumps({"thread_run_id": thread_run_id}),
+            "created_at": now_progress, "updated_at": now_progress
+        }
+
+    def _content_chunk_message(self, thread_id: str, thread_run_id: str, content: str) -> Dict[str, Any]:
+        """Build a transient (unsaved) assistant content chunk frame."""
+        now_chunk = datetime.now(timezone.utc).isoformat()
+        return {
+            "message_id": None, "thread_id": thread_id, "type": "assistant",
+            "is_llm_message": True,
+            "content": json.dumps({"role": "assistant", "content": content}),
+            "metadata": json.dumps({"stream_status": "chunk", "thread_run_id": thread_run_id}),
+            "created_at": now_chunk, "updated_at": now_chunk
+        }
+
+    # XML parsing methods
     def _extract_xml_chunks(self, content: str) -> List[str]:
-        """Extract complete XML chunks using start and end pattern matching."""
-        chunks = []
-        pos = 0
-        
+        """Extract complete XML chunks for all registered tags in a single pass."""
         try:
-            while pos < len(content):
-                # Find the next tool tag
-                next_tag_start = -1
-                current_tag = None
-                
-                # Find the earliest occurrence of any registered tag
-                for tag_name in self.tool_registry.xml_tools.keys():
-                    start_pattern = f'<{tag_name}'
-                    tag_pos = content.find(start_pattern, pos)
-                    
-                    if tag_pos != -1 and (next_tag_start == -1 or tag_pos < next_tag_start):
-                        next_tag_start = tag_pos
-                        current_tag = tag_name
-                
-                if next_tag_start == -1 or not current_tag:
-                    break
-                
-                # Find the matching end tag
-                end_pattern = f'</{current_tag}>'
-                tag_stack = []
-                chunk_start = next_tag_start
-                current_pos = next_tag_start
-                
-                while current_pos < len(content):
-                    # Look for next start or end tag of the same type
-                    next_start = content.find(f'<{current_tag}', current_pos + 1)
-                    next_end = content.find(end_pattern, current_pos)
-                    
-                    if next_end == -1:  # No closing tag found
-                        break
-                    
-                    if next_start != -1 and next_start < next_end:
-                        # Found nested start tag
-                        tag_stack.append(next_start)
-                        current_pos = next_start + 1
-                    else:
-                        # Found end tag
-                        if not tag_stack:  # This is our matching end tag
-                            chunk_end = next_end + len(end_pattern)
-                            chunk = content[chunk_start:chunk_end]
-                            chunks.append(chunk)
-                            pos = chunk_end
-                            break
-                        else:
-                            # Pop nested tag
-                            tag_stack.pop()
-                            current_pos = next_end + 1
-                
-                if current_pos >= len(content):  # Reached end without finding closing tag
-                    break
-                
-                pos = max(pos + 1, current_pos)
-        
+            return extract_xml_chunks(content, self.tool_registry.xml_tools.keys())
         except Exception as e:
             logger.error(f"Error extracting XML chunks: {e}")
             logger.error(f"Content was: {content}")
-        
-        return chunks
+            return []
 
     def _parse_xml_tool_call(self, xml_chunk: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
         """Parse XML chunk into tool call format and return parsing details.
         
+        Uses the XMLToolParser compiled for the tag at registration time.
+        
         Returns:
             Tuple of (tool_call, parsing_details) or None if parsing fails.
             - tool_call: Dict with 'function_name', 'xml_tag_name', 'arguments'
@@ -914,7 +1064,7 @@ class ResponseProcessor:
         """
         try:
             # Extract tag name and validate
-            tag_match = re.match(r'<([^\s>]+)', xml_chunk)
+            tag_match = XML_TAG_NAME_PATTERN.match(xml_chunk)
             if not tag_match:
                 logger.error(f"No tag found in XML chunk: {xml_chunk}")
                 return None
@@ -923,82 +1073,22 @@ class ResponseProcessor:
             xml_tag_name = tag_match.group(1)
             logger.info(f"Found XML tag: {xml_tag_name}")
             
-            # Get tool info and schema from registry
+            # Get tool info and compiled parser from registry
             tool_info = self.tool_registry.get_xml_tool(xml_tag_name)
             if not tool_info or not tool_info['schema'].xml_schema:
                 logger.error(f"No tool or schema found for tag: {xml_tag_name}")
                 return None
             
-            # This is the actual function name to call (e.g., "create_file")
-            function_name = tool_info['method']
-            
-            schema = tool_info['schema'].xml_schema
-            params = {}
-            remaining_chunk = xml_chunk
-            
-            # --- Store detailed parsing info ---
-            parsing_details = {
-                "attributes": {},
-                "elements": {},
-                "text_content": None,
-                "root_content": None,
-                "raw_chunk": xml_chunk # Store the original chunk for reference
-            }
-            # ---
-            
-            # Process each mapping
-            for mapping in schema.mappings:
-                try:
-                    if mapping.node_type == "attribute":
-                        # Extract attribute from opening tag
-                        opening_tag = remaining_chunk.split('>', 1)[0]
-                        value = self._extract_attribute(opening_tag, mapping.path)
-                        if value is not None:
-                            params[mapping.param_name] = value
-                            parsing_details["attributes"][mapping.path] = value # Store raw attribute
-                            logger.info(f"Found attribute {mapping.path} -> {mapping.param_name}: {value}")
-                
-                    elif mapping.node_type == "element":
-                        # Extract element content
-                        content, remaining_chunk = self._extract_tag_content(remaining_chunk, mapping.path)
-                        if content is not None:
-                            params[mapping.param_name] = content.strip()
-                            parsing_details["elements"][mapping.path] = content.strip() # Store raw element content
-                            logger.info(f"Found element {mapping.path} -> {mapping.param_name}")
-                
-                    elif mapping.node_type == "text":
-                        # Extract text content
-                        content, _ = self._extract_tag_content(remaining_chunk, xml_tag_name)
-                        if content is not None:
-                            params[mapping.param_name] = content.strip()
-                            parsing_details["text_content"] = content.strip() # Store raw text content
-                            logger.info(f"Found text content for {mapping.param_name}")
-                
-                    elif mapping.node_type == "content":
-                        # Extract root content
-                        content, _ = self._extract_tag_content(remaining_chunk, xml_tag_name)
-                        if content is not None:
-                            params[mapping.param_name] = content.strip()
-                            parsing_details["root_content"] = content.strip() # Store raw root content
-                            logger.info(f"Found root content for {mapping.param_name}")
-                
-                except Exception as e:
-                    logger.error(f"Error processing mapping {mapping}: {e}")
-                    continue
-            
-            # Validate required parameters
-            missing = [mapping.param_name for mapping in schema.mappings if mapping.required and mapping.param_name not in params]
-            if missing:
-                logger.error(f"Missing required parameters: {missing}")
-                logger.error(f"Current params: {params}")
-                logger.error(f"XML chunk: {xml_chunk}")
+            parsed = tool_info['parser'].parse(xml_chunk)
+            if not parsed:
                 return None
+            params, parsing_details = parsed
             
             # Create tool call with clear separation between function_name and xml_tag_name
             tool_call = {
-                "function_name": function_name,  # The actual method to call (e.g., create_file)
-                "xml_tag_name": xml_tag_name,    # The original XML tag (e.g., create-file)
-                "arguments": params              # The extracted parameters
+                "function_name": tool_info['method'],  # The actual method to call (e.g., create_file)
+                "xml_tag_name": xml_tag_name,          # The original XML tag (e.g., create-file)
+                "arguments": params                    # The extracted parameters
             }
             
             logger.info(f"Created tool call: {tool_call}")
@@ -1035,8 +1125,21 @@ class ResponseProcessor:
         return parsed_data
 
     # Tool execution methods
-    async def _execute_tool(self, tool_call: Dict[str, Any]) -> ToolResult:
-        """Execute a single tool call and return the result."""
+    async def _execute_tool(
+        self,
+        tool_call: Dict[str, Any],
+        progress_callback: Optional[Callable[[ToolProgress], None]] = None
+    ) -> ToolResult:
+        """Execute a single tool call and return the result.
+        
+        Tools implemented as async generators are consumed to completion; their
+        progress items are passed to progress_callback (if given) as they arrive.
+        The call waits for a slot when its tool class declares max_concurrency and
+        fails with a timeout result when it runs longer than its declared timeout.
+        Blocking calls the tool runs via Tool.run_blocking cannot be interrupted, so
+        a timed-out call only returns, and a cancelled call only frees its slot,
+        once they have returned.
+        """
         try:
             function_name = tool_call["function_name"]
             arguments = tool_call["arguments"]
@@ -1058,18 +1161,159 @@ class ResponseProcessor:
                 logger.error(f"Tool function '{function_name}' not found in registry")
                 return ToolResult(success=False, output=f"Tool function '{function_name}' not found")
             
+            limits = self.tool_registry.get_execution_limits(function_name)
+            semaphore = None
+            if limits.max_concurrency:
+                tool_class = type(self.tool_registry.get_tool_instance(function_name)).__name__
+                semaphore = _get_tool_semaphore(tool_class, limits.max_concurrency)
+                if semaphore.locked():
+                    logger.debug(f"Tool {function_name} waits for one of {limits.max_concurrency} {tool_class} slots")
+
+            async def invoke() -> ToolResult:
+                result = tool_fn(**arguments)
+                if inspect.isasyncgen(result):
+                    return await self._consume_streaming_tool(function_name, result, progress_callback)
+                return await result
+
             logger.debug(f"Found tool function for '{function_name}', executing...")
-            result = await tool_fn(**arguments)
+            if semaphore:
+                await semaphore.acquire()
+            # Worker threads started via Tool.run_blocking; they outlive a timeout or cancellation
+            workers: List[asyncio.Future] = []
+            workers_token = tool_call_workers.set(workers)
+            try:
+                # The timeout starts once a slot is held, so queueing does not count against it
+                result = await asyncio.wait_for(invoke(), timeout=limits.timeout)
+            except asyncio.TimeoutError:
+                if limits.timeout is None:
+                    raise
+                logger.warning(f"Tool {function_name} timed out after {limits.timeout}s")
+                running = [worker for worker in workers if not worker.done()]
+                if running:
+                    # Finishing now would let a conflicting call overlap the still-running thread
+                    logger.warning(f"Tool {function_name} waits for {len(running)} blocking call(s) to return")
+                    await asyncio.wait(running)
+                return ToolResult(success=False, output=f"Tool {function_name} timed out after {limits.timeout} seconds")
+            finally:
+                tool_call_workers.reset(workers_token)
+                if semaphore:
+                    # After a cancellation the slot stays taken until the worker threads return
+                    _release_after(semaphore, workers)
             logger.info(f"Tool execution complete: {function_name} -> {result}")
             return result
         except Exception as e:
             logger.error(f"Error executing tool {tool_call['function_name']}: {str(e)}", exc_info=True)
             return ToolResult(success=False, output=f"Error executing tool: {str(e)}")
 
+    async def _cancel_tool_executions(self, executions: List[Dict[str, Any]]) -> List[ToolExecutionContext]:
+        """Cancel the unfinished tasks of streamed tool executions.
+        
+        Waits up to TOOL_CANCEL_GRACE_PERIOD for the tasks to unwind so tool
+        cleanup runs before the run ends.
+        
+        Args:
+            executions: Streamed tool executions ({'task', 'context', ...})
+            
+        Returns:
+            Contexts of the executions that were cut short
+        """
+        unfinished = [execution for execution in executions if not execution["task"].done()]
+        if not unfinished:
+            return []
+        tasks = [execution["task"] for execution in unfinished]
+        for task in tasks:
+            task.cancel()
+        logger.info(f"Cancelled {len(tasks)} in-flight tool executions")
+        _, still_running = await asyncio.wait(tasks, timeout=TOOL_CANCEL_GRACE_PERIOD)
+        if still_running:
+            logger.warning(f"{len(still_running)} tool executions did not finish unwinding after cancellation")
+        return [execution["context"] for execution in unfinished]
+
+    async def _save_cancelled_tool_errors(
+        self,
+        contexts: List[ToolExecutionContext],
+        thread_id: str,
+        thread_run_id: str
+    ) -> None:
+        """Save a tool error status row for each tool call cut short by a stop request."""
+        for context in contexts:
+            context.error = asyncio.CancelledError(TOOL_CANCELLED_MESSAGE)
+            try:
+                await self._yield_and_save_tool_error(context, thread_id, thread_run_id)
+            except Exception as e:
+                logger.error(f"Failed to record cancellation of tool index {context.tool_index}: {str(e)}")
+
+    async def _consume_streaming_tool(
+        self,
+        function_name: str,
+        tool_stream: AsyncGenerator,
+        progress_callback: Optional[Callable[[ToolProgress], None]] = None
+    ) -> ToolResult:
+        """Run a streaming tool to completion and return its final result.
+        
+        Args:
+            function_name: Name of the tool function
+            tool_stream: Async generator returned by the tool
+            progress_callback: Optional callback receiving each progress item
+            
+        Returns:
+            The last ToolResult yielded, or a successful result aggregating all
+            progress output if the tool yielded none
+        """
+        final_result = None
+        outputs = []
+        try:
+            async for item in tool_stream:
+                if isinstance(item, ToolResult):
+                    final_result = item
+                    continue
+                progress = item if isinstance(item, ToolProgress) else ToolProgress(output=str(item))
+                outputs.append(progress.output)
+                if progress_callback:
+                    progress_callback(progress)
+        finally:
+            # Runs the tool's own cleanup when it is cancelled or times out mid-stream
+            await tool_stream.aclose()
+
+        if final_result is None:
+            logger.debug(f"Streaming tool {function_name} yielded no ToolResult, aggregating {len(outputs)} progress items")
+            final_result = ToolResult(success=True, output="\n".join(outputs))
+        return final_result
+
+    def _create_tool_batch(self, config: ProcessorConfig) -> Optional[ToolCallBatch]:
+        """Create the batch for one response's tool calls, or None when batching is off."""
+        if not config.tool_call_batching:
+            return None
+        scheduler = ToolScheduler(self.tool_registry, self._execute_tool) if config.tool_execution_strategy == "scheduled" else None
+        return ToolCallBatch(self._execute_tool, scheduler=scheduler)
+
+    def _start_tool_execution(
+        self,
+        tool_call: Dict[str, Any],
+        context: ToolExecutionContext,
+        tool_executor: Optional[Union[ToolScheduler, ToolCallBatch]],
+        progress_queue: asyncio.Queue
+    ) -> asyncio.Task:
+        """Start a tool call during streaming, forwarding its progress to progress_queue.
+        
+        The call is submitted to tool_executor (a scheduler or an ordered batch) when
+        given, and started immediately otherwise.
+        """
+        def report_progress(progress: ToolProgress) -> None:
+            progress_queue.put_nowait((context, progress))
+
+        async def execute(call: Dict[str, Any]) -> ToolResult:
+            return await self._execute_tool(call, progress_callback=report_progress)
+
+        if tool_executor:
+            return tool_executor.submit(tool_call, execute=execute)
+        return asyncio.create_task(execute(tool_call))
+
     async def _execute_tools(
         self, 
         tool_calls: List[Dict[str, Any]], 
-        execution_strategy: ToolExecutionStrategy = "sequential"
+        execution_strategy: ToolExecutionStrategy = "sequential",
+        tool_batch: Optional[ToolCallBatch] = None
     ) -> List[Tuple[Dict[str, Any], ToolResult]]:
         """Execute tool calls with the specified strategy.
         
@@ -1081,16 +1325,26 @@ class ResponseProcessor:
             execution_strategy: Strategy for executing tools:
                 - "sequential": Execute tools one after another, waiting for each to complete
                 - "parallel": Execute all tools simultaneously for better performance 
+                - "scheduled": Execute tools concurrently, serializing only calls whose
+                  declared execution traits conflict
+            tool_batch: Optional batch; when given, it runs the calls (through its own
+                scheduler for the "scheduled" strategy)
                 
         Returns:
             List of tuples containing the original tool call and its result
         """
+        if tool_batch:
+            logger.info(f"Executing {len(tool_calls)} tools as a batch")
+            return await tool_batch.run(tool_calls)
+
         logger.info(f"Executing {len(tool_calls)} tools with strategy: {execution_strategy}")
             
         if execution_strategy == "sequential":
             return await self._execute_tools_sequentially(tool_calls)
         elif execution_strategy == "parallel":
             return await self._execute_tools_in_parallel(tool_calls)
+        elif execution_strategy == "scheduled":
+            return await ToolScheduler(self.tool_registry, self._execute_tool).run(tool_calls)
         else:
             logger.warning(f"Unknown execution strategy: {execution_strategy}, falling back to sequential")
             return await self._execute_tools_sequentially(tool_calls)
@@ -1163,10 +1417,17 @@ class ResponseProcessor:
             logger.info(f"Executing {len(tool_calls)} tools in parallel: {tool_names}")
             
             # Create tasks for all tool calls
-            tasks = [self._execute_tool(tool_call) for tool_call in tool_calls]
+            tasks = [asyncio.create_task(self._execute_tool(tool_call)) for tool_call in tool_calls]
             
             # Execute all tasks concurrently with error handling
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+            except asyncio.CancelledError:
+                # Stop requested: make sure every tool is cancelled and give them a moment to clean up
+                for task in tasks:
+                    task.cancel()
+                await asyncio.wait(tasks, timeout=TOOL_CANCEL_GRACE_PERIOD)
+                raise
             
             # Process results and handle any exceptions
             processed_results = []
@@ -1392,7 +1653,7 @@ class ResponseProcessor:
             metadata["linked_tool_result_message_id"] = tool_message_id
             
         # <<< ADDED: Signal if this is a terminating tool >>>
-        if context.function_name in ['ask', 'complete']:
+        if context.function_name in TERMINAL_TOOL_NAMES:
             metadata["agent_should_terminate"] = True
             logger.info(f"Marking tool status for '{context.function_name}' with termination signal.")
         # <<< END ADDED >>>
@@ -1402,6 +1663,18 @@ class ResponseProcessor:
         )
         return saved_message_obj
 
+    async def _yield_and_save_tool_batch(self, tool_batch: ToolCallBatch, thread_id: str, thread_run_id: str) -> Optional[Dict[str, Any]]:
+        """Formats, saves, and returns the status message summarizing a tool call batch."""
+        summary = tool_batch.summary()
+        logger.info(f"Tool batch: {summary['executed']} executed, {summary['skipped']} skipped, "
+                    f"{summary['llm_turns_saved']} LLM turns saved")
+        content = {"role": "assistant", "status_type": "tool_batch", **summary}
+        saved_message_obj = await self.add_message(
+            thread_id=thread_id, type="status", content=content, is_llm_message=False,
+            metadata={"thread_run_id": thread_run_id}
+        )
+        return saved_message_obj
+
     async def _yield_and_save_tool_error(self, context: ToolExecutionContext, thread_id: str, thread_run_id: str) -> Optional[Dict[str, Any]]:
         """Formats, saves, and returns a tool error status message."""
         error_msg = str(context.error) if context.error else "Unknown error during tool execution"
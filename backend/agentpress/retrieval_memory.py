@@ -0,0 +1,314 @@
+"""
+Retrieval memory over the full history of threads.
+
+Once a thread is summarized, messages before the summary leave the LLM context
+and their details are only reachable through the summary text. This module
+keeps a per-thread index of those messages so the most relevant ones can be
+brought back for the current turn:
+- Messages are cut into overlapping character chunks
+- Chunks are embedded locally with a signed hashing vectorizer (word unigrams
+  and bigrams) into L2-normalized NumPy vectors; no embedding service is called
+- The index grows incrementally as rows are written, and is loaded in full
+  the first time a thread is searched
+- A search scores every chunk older than the latest summary with one
+  matrix-vector product and returns the top-k snippets
+- Threads are evicted least-recently-used once a thread or byte budget is exceeded
+"""
+
+import re
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from agentpress.message_cache import parse_timestamp, to_llm_message
+from utils.logger import logger
+
+# Defaults for the vectorizer and the index budget
+DEFAULT_DIMENSIONS = 1024
+DEFAULT_MAX_THREADS = 64
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024  # Vectors and chunk texts of all indexed threads
+
+CHUNK_CHARS = 1000
+CHUNK_OVERLAP_CHARS = 200
+DEFAULT_TOP_K = 4
+MIN_SIMILARITY = 0.1  # Chunks scoring lower are not worth the tokens
+
+# Messages at the end of the context that describe the current turn
+QUERY_MESSAGES = 3
+QUERY_MAX_CHARS = 4000
+
+_TERM = re.compile(r"[a-z0-9_][a-z0-9_.\-/]*[a-z0-9_]|[a-z0-9]")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have i if in is it of on or that the this to was we were will with you".split()
+)
+
+
+def message_text(message: Any) -> str:
+    """Get the text of an LLM message, ignoring images and other non-text blocks."""
+    if not isinstance(message, dict):
+        return ""
+    content = message.get('content')
+    if isinstance(content, list):
+        content = "\n".join(block.get('text', '') for block in content if isinstance(block, dict) and block.get('type') == 'text')
+    text = content if isinstance(content, str) else ""
+    for tool_call in message.get('tool_calls') or []:
+        if isinstance(tool_call, dict) and isinstance(tool_call.get('function'), dict):
+            text += f"\n{tool_call['function'].get('name', '')} {tool_call['function'].get('arguments', '')}"
+    return text
+
+
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS, overlap_chars: int = CHUNK_OVERLAP_CHARS) -> List[str]:
+    """Cut text into chunks of at most chunk_chars, each overlapping the previous one."""
+    text = text.strip()
+    if len(text) <= chunk_chars:
+        return [text] if text else []
+    step = chunk_chars - overlap_chars
+    return [text[start:start + chunk_chars] for start in range(0, len(text) - overlap_chars, step)]
+
+
+class HashingVectorizer:
+    """Embeds text into a fixed number of dimensions by hashing its terms.
+
+    Each word and word bigram is hashed (CRC32, stable across processes) to a
+    dimension and a sign; counts are dampened logarithmically and the vector is
+    L2-normalized, so the dot product of two vectors is their cosine similarity.
+
+    Attributes:
+        dimensions (int): Length of the vectors
+    """
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        """Initialize the vectorizer.
+
+        Args:
+            dimensions: Length of the vectors
+        """
+        self.dimensions = dimensions
+
+    def transform(self, texts: List[str]) -> np.ndarray:
+        """Embed texts.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Float32 matrix with one L2-normalized row per text (all zeros for texts without terms)
+        """
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [word for word in _TERM.findall(text.lower()) if word not in _STOPWORDS]
+            terms = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+            if not terms:
+                continue
+            hashes = np.fromiter((zlib.crc32(term.encode('utf-8')) for term in terms), dtype=np.uint32, count=len(terms))
+            indices = (hashes % self.dimensions).astype(np.int64)
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+            counts = np.bincount(indices, weights=signs, minlength=self.dimensions)
+            vectors[row] = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+@dataclass(frozen=True)
+class RetrievedSnippet:
+    """A chunk of an earlier message found by a search.
+
+    Attributes:
+        message_id (str): Message the chunk comes from
+        created_at (datetime): Creation time of the message
+        role (str): Role of the message
+        text (str): The chunk
+        score (float): Cosine similarity to the query
+    """
+    message_id: str
+    created_at: datetime
+    role: str
+    text: str
+    score: float
+
+
+class _ThreadIndex:
+    """Chunk vectors of one thread, in arrays grown by doubling."""
+
+    def __init__(self, dimensions: int):
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.timestamps = np.zeros(0, dtype=np.float64)
+        self.size = 0
+        self.chunks: List[RetrievedSnippet] = []
+        self.message_ids: set = set()
+        self.size_bytes = 0
+
+    def append(self, vectors: np.ndarray, snippets: List[RetrievedSnippet]) -> None:
+        needed = self.size + len(snippets)
+        if needed > len(self.vectors):
+            capacity = max(needed, 2 * len(self.vectors), 16)
+            grown = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            timestamps = np.zeros(capacity, dtype=np.float64)
+            timestamps[:self.size] = self.timestamps[:self.size]
+            self.size_bytes += grown.nbytes + timestamps.nbytes - self.vectors.nbytes - self.timestamps.nbytes
+            self.vectors, self.timestamps = grown, timestamps
+        self.vectors[self.size:needed] = vectors
+        self.timestamps[self.size:needed] = [snippet.created_at.timestamp() for snippet in snippets]
+        self.chunks.extend(snippets)
+        self.size = needed
+        self.size_bytes += sum(len(snippet.text) for snippet in snippets)
+
+
+class RetrievalMemory:
+    """Bounded LRU store of per-thread retrieval indexes.
+
+    Attributes:
+        vectorizer (HashingVectorizer): Embeds chunks and queries
+        max_threads (int): Number of threads kept before the least recently used is evicted
+        max_bytes (int): Estimated index size kept before threads are evicted
+    """
+
+    def __init__(
+        self,
+        dimensions: int = DEFAULT_DIMENSIONS,
+        max_threads: int = DEFAULT_MAX_THREADS,
+        max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        """Initialize an empty store.
+
+        Args:
+            dimensions: Length of the chunk vectors
+            max_threads: Number of threads kept before the least recently used is evicted
+            max_bytes: Estimated index size kept before threads are evicted
+        """
+        self.vectorizer = HashingVectorizer(dimensions)
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self._threads: "OrderedDict[str, _ThreadIndex]" = OrderedDict()
+        self._size_bytes = 0
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._threads
+
+    def load(self, thread_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Replace the index of a thread with one built from all its LLM message rows.
+
+        Args:
+            thread_id: Thread the rows belong to
+            rows: Rows with message_id, type, content and created_at
+        """
+        self.invalidate(thread_id)
+        self._threads[thread_id] = _ThreadIndex(self.vectorizer.dimensions)
+        self.add_rows(thread_id, rows)
+        logger.debug(f"Indexed {self._threads[thread_id].size if thread_id in self else 0} chunks of thread {thread_id} for retrieval")
+
+    def add_rows(self, thread_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Index new LLM message rows of a loaded thread.
+
+        Rows of threads that are not loaded are ignored; the first search loads
+        them in full. Summary rows and rows indexed before are skipped.
+
+        Args:
+            thread_id: Thread the rows belong to
+            rows: Rows with message_id, type, content and created_at
+        """
+        index = self._threads.get(thread_id)
+        if index is None:
+            return
+
+        snippets: List[RetrievedSnippet] = []
+        for row in rows:
+            message_id = row.get('message_id')
+            created_at = row.get('created_at')
+            if not message_id or not created_at or message_id in index.message_ids:
+                continue
+            index.message_ids.add(message_id)
+            if row.get('type') == 'summary':
+                continue
+            message = to_llm_message(row)
+            role = message.get('role', row.get('type', '')) if isinstance(message, dict) else row.get('type', '')
+            timestamp = parse_timestamp(created_at)
+            snippets.extend(
+                RetrievedSnippet(message_id, timestamp, role, chunk, 0.0)
+                for chunk in chunk_text(message_text(message))
+            )
+
+        if snippets:
+            before = index.size_bytes
+            index.append(self.vectorizer.transform([snippet.text for snippet in snippets]), snippets)
+            self._size_bytes += index.size_bytes - before
+        self._threads.move_to_end(thread_id)
+        self._evict()
+
+    def search(
+        self,
+        thread_id: str,
+        query: str,
+        before: datetime,
+        top_k: int = DEFAULT_TOP_K,
+        min_similarity: float = MIN_SIMILARITY
+    ) -> List[RetrievedSnippet]:
+        """Find the chunks of a thread most similar to a query.
+
+        Args:
+            thread_id: Thread to search
+            query: Text describing the current turn
+            before: Only chunks of messages created before this time are searched
+            top_k: Number of snippets returned at most
+            min_similarity: Snippets scoring lower are not returned
+
+        Returns:
+            Snippets in the order of their messages in the thread
+        """
+        index = self._threads.get(thread_id)
+        if index is None or index.size == 0 or top_k <= 0:
+            return []
+        self._threads.move_to_end(thread_id)
+
+        query_vector = self.vectorizer.transform([query])[0]
+        scores = index.vectors[:index.size] @ query_vector
+        scores[index.timestamps[:index.size] >= before.timestamp()] = -1.0
+
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k] if index.size > top_k else np.arange(index.size)
+        selected = [position for position in candidates if scores[position] >= min_similarity]
+        snippets = [replace(index.chunks[position], score=float(scores[position])) for position in selected]
+        return sorted(snippets, key=lambda snippet: snippet.created_at)
+
+    def invalidate(self, thread_id: str) -> None:
+        """Drop the index of a thread."""
+        index = self._threads.pop(thread_id, None)
+        if index is not None:
+            self._size_bytes -= index.size_bytes
+
+    def _evict(self) -> None:
+        """Evict least recently used threads until the store is within budget."""
+        while len(self._threads) > 1 and (
+            len(self._threads) > self.max_threads or self._size_bytes > self.max_bytes
+        ):
+            thread_id, index = self._threads.popitem(last=False)
+            self._size_bytes -= index.size_bytes
+            logger.debug(f"Evicted thread {thread_id} from retrieval memory ({index.size_bytes} bytes)")
+
+
+def build_query(messages: List[Dict[str, Any]], temporary_message: Optional[Dict[str, Any]] = None) -> str:
+    """Describe the current turn by the text of the last messages of the context."""
+    recent = messages[-QUERY_MESSAGES:] + ([temporary_message] if temporary_message else [])
+    return "\n".join(message_text(message) for message in recent)[-QUERY_MAX_CHARS:]
+
+
+def format_retrieved_context(snippets: List[RetrievedSnippet]) -> Optional[Dict[str, Any]]:
+    """Format snippets as the message injected into the LLM context, or None if there are none."""
+    if not snippets:
+        return None
+    excerpts = "\n\n".join(
+        f"[{snippet.created_at.isoformat()} {snippet.role}]\n{snippet.text}" for snippet in snippets
+    )
+    return {
+        "role": "user",
+        "content": f"""======== RELEVANT EARLIER MESSAGES ========
+The following excerpts come from earlier in this conversation, before the summary above, and may be relevant to the current step:
+
+{excerpts}
+
+======== END OF EARLIER MESSAGES ========"""
+    }
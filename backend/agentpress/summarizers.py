@@ -0,0 +1,274 @@
+"""
+Pluggable summarizer backends for ContextManager.
+
+A summarizer turns the messages being replaced into summary text:
+- LLMSummarizer calls an LLM (map-reduce for long histories, see ContextManager)
+- ExtractiveSummarizer scores sentences with TF-IDF in NumPy and keeps the best
+  ones, plus every tool name, file path and URL; it runs offline in milliseconds
+- TieredSummarizer tries one backend and falls back to another when the result
+  is missing or does not fit the token budget
+
+The backend is chosen per deployment with the CONTEXT_SUMMARIZER_BACKEND
+environment variable: "llm" (default), "extractive" or "tiered" (extractive
+first, LLM as fallback).
+"""
+
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Awaitable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from agentpress.context_packer import tool_result_tag
+from agentpress.token_counting import count_message_tokens
+from utils.logger import logger
+
+SUMMARIZER_BACKEND_ENV = "CONTEXT_SUMMARIZER_BACKEND"
+DEFAULT_SUMMARIZER_BACKEND = "llm"
+
+# Rough characters per token, used to budget the extractive summary before counting it
+CHARS_PER_TOKEN = 4
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_TERM = re.compile(r"[a-z0-9_]{2,}")
+_URL = re.compile(r"https?://[^\s'\"<>)\]]+")
+_PATH = re.compile(r"(?<![\w:/])(?:/[\w.\-]+)+|\b[\w\-]+(?:/[\w.\-]+)*\.(?:py|js|ts|tsx|jsx|json|md|html|css|txt|csv|yaml|yml|toml|sh|sql|pdf|png|jpg)\b")
+_XML_TAG = re.compile(r"<([a-z][\w\-]*)[\s>/]")
+_DECISION = re.compile(r"\b(decid\w*|will|plan\w*|chose|choose|must|should|next|error\w*|fail\w*|fix\w*|complete\w*|done|todo)\b", re.IGNORECASE)
+
+# Sentence weights by where the sentence comes from; tool output is long and repetitive
+ROLE_WEIGHTS = {"user": 1.2, "assistant": 1.0, "tool_result": 0.4}
+DECISION_BOOST = 1.5
+FACT_BOOST = 1.3
+
+
+class Summarizer(ABC):
+    """Turns the messages replaced by a summary into summary text."""
+
+    name: str = "summarizer"
+
+    @abstractmethod
+    async def summarize(
+        self,
+        thread_id: str,
+        messages: List[Dict[str, Any]],
+        model: str,
+        target_tokens: int
+    ) -> Optional[str]:
+        """Summarize messages.
+
+        Args:
+            thread_id: ID of the thread being summarized
+            messages: Messages to summarize, in chronological order
+            model: Model whose tokenizer measures target_tokens (and that LLM backends call)
+            target_tokens: Size the summary should stay within
+
+        Returns:
+            Summary text, or None if the backend could not summarize
+        """
+
+
+class LLMSummarizer(Summarizer):
+    """Summarizes with an LLM call (or several, for long histories)."""
+
+    name = "llm"
+
+    def __init__(self, summarize_with_llm: Callable[[str, List[Dict[str, Any]], str], Awaitable[Optional[str]]]):
+        """Initialize the backend.
+
+        Args:
+            summarize_with_llm: Coroutine function (thread_id, messages, model) returning summary text
+        """
+        self._summarize_with_llm = summarize_with_llm
+
+    async def summarize(self, thread_id, messages, model, target_tokens):
+        return await self._summarize_with_llm(thread_id, messages, model)
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    """Get the text of a message, ignoring images and other non-text blocks."""
+    content = message.get('content')
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(block.get('text', '') for block in content if isinstance(block, dict) and block.get('type') == 'text')
+    return ""
+
+
+def _message_kind(message: Dict[str, Any]) -> str:
+    """Classify a message as user, assistant or tool_result for weighting."""
+    if tool_result_tag(message):
+        return "tool_result"
+    return "assistant" if message.get('role') == 'assistant' else "user"
+
+
+class ExtractiveSummarizer(Summarizer):
+    """Offline summarizer keeping the highest-scoring sentences and all key facts.
+
+    Sentences are scored by the TF-IDF weight of their terms across the
+    history, weighted by the kind of message they come from and boosted when
+    they state a decision or mention a file path or URL. The summary lists the
+    tools used, the file paths and URLs mentioned, and the selected sentences in
+    chronological order.
+    """
+
+    name = "extractive"
+
+    async def summarize(self, thread_id, messages, model, target_tokens):
+        facts, sentences = self._extract(messages)
+        fact_section = self._format_facts(facts)
+        budget_chars = target_tokens * CHARS_PER_TOKEN - len(fact_section)
+        if budget_chars <= 0:
+            logger.info(f"Key facts of thread {thread_id} alone exceed {target_tokens} tokens, extractive summary does not fit")
+            return None
+
+        selected = self._select(sentences, budget_chars)
+        key_points = "\n".join(f"- [{kind}] {text}" for kind, text in selected)
+        summary = f"{fact_section}\n## Key points (in order)\n{key_points}\n"
+        logger.info(f"Extractive summary of thread {thread_id}: {len(selected)} of {len(sentences)} sentences kept")
+        return summary
+
+    def _extract(self, messages: List[Dict[str, Any]]) -> Tuple[Dict[str, List[str]], List[Tuple[str, str]]]:
+        """Collect tool names, paths and URLs, and split messages into (kind, sentence) pairs."""
+        facts: Dict[str, List[str]] = {"tools": [], "paths": [], "urls": []}
+        sentences: List[Tuple[str, str]] = []
+
+        def remember(kind: str, values) -> None:
+            for value in values:
+                if value not in facts[kind]:
+                    facts[kind].append(value)
+
+        for message in messages:
+            text = _message_text(message)
+            kind = _message_kind(message)
+            if kind == "tool_result":
+                remember("tools", [tool_result_tag(message)])
+            elif kind == "assistant":
+                remember("tools", _XML_TAG.findall(text))
+                remember("tools", [call.get('function', {}).get('name') for call in message.get('tool_calls') or [] if isinstance(call, dict)])
+            urls = _URL.findall(text)
+            remember("urls", urls)
+            remember("paths", [path for path in _PATH.findall(text) if not any(path in url for url in urls)])
+            for sentence in _SENTENCE_SPLIT.split(text):
+                sentence = sentence.strip()
+                if len(sentence) >= 20:
+                    sentences.append((kind, sentence))
+
+        facts["tools"] = [tool for tool in facts["tools"] if tool and tool != "tool_result"]
+        return facts, sentences
+
+    def _format_facts(self, facts: Dict[str, List[str]]) -> str:
+        sections = []
+        for title, key in (("Tools used", "tools"), ("Files and paths", "paths"), ("URLs", "urls")):
+            if facts[key]:
+                sections.append(f"## {title}\n" + "\n".join(f"- {value}" for value in facts[key]))
+        return "\n".join(sections) + "\n" if sections else ""
+
+    def _select(self, sentences: List[Tuple[str, str]], budget_chars: int) -> List[Tuple[str, str]]:
+        """Pick the best-scoring sentences within budget_chars, returned in original order."""
+        if not sentences:
+            return []
+        scores = self.score_sentences([text for _, text in sentences])
+        weights = np.array([
+            ROLE_WEIGHTS[kind]
+            * (DECISION_BOOST if _DECISION.search(text) else 1.0)
+            * (FACT_BOOST if _URL.search(text) or _PATH.search(text) else 1.0)
+            for kind, text in sentences
+        ])
+        # Later sentences describe the latest state; favour them slightly
+        recency = np.linspace(1.0, 1.5, num=len(sentences))
+        ranked = np.argsort(-(scores * weights * recency), kind="stable")
+
+        chosen, used, seen = [], 0, set()
+        for index in ranked:
+            kind, text = sentences[index]
+            if text in seen:
+                continue
+            if used + len(text) + 16 > budget_chars:
+                continue
+            chosen.append(index)
+            seen.add(text)
+            used += len(text) + 16
+        return [sentences[index] for index in sorted(chosen)]
+
+    @staticmethod
+    def score_sentences(sentences: List[str]) -> np.ndarray:
+        """Score sentences by the length-normalized TF-IDF weight of their terms.
+
+        Args:
+            sentences: Sentences of the history; each one is a document
+
+        Returns:
+            One score per sentence
+        """
+        vocabulary: Dict[str, int] = {}
+        sentence_ids: List[int] = []
+        term_ids: List[int] = []
+        for sentence_id, sentence in enumerate(sentences):
+            for term in _TERM.findall(sentence.lower()):
+                sentence_ids.append(sentence_id)
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+        if not term_ids:
+            return np.zeros(len(sentences))
+
+        # (sentence, term) pairs with their counts
+        pairs = np.array(sentence_ids, dtype=np.int64) * len(vocabulary) + np.array(term_ids, dtype=np.int64)
+        unique_pairs, term_counts = np.unique(pairs, return_counts=True)
+        pair_sentences = unique_pairs // len(vocabulary)
+        pair_terms = unique_pairs % len(vocabulary)
+
+        document_frequency = np.bincount(pair_terms, minlength=len(vocabulary))
+        idf = np.log((1 + len(sentences)) / (1 + document_frequency)) + 1.0
+        weights = (1 + np.log(term_counts)) * idf[pair_terms]
+        totals = np.bincount(pair_sentences, weights=weights, minlength=len(sentences))
+        lengths = np.bincount(np.array(sentence_ids, dtype=np.int64), minlength=len(sentences))
+        return totals / np.sqrt(np.maximum(lengths, 1))
+
+
+class TieredSummarizer(Summarizer):
+    """Tries a primary backend and falls back when its summary is missing or over budget."""
+
+    name = "tiered"
+
+    def __init__(self, primary: Summarizer, fallback: Summarizer):
+        """Initialize the backend.
+
+        Args:
+            primary: Backend tried first (e.g. extractive)
+            fallback: Backend used when the primary result does not fit (e.g. LLM)
+        """
+        self.primary = primary
+        self.fallback = fallback
+
+    async def summarize(self, thread_id, messages, model, target_tokens):
+        summary = await self.primary.summarize(thread_id, messages, model, target_tokens)
+        if summary:
+            tokens = (await count_message_tokens(model, [{"role": "user", "content": summary}]))[0]
+            if tokens <= target_tokens:
+                return summary
+            logger.info(f"{self.primary.name} summary has {tokens} tokens, over {target_tokens}; falling back to {self.fallback.name}")
+        return await self.fallback.summarize(thread_id, messages, model, target_tokens)
+
+
+def create_summarizer(
+    summarize_with_llm: Callable[[str, List[Dict[str, Any]], str], Awaitable[Optional[str]]],
+    backend: Optional[str] = None
+) -> Summarizer:
+    """Create the summarizer configured for this deployment.
+
+    Args:
+        summarize_with_llm: Coroutine function used by the LLM backend
+        backend: "llm", "extractive" or "tiered"; read from CONTEXT_SUMMARIZER_BACKEND if omitted
+
+    Returns:
+        The summarizer backend
+    """
+    backend = (backend or os.getenv(SUMMARIZER_BACKEND_ENV) or DEFAULT_SUMMARIZER_BACKEND).strip().lower()
+    if backend == "extractive":
+        return ExtractiveSummarizer()
+    if backend == "tiered":
+        return TieredSummarizer(ExtractiveSummarizer(), LLMSummarizer(summarize_with_llm))
+    if backend != "llm":
+        logger.warning(f"Unknown {SUMMARIZER_BACKEND_ENV} '{backend}', using the LLM summarizer")
+    return LLMSummarizer(summarize_with_llm)
@@ -8,14 +8,22 @@ This module provides comprehensive conversation management, including:
 - LLM interaction with streaming support
 - Error handling and cleanup
 - Context summarization to manage token limits
+- Retrieval of relevant messages from before the latest summary
 """
 
+import copy
 import json
 from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal
-from services.llm import make_llm_api_call
+from services.llm import make_llm_api_call, get_model_context_window
 from agentpress.tool import Tool
-from agentpress.tool_registry import ToolRegistry
+from agentpress.tool_registry import ToolRegistry, RunToolRegistry
 from agentpress.context_manager import ContextManager
+from agentpress.message_writer import MessageWriteBehindQueue, MessageFlushError
+from agentpress.message_cache import ThreadMessageCache, to_llm_message
+from agentpress.token_counting import count_message_tokens, REPLY_PRIMING_TOKENS
+from agentpress.prompt_cache import prompt_assembly_cache
+from agentpress.context_packer import pack_messages
+from agentpress.retrieval_memory import RetrievalMemory, DEFAULT_TOP_K, build_query, format_retrieved_context
 from agentpress.response_processor import (
     ResponseProcessor, 
     ProcessorConfig    
@@ -26,6 +34,12 @@ from utils.logger import logger
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
 
+# Tokens kept free for the response when the call sets no max_tokens
+DEFAULT_OUTPUT_RESERVE_TOKENS = 8192
+
+# Columns of the LLM message rows read into the message cache; metadata carries stored token counts
+LLM_MESSAGE_COLUMNS = 'message_id, type, content, metadata, created_at'
+
 class ThreadManager:
     """Manages conversation threads with LLM models and tool execution.
     
@@ -45,18 +59,49 @@ class ThreadManager:
             add_message_callback=self.add_message
         )
         self.context_manager = ContextManager()
+        self._write_behind_queues: Dict[str, MessageWriteBehindQueue] = {} # thread_id -> queue of the active run
+        self._message_cache = ThreadMessageCache() # thread_id -> normalized LLM messages
+        self._retrieval_memory = RetrievalMemory() # thread_id -> chunk index of the full history
+        self._thread_models: Dict[str, str] = {} # thread_id -> LLM model of the latest run, for token counts
+        self._prompt_cache = prompt_assembly_cache # Shared across thread managers
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
         self.tool_registry.register_tool(tool_class, function_names, **kwargs)
 
+    def create_run_scope(self) -> "ThreadManager":
+        """Create a thread manager for one agent run.
+        
+        The scope shares the database connection, context manager and message
+        caches with this manager, but has its own tool registry (an overlay of
+        this manager's) and response processor. Tools added to the scope are
+        bound to the run, so concurrent runs in one process do not replace each
+        other's tool instances. Call release() when the run ends.
+        
+        Returns:
+            The run-scoped thread manager
+        """
+        scope = copy.copy(self)  # Shallow: shared state stays shared
+        scope.tool_registry = self.tool_registry.overlay()
+        scope.response_processor = ResponseProcessor(
+            tool_registry=scope.tool_registry,
+            add_message_callback=scope.add_message
+        )
+        return scope
+
+    async def release(self) -> None:
+        """Clean up the tools added to a run scope; a no-op for the shared manager."""
+        if isinstance(self.tool_registry, RunToolRegistry):
+            await self.tool_registry.release()
+
     async def add_message(
         self, 
         thread_id: str, 
         type: str, 
         content: Union[Dict[str, Any], List[Any], str], 
         is_llm_message: bool = False,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        created_at: Optional[str] = None
     ):
         """Add a message to the thread in the database.
 
@@ -69,8 +114,36 @@ class ThreadManager:
                             Defaults to False (user message).
             metadata: Optional dictionary for additional message metadata.
                       Defaults to None, stored as an empty JSONB object if None.
+            created_at: Optional ISO timestamp placing the message at an earlier position
+                        in the thread (e.g. a summary of the messages up to that point).
+                        Defaults to the time of insertion.
+
+        Returns:
+            The stored message row. While a write-behind run is active for the
+            thread, the row is returned immediately and written in a later bulk insert.
+            LLM messages of a thread run store their token count for the run's model
+            in metadata.token_counts.
         """
         logger.debug(f"Adding message of type '{type}' to thread {thread_id}")
+
+        model = self._thread_models.get(thread_id)
+        if is_llm_message and model:
+            message = to_llm_message({'content': json.dumps(content) if isinstance(content, (dict, list)) else content})
+            if isinstance(message, dict):
+                try:
+                    token_count = (await count_message_tokens(model, [message]))[0]
+                    metadata = {**(metadata or {}), 'token_counts': {model: token_count}}
+                except Exception as e:
+                    logger.warning(f"Failed to count tokens of new message in thread {thread_id}: {str(e)}")
+
+        write_behind_queue = self._write_behind_queues.get(thread_id)
+        if write_behind_queue:
+            row = write_behind_queue.enqueue(type, content, is_llm_message, metadata, created_at)
+            if is_llm_message:
+                self._message_cache.add_rows(thread_id, [row])
+                self._retrieval_memory.add_rows(thread_id, [row])
+            return row
+
         client = await self.db.client
         
         # Prepare data for insertion
@@ -81,6 +154,8 @@ class ThreadManager:
             'is_llm_message': is_llm_message,
             'metadata': json.dumps(metadata or {}), # Ensure metadata is always a JSON object
         }
+        if created_at:
+            data_to_insert['created_at'] = created_at
         
         try:
             # Add returning='representation' to get the inserted row data including the id
@@ -90,6 +165,9 @@ class ThreadManager:
             print(f"MESSAGE RESULT: {result}")
             
             if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
+                if is_llm_message:
+                    self._message_cache.add_rows(thread_id, [result.data[0]])
+                    self._retrieval_memory.add_rows(thread_id, [result.data[0]])
                 return result.data[0]
             else:
                 logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
@@ -101,8 +179,10 @@ class ThreadManager:
     async def get_llm_messages(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all messages for a thread.
         
-        This method uses the SQL function which handles context truncation
-        by considering summary messages.
+        Messages are served from the in-process message cache. A cached thread
+        only fetches rows newer than its high-water mark; an uncached thread is
+        loaded from its latest summary message onwards, which handles context
+        truncation the same way as the get_llm_formatted_messages SQL function.
         
         Args:
             thread_id: The ID of the thread to get messages for.
@@ -114,39 +194,127 @@ class ThreadManager:
         client = await self.db.client
         
         try:
-            result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
-            
-            # Parse the returned data which might be stringified JSON
-            if not result.data:
-                return []
-                
-            # Return properly parsed JSON objects
-            messages = []
-            for item in result.data:
-                if isinstance(item, str):
-                    try:
-                        parsed_item = json.loads(item)
-                        messages.append(parsed_item)
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to parse message: {item}")
-                else:
-                    messages.append(item)
-
-            # Ensure tool_calls have properly formatted function arguments
-            for message in messages:
-                if message.get('tool_calls'):
-                    for tool_call in message['tool_calls']:
-                        if isinstance(tool_call, dict) and 'function' in tool_call:
-                            # Ensure function.arguments is a string
-                            if 'arguments' in tool_call['function'] and not isinstance(tool_call['function']['arguments'], str):
-                                tool_call['function']['arguments'] = json.dumps(tool_call['function']['arguments'])
-
-            return messages
+            # Rows queued by an active write-behind run must be visible to this read
+            write_behind_queue = self._write_behind_queues.get(thread_id)
+            if write_behind_queue:
+                await write_behind_queue.flush()
+
+            since = self._message_cache.delta_since(thread_id)
+            if since is None:
+                rows = await self._fetch_llm_message_rows(client, thread_id)
+                self._message_cache.load(thread_id, rows)
+                logger.debug(f"Loaded {len(rows)} messages of thread {thread_id} into the message cache")
+            else:
+                # Rows written by other clients since the last read (own rows are deduplicated)
+                result = await client.table('messages').select(LLM_MESSAGE_COLUMNS) \
+                    .eq('thread_id', thread_id) \
+                    .eq('is_llm_message', True) \
+                    .gte('created_at', since) \
+                    .order('created_at') \
+                    .execute()
+                self._message_cache.add_rows(thread_id, result.data or [])
+                self._retrieval_memory.add_rows(thread_id, result.data or [])
+
+            return self._message_cache.get(thread_id) or []
             
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
+            self._message_cache.invalidate(thread_id)
             return []
 
+    async def get_thread_token_count(self, thread_id: str, model: str, messages: List[Dict[str, Any]]) -> int:
+        """Get the token count of a thread's LLM messages.
+        
+        Messages counted before (or stored with a count) are not tokenized again;
+        the total is the running sum kept by the message cache.
+        
+        Args:
+            thread_id: The ID of the thread
+            model: Model whose tokenizer is used
+            messages: The thread's messages, counted directly if the thread is not cached
+            
+        Returns:
+            Sum of the per-message token counts
+        """
+        uncounted = self._message_cache.uncounted_messages(thread_id, model)
+        if uncounted:
+            counts = await count_message_tokens(model, [message for _, message in uncounted])
+            self._message_cache.set_token_counts(
+                thread_id, model, [(key, count) for (key, _), count in zip(uncounted, counts)]
+            )
+        total = self._message_cache.token_total(thread_id, model)
+        if total is None:
+            total = sum(await count_message_tokens(model, messages))
+        return total
+
+    async def get_retrieved_context(
+        self,
+        thread_id: str,
+        messages: List[Dict[str, Any]],
+        temporary_message: Optional[Dict[str, Any]] = None,
+        top_k: int = DEFAULT_TOP_K
+    ) -> Optional[Dict[str, Any]]:
+        """Get a message with the earlier messages most relevant to the current turn.
+        
+        Only threads whose context starts at a summary have earlier messages to
+        retrieve. The thread's full history is indexed on first use; after that
+        the index is updated by add_message and delta fetches.
+        
+        Args:
+            thread_id: The ID of the thread
+            messages: The thread's current LLM messages, describing the current turn
+            temporary_message: Temporary message of the run, also describing the turn
+            top_k: Number of snippets retrieved at most
+            
+        Returns:
+            A user message with the snippets, or None if nothing relevant was found
+        """
+        summary_created_at = self._message_cache.summary_created_at(thread_id)
+        if summary_created_at is None:
+            return None
+
+        if thread_id not in self._retrieval_memory:
+            client = await self.db.client
+            result = await client.table('messages').select(LLM_MESSAGE_COLUMNS) \
+                .eq('thread_id', thread_id) \
+                .eq('is_llm_message', True) \
+                .order('created_at') \
+                .execute()
+            self._retrieval_memory.load(thread_id, result.data or [])
+
+        snippets = self._retrieval_memory.search(
+            thread_id, build_query(messages, temporary_message), summary_created_at, top_k
+        )
+        if snippets:
+            logger.info(f"Retrieved {len(snippets)} earlier snippets for thread {thread_id} (best score {max(s.score for s in snippets):.2f})")
+        return format_retrieved_context(snippets)
+
+    async def _fetch_llm_message_rows(self, client, thread_id: str) -> List[Dict[str, Any]]:
+        """Fetch the LLM message rows of a thread, starting at its latest summary.
+        
+        Args:
+            client: Database client
+            thread_id: The ID of the thread to get messages for.
+            
+        Returns:
+            Rows with message_id, type, content, metadata and created_at, in created_at order
+        """
+        summary_result = await client.table('messages').select('created_at') \
+            .eq('thread_id', thread_id) \
+            .eq('type', 'summary') \
+            .eq('is_llm_message', True) \
+            .order('created_at', desc=True) \
+            .limit(1) \
+            .execute()
+
+        query = client.table('messages').select(LLM_MESSAGE_COLUMNS) \
+            .eq('thread_id', thread_id) \
+            .eq('is_llm_message', True)
+        if summary_result.data:
+            query = query.gte('created_at', summary_result.data[0]['created_at'])
+        result = await query.order('created_at').execute()
+        return result.data or []
+
     async def run_thread(
         self,
         thread_id: str,
@@ -163,7 +331,10 @@ class ThreadManager:
         include_xml_examples: bool = False,
         enable_thinking: Optional[bool] = False,
         reasoning_effort: Optional[str] = 'low',
-        enable_context_manager: bool = True
+        enable_context_manager: bool = True,
+        enable_write_behind: bool = False,
+        prompt_version: Optional[str] = None,
+        enable_retrieval_memory: bool = False
     ) -> Union[Dict[str, Any], AsyncGenerator]:
         """Run a conversation thread with LLM integration and tool execution.
         
@@ -184,12 +355,19 @@ class ThreadManager:
             enable_thinking: Whether to enable thinking before making a decision
             reasoning_effort: The effort level for reasoning
             enable_context_manager: Whether to enable automatic context summarization.
+            enable_write_behind: Whether to queue the run's message rows and write them in
+                                 ordered bulk inserts instead of one insert per row.
+            prompt_version: Version of the system prompt for the prompt assembly cache;
+                            a digest of its content if omitted.
+            enable_retrieval_memory: Whether to add the messages from before the latest summary
+                                     most relevant to the current turn to the context.
             
         Returns:
             An async generator yielding response chunks or error dict
         """
         
         logger.info(f"Starting thread execution for thread {thread_id}")
+        self._thread_models[thread_id] = llm_model
         logger.debug(f"Parameters: model={llm_model}, temperature={llm_temperature}, max_tokens={llm_max_tokens}")
         logger.debug(f"Auto-continue: max={native_max_auto_continues}, XML tool limit={max_xml_tool_calls}")
         
@@ -201,44 +379,15 @@ class ThreadManager:
         if max_xml_tool_calls > 0 and not processor_config.max_xml_tool_calls:
             processor_config.max_xml_tool_calls = max_xml_tool_calls
             
-        # Create a working copy of the system prompt to potentially modify
-        working_system_prompt = system_prompt.copy()
-
-        # Add XML examples to system prompt if requested, do this only ONCE before the loop
-        if include_xml_examples and processor_config.xml_tool_calling:
-            xml_examples = self.tool_registry.get_xml_examples()
-            if xml_examples:
-                examples_content = """
---- XML TOOL CALLING ---
-
-In this environment you have access to a set of tools you can use to answer the user's question. The tools are specified in XML format.
-Format your tool calls using the specified XML tags. Place parameters marked as 'attribute' within the opening tag (e.g., `<tag attribute='value'>`). Place parameters marked as 'content' between the opening and closing tags. Place parameters marked as 'element' within their own child tags (e.g., `<tag><element>value</element></tag>`). Refer to the examples provided below for the exact structure of each tool.
-String and scalar parameters should be specified as attributes, while content goes between tags.
-Note that spaces for string values are not stripped. The output is parsed with regular expressions.
-
-Here are the XML tools available with examples:
-"""
-                for tag_name, example in xml_examples.items():
-                    examples_content += f"<{tag_name}> Example: {example}\\n"
-
-                system_content = working_system_prompt.get('content')
-
-                if isinstance(system_content, str):
-                    working_system_prompt['content'] += examples_content
-                    logger.debug("Appended XML examples to string system prompt content.")
-                elif isinstance(system_content, list):
-                    appended = False
-                    for item in working_system_prompt['content']: # Modify the copy
-                        if isinstance(item, dict) and item.get('type') == 'text' and 'text' in item:
-                            item['text'] += examples_content
-                            logger.debug("Appended XML examples to the first text block in list system prompt content.")
-                            appended = True
-                            break
-                    if not appended:
-                        logger.warning("System prompt content is a list but no text block found to append XML examples.")
-                else:
-                    logger.warning(f"System prompt content is of unexpected type ({type(system_content)}), cannot add XML examples.")
-        
+        # Assembled once per prompt version, tool set and model, not per run
+        assembled_prompt = await self._prompt_cache.get(
+            system_prompt,
+            self.tool_registry,
+            llm_model,
+            include_xml_examples=include_xml_examples and processor_config.xml_tool_calling,
+            prompt_version=prompt_version
+        )
+
         # Control whether we need to auto-continue due to tool_calls finish reason
         auto_continue = True
         auto_continue_count = 0
@@ -256,37 +405,75 @@ Here are the XML tools available with examples:
                 # 2. Check token count before proceeding
                 token_count = 0
                 try:
-                    from litellm import token_counter
-                    # Use the potentially modified working_system_prompt for token counting
-                    token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages) 
+                    # The assembled system prompt, which may contain the XML examples, is counted once
+                    system_prompt_tokens = assembled_prompt.token_count
+                    token_count = system_prompt_tokens + await self.get_thread_token_count(thread_id, llm_model, messages) + REPLY_PRIMING_TOKENS
                     token_threshold = self.context_manager.token_threshold
                     logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
                     
                     if token_count >= token_threshold and enable_context_manager:
-                        logger.info(f"Thread token count ({token_count}) exceeds threshold ({token_threshold}), summarizing...")
-                        summarized = await self.context_manager.check_and_summarize_if_needed(
-                            thread_id=thread_id,
-                            add_message_callback=self.add_message,
-                            model=llm_model,
-                            force=True
-                        )
+                        # A background summary started at the proactive threshold is usually done by now
+                        summarized = await self.context_manager.wait_for_background_summary(thread_id)
+                        if not summarized:
+                            logger.info(f"Thread token count ({token_count}) exceeds threshold ({token_threshold}), summarizing...")
+                            summarized = await self.context_manager.check_and_summarize_if_needed(
+                                thread_id=thread_id,
+                                add_message_callback=self.add_message,
+                                model=llm_model,
+                                force=True
+                            )
                         if summarized:
                             logger.info("Summarization complete, fetching updated messages with summary")
                             messages = await self.get_llm_messages(thread_id)
                             # Recount tokens after summarization, using the modified prompt
-                            new_token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages) 
+                            new_token_count = system_prompt_tokens + await self.get_thread_token_count(thread_id, llm_model, messages) + REPLY_PRIMING_TOKENS
                             logger.info(f"After summarization: token count reduced from {token_count} to {new_token_count}")
+                            token_count = new_token_count
                         else:
                             logger.warning("Summarization failed or wasn't needed - proceeding with original messages")
+                    elif token_count >= self.context_manager.proactive_threshold and enable_context_manager:
+                        # Summarize the messages read so far off the critical path
+                        summarized_until = self._message_cache.high_water_mark(thread_id)
+                        if summarized_until:
+                            self.context_manager.start_background_summary(
+                                thread_id,
+                                messages,
+                                summarized_until,
+                                add_message_callback=self.add_message,
+                                model=llm_model,
+                                token_count=token_count
+                            )
                     elif not enable_context_manager: # Added condition for clarity
                         logger.info("Automatic summarization disabled. Skipping token count check and summarization.")
 
                 except Exception as e:
                     logger.error(f"Error counting tokens or summarizing: {str(e)}")
                 
+                # Bring back details the summary dropped, placed before the last user message
+                if enable_retrieval_memory:
+                    try:
+                        retrieved = await self.get_retrieved_context(thread_id, messages, temp_msg)
+                        if retrieved:
+                            last_user_index = max((i for i, msg in enumerate(messages) if msg.get('role') == 'user'), default=len(messages))
+                            messages = messages[:last_user_index] + [retrieved] + messages[last_user_index:]
+                            token_count += (await count_message_tokens(llm_model, [retrieved]))[0]
+                    except Exception as e:
+                        logger.error(f"Error retrieving earlier messages: {str(e)}")
+                
+                # Fit the messages into the model's context window by policy, without an LLM call
+                if enable_context_manager:
+                    try:
+                        budget = get_model_context_window(llm_model) - (llm_max_tokens or DEFAULT_OUTPUT_RESERVE_TOKENS) - assembled_prompt.token_count
+                        packed = await pack_messages(messages, llm_model, budget)
+                        if packed.actions:
+                            messages = packed.messages
+                            token_count = assembled_prompt.token_count + packed.tokens_after + REPLY_PRIMING_TOKENS
+                    except Exception as e:
+                        logger.error(f"Error packing context: {str(e)}")
+                
                 # 3. Prepare messages for LLM call + add temporary message if it exists
-                # Use the working_system_prompt which may contain the XML examples
-                prepared_messages = [working_system_prompt] 
+                # A fresh copy of the assembled system prompt, which may contain the XML examples
+                prepared_messages = [assembled_prompt.system_message()]
                 
                 # Find the last user message index
                 last_user_index = -1
@@ -316,7 +503,7 @@ Here are the XML tools available with examples:
                 # 5. Prepare tools for LLM call
                 openapi_tool_schemas = None
                 if processor_config.native_tool_calling:
-                    openapi_tool_schemas = self.tool_registry.get_openapi_schemas()
+                    openapi_tool_schemas = assembled_prompt.openapi_schemas()
                     logger.debug(f"Retrieved {len(openapi_tool_schemas) if openapi_tool_schemas else 0} OpenAPI tool schemas")
 
                 # 6. Make LLM API call
@@ -347,7 +534,8 @@ Here are the XML tools available with examples:
                         thread_id=thread_id,
                         config=processor_config,
                         prompt_messages=prepared_messages,
-                        llm_model=llm_model
+                        llm_model=llm_model,
+                        prompt_token_count=token_count or None # Cost fallback if the provider sends no usage
                     )
                     
                     return response_generator
@@ -360,7 +548,8 @@ Here are the XML tools available with examples:
                             thread_id=thread_id,
                             config=processor_config,
                             prompt_messages=prepared_messages,
-                            llm_model=llm_model
+                            llm_model=llm_model,
+                            prompt_token_count=token_count or None # Cost fallback if the provider sends no usage
                         )
                         return response_generator # Return the generator
                     except Exception as e:
@@ -424,11 +613,58 @@ Here are the XML tools available with examples:
                     "content": f"\n[Agent reached maximum auto-continue limit of {native_max_auto_continues}]"
                 }
         
+        # Define a wrapper generator that flushes queued rows when the run ends or fails
+        async def write_behind_wrapper(write_behind_queue, response_gen):
+            async def close_queue():
+                if self._write_behind_queues.get(thread_id) is write_behind_queue:
+                    del self._write_behind_queues[thread_id]
+                await write_behind_queue.close()
+
+            try:
+                async for chunk in response_gen:
+                    yield chunk
+            except BaseException:
+                try:
+                    await close_queue()
+                except MessageFlushError as e:
+                    logger.error(str(e))
+                raise
+
+            try:
+                await close_queue()
+            except MessageFlushError as e:
+                # Rows already streamed to the client are missing from the thread; fail the run
+                logger.error(str(e))
+                yield {
+                    "type": "status",
+                    "status": "error",
+                    "message": str(e)
+                }
+
+        write_behind_queue = None
+        if enable_write_behind:
+            if thread_id in self._write_behind_queues:
+                logger.warning(f"Write-behind already active for thread {thread_id}, writing rows directly")
+            else:
+                write_behind_queue = MessageWriteBehindQueue(self.db, thread_id)
+                self._write_behind_queues[thread_id] = write_behind_queue
+        
         # If auto-continue is disabled (max=0), just run once
         if native_max_auto_continues == 0:
             logger.info("Auto-continue is disabled (native_max_auto_continues=0)")
             # Pass the potentially modified system prompt and temp message
-            return await _run_once(temporary_message) 
-        
-        # Otherwise return the auto-continue wrapper generator
-        return auto_continue_wrapper()
+            response = await _run_once(temporary_message)
+        else:
+            # Otherwise use the auto-continue wrapper generator
+            response = auto_continue_wrapper()
+
+        if write_behind_queue:
+            if isinstance(response, dict):
+                del self._write_behind_queues[thread_id]
+                try:
+                    await write_behind_queue.close()
+                except MessageFlushError as e:
+                    logger.error(str(e))
+                return response
+            return write_behind_wrapper(write_behind_queue, response)
+        return response
@@ -0,0 +1,92 @@
+"""
+Memoized per-message token counting for AgentPress.
+
+Counting a whole thread with litellm's token_counter on every LLM call costs
+time proportional to the thread and blocks the event loop. This module counts
+each message once per model:
+- Counts are memoized by (model, message digest) in a bounded in-memory map
+- A list of messages costs the sum of its per-message counts plus the reply priming
+- Counting work above a size threshold runs in a worker thread
+"""
+
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from litellm import token_counter
+from utils.logger import logger
+
+# Tokens token_counter adds once per request for priming the reply
+REPLY_PRIMING_TOKENS = 3
+
+# Characters of uncounted content above which counting moves to a worker thread
+OFFLOAD_THRESHOLD_CHARS = 20000
+
+# Number of (model, message) counts kept in memory
+MAX_MEMOIZED_COUNTS = 100000
+
+_counts: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+
+
+def message_digest(message: Dict[str, Any]) -> str:
+    """Return a stable digest identifying a message's content."""
+    return hashlib.sha1(json.dumps(message, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _remember(key: Tuple[str, str], count: int) -> None:
+    _counts[key] = count
+    _counts.move_to_end(key)
+    while len(_counts) > MAX_MEMOIZED_COUNTS:
+        _counts.popitem(last=False)
+
+
+def _count_uncached(model: str, messages: List[Dict[str, Any]]) -> List[int]:
+    """Tokenize each message on its own; runs in a worker thread for large inputs."""
+    return [token_counter(model=model, messages=[message]) - REPLY_PRIMING_TOKENS for message in messages]
+
+
+async def count_message_tokens(model: str, messages: List[Dict[str, Any]]) -> List[int]:
+    """Get the token count of each message, tokenizing only messages not seen before.
+
+    Args:
+        model: Model whose tokenizer is used
+        messages: Messages to count
+
+    Returns:
+        Token counts, in the order of messages
+    """
+    keys = [(model, message_digest(message)) for message in messages]
+    counts = [_counts.get(key) for key in keys]
+    missing = [index for index, count in enumerate(counts) if count is None]
+
+    if missing:
+        to_count = [messages[index] for index in missing]
+        size = sum(len(json.dumps(message, default=str)) for message in to_count)
+        if size > OFFLOAD_THRESHOLD_CHARS:
+            logger.debug(f"Counting tokens of {len(to_count)} messages ({size} chars) in a worker thread")
+            new_counts = await asyncio.to_thread(_count_uncached, model, to_count)
+        else:
+            new_counts = _count_uncached(model, to_count)
+        for index, count in zip(missing, new_counts):
+            counts[index] = count
+            _remember(keys[index], count)
+    else:
+        for key in keys:
+            _counts.move_to_end(key)
+
+    return counts
+
+
+async def count_prompt_tokens(model: str, messages: List[Dict[str, Any]]) -> int:
+    """Get the token count of a prompt, as litellm's token_counter would report it.
+
+    Args:
+        model: Model whose tokenizer is used
+        messages: Messages of the prompt
+
+    Returns:
+        Total tokens of the messages plus the reply priming
+    """
+    return sum(await count_message_tokens(model, messages)) + REPLY_PRIMING_TOKENS
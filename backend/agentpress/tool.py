@@ -4,12 +4,19 @@ Core tool system providing the foundation for creating and managing tools.
 This module defines the base classes and decorators for creating tools in AgentPress:
 - Tool base class for implementing tool functionality
 - Schema decorators for OpenAPI and XML tool definitions
+- Execution traits declaring how tool calls may run concurrently
+- Execution limits (timeouts and concurrency caps) declared with the schema decorators
 - Result containers for standardized tool outputs
+- Progress containers for partial output of streaming (async generator) tools
+- Blocking calls in worker threads, tracked so they keep their slot until they return
 """
 
-from typing import Dict, Any, Union, Optional, List, Type
+from typing import Dict, Any, Union, Optional, List, Type, Tuple, Callable
 from dataclasses import dataclass, field
 from abc import ABC
+from contextvars import ContextVar
+import asyncio
+import functools
 import json
 import inspect
 from enum import Enum
@@ -82,6 +89,36 @@ class ToolSchema:
     schema: Dict[str, Any]
     xml_schema: Optional[XMLTagSchema] = None
 
+@dataclass(frozen=True)
+class ToolExecutionTraits:
+    """Concurrency traits of a tool function, used by the tool scheduler.
+    
+    Two calls conflict, and run in call order, when one of them needs exclusive
+    access to a resource the other one uses. All other calls run concurrently.
+    
+    Attributes:
+        read_only (bool): The call has no side effects another call could observe
+        path_param (str, optional): Argument holding a path the call mutates
+        exclusive_resources (Tuple[str, ...]): Resources the call needs to itself (e.g. "browser")
+        shared_resources (Tuple[str, ...]): Resources the call uses alongside other shared users
+    """
+    read_only: bool = False
+    path_param: Optional[str] = None
+    exclusive_resources: Tuple[str, ...] = ()
+    shared_resources: Tuple[str, ...] = ()
+
+@dataclass(frozen=True)
+class ToolExecutionLimits:
+    """Runtime limits of a tool function, declared with its schema decorators.
+    
+    Attributes:
+        timeout (float, optional): Seconds a call may run before it fails with a timeout
+        max_concurrency (int, optional): Calls of the tool class with this cap that may run
+            at once across all thread runs of the process
+    """
+    timeout: Optional[float] = None
+    max_concurrency: Optional[int] = None
+
 @dataclass
 class ToolResult:
     """Container for tool execution results.
@@ -93,6 +130,23 @@ class ToolResult:
     success: bool
     output: str
 
+@dataclass
+class ToolProgress:
+    """Partial output or progress update yielded by a streaming tool.
+    
+    Tool methods may be async generators that yield ToolProgress items while
+    they run and a ToolResult as their last item. Progress is forwarded to
+    clients as transient events; only the final result is persisted.
+    
+    Attributes:
+        output (str): Progress message or partial output
+    """
+    output: str
+
+# Worker threads started by Tool.run_blocking during the current tool call;
+# set by the executor so it can wait for threads that outlive a timeout or cancellation
+tool_call_workers: ContextVar[Optional[List[asyncio.Future]]] = ContextVar("tool_call_workers", default=None)
+
 class Tool(ABC):
     """Abstract base class for all tools.
     
@@ -101,13 +155,25 @@ class Tool(ABC):
     
     Attributes:
         _schemas (Dict[str, List[ToolSchema]]): Registered schemas for tool methods
+        default_execution_traits (ToolExecutionTraits, optional): Traits for methods
+            without their own @execution_traits declaration
+        default_execution_limits (ToolExecutionLimits, optional): Limits for methods
+            that declare none in their schema decorators
         
     Methods:
         get_schemas: Get all registered tool schemas
+        get_execution_traits: Get the concurrency traits of a tool method
+        get_execution_limits: Get the timeout and concurrency cap of a tool method
         success_response: Create a successful result
         fail_response: Create a failed result
+        progress: Create a progress update for streaming tools
+        run_blocking: Run a blocking call in a worker thread
+        cleanup: Release resources held by the tool
     """
     
+    default_execution_traits: Optional[ToolExecutionTraits] = None
+    default_execution_limits: Optional[ToolExecutionLimits] = None
+    
     def __init__(self):
         """Initialize tool with empty schema registry."""
         self._schemas: Dict[str, List[ToolSchema]] = {}
@@ -129,6 +195,38 @@ class Tool(ABC):
         """
         return self._schemas
 
+    def get_execution_traits(self, method_name: str) -> Optional[ToolExecutionTraits]:
+        """Get the concurrency traits of a tool method.
+        
+        Args:
+            method_name: Name of the tool method
+            
+        Returns:
+            The method's declared traits, the class default, or None if undeclared
+        """
+        method = getattr(self, method_name, None)
+        return getattr(method, 'execution_traits', None) or self.default_execution_traits
+
+    def get_execution_limits(self, method_name: str) -> ToolExecutionLimits:
+        """Get the timeout and concurrency cap of a tool method.
+        
+        Limits declared on the method take precedence field by field over the
+        class default.
+        
+        Args:
+            method_name: Name of the tool method
+            
+        Returns:
+            The effective limits; fields are None when nothing is declared
+        """
+        method = getattr(self, method_name, None)
+        declared = getattr(method, 'execution_limits', None) or ToolExecutionLimits()
+        default = self.default_execution_limits or ToolExecutionLimits()
+        return ToolExecutionLimits(
+            timeout=declared.timeout if declared.timeout is not None else default.timeout,
+            max_concurrency=declared.max_concurrency if declared.max_concurrency is not None else default.max_concurrency
+        )
+
     def success_response(self, data: Union[Dict[str, Any], str]) -> ToolResult:
         """Create a successful tool result.
         
@@ -145,6 +243,17 @@ class Tool(ABC):
         logger.debug(f"Created success response for {self.__class__.__name__}")
         return ToolResult(success=True, output=text)
 
+    def progress(self, data: Union[Dict[str, Any], str]) -> ToolProgress:
+        """Create a progress update for a streaming tool.
+        
+        Args:
+            data: Progress data (dictionary or string)
+            
+        Returns:
+            ToolProgress with formatted output
+        """
+        return ToolProgress(output=data if isinstance(data, str) else json.dumps(data, indent=2))
+
     def fail_response(self, msg: str) -> ToolResult:
         """Create a failed tool result.
         
@@ -157,6 +266,35 @@ class Tool(ABC):
         logger.debug(f"Tool {self.__class__.__name__} returned failed result: {msg}")
         return ToolResult(success=False, output=msg)
 
+    async def run_blocking(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking call in a worker thread without blocking the event loop.
+        
+        Threads cannot be interrupted: when the tool call times out or is
+        cancelled, the call keeps running. The executor therefore holds the tool's
+        concurrency slot until the thread has returned.
+        
+        Args:
+            func: Blocking function to call
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+            
+        Returns:
+            The return value of func
+        """
+        worker = asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+        workers = tool_call_workers.get()
+        if workers is not None:
+            workers.append(worker)
+        # Shielded so a cancellation leaves the future tracking the still-running thread
+        return await asyncio.shield(worker)
+
+    async def cleanup(self) -> None:
+        """Release resources held by the tool, called when its run ends.
+        
+        The default does nothing; tools holding sessions or connections override it.
+        """
+        pass
+
 def _add_schema(func, schema: ToolSchema):
     """Helper to add schema to a function."""
     if not hasattr(func, 'tool_schemas'):
@@ -165,10 +303,33 @@ def _add_schema(func, schema: ToolSchema):
     logger.debug(f"Added {schema.schema_type.value} schema to function {func.__name__}")
     return func
 
-def openapi_schema(schema: Dict[str, Any]):
-    """Decorator for OpenAPI schema tools."""
+def _add_limits(func, timeout: Optional[float], max_concurrency: Optional[int]):
+    """Helper to merge execution limits declared by a schema decorator into a function."""
+    if timeout is None and max_concurrency is None:
+        return func
+    current = getattr(func, 'execution_limits', None) or ToolExecutionLimits()
+    func.execution_limits = ToolExecutionLimits(
+        timeout=timeout if timeout is not None else current.timeout,
+        max_concurrency=max_concurrency if max_concurrency is not None else current.max_concurrency
+    )
+    logger.debug(f"Applied execution limits to function {func.__name__}: {func.execution_limits}")
+    return func
+
+def openapi_schema(
+    schema: Dict[str, Any],
+    timeout: Optional[float] = None,
+    max_concurrency: Optional[int] = None
+):
+    """Decorator for OpenAPI schema tools.
+    
+    Args:
+        schema: OpenAPI function schema
+        timeout: Optional seconds a call may run before it fails
+        max_concurrency: Optional cap on concurrent calls of the tool class
+    """
     def decorator(func):
         logger.debug(f"Applying OpenAPI schema to function {func.__name__}")
+        _add_limits(func, timeout, max_concurrency)
         return _add_schema(func, ToolSchema(
             schema_type=SchemaType.OPENAPI,
             schema=schema
@@ -178,7 +339,9 @@ def openapi_schema(schema: Dict[str, Any]):
 def xml_schema(
     tag_name: str,
     mappings: List[Dict[str, Any]] = None,
-    example: str = None
+    example: str = None,
+    timeout: Optional[float] = None,
+    max_concurrency: Optional[int] = None
 ):
     """
     Decorator for XML schema tools with improved node mapping.
@@ -191,6 +354,8 @@ def xml_schema(
             - path: Path to the node (default "." for root)
             - required: Whether the parameter is required (default True)
         example: Optional example showing how to use the XML tag
+        timeout: Optional seconds a call may run before it fails
+        max_concurrency: Optional cap on concurrent calls of the tool class
     
     Example:
         @xml_schema(
@@ -210,6 +375,7 @@ def xml_schema(
     """
     def decorator(func):
         logger.debug(f"Applying XML schema with tag '{tag_name}' to function {func.__name__}")
+        _add_limits(func, timeout, max_concurrency)
         xml_schema = XMLTagSchema(tag_name=tag_name, example=example)
         
         # Add mappings
@@ -229,6 +395,38 @@ def xml_schema(
         ))
     return decorator
 
+def execution_traits(
+    read_only: bool = False,
+    path_param: Optional[str] = None,
+    exclusive_resources: Optional[List[str]] = None,
+    shared_resources: Optional[List[str]] = None
+):
+    """
+    Decorator declaring how calls of a tool function may run concurrently.
+    
+    Args:
+        read_only: The call has no side effects another call could observe
+        path_param: Name of the argument holding a path the call mutates
+        exclusive_resources: Resources the call needs exclusive access to
+        shared_resources: Resources the call uses alongside other shared users
+    
+    Example:
+        @execution_traits(path_param="file_path", shared_resources=["workspace"])
+        @xml_schema(tag_name="create-file", ...)
+        async def create_file(self, file_path: str, file_contents: str) -> ToolResult:
+            ...
+    """
+    def decorator(func):
+        func.execution_traits = ToolExecutionTraits(
+            read_only=read_only,
+            path_param=path_param,
+            exclusive_resources=tuple(exclusive_resources or ()),
+            shared_resources=tuple(shared_resources or ())
+        )
+        logger.debug(f"Applied execution traits to function {func.__name__}: {func.execution_traits}")
+        return func
+    return decorator
+
 def custom_schema(schema: Dict[str, Any]):
     """Decorator for custom schema tools."""
     def decorator(func):
@@ -0,0 +1,152 @@
+"""
+Batched execution of the tool calls made in one LLM turn.
+
+When several tool calls are accepted per turn, they run as a batch:
+- Calls execute one at a time in call order, or through a ToolScheduler so
+  that calls whose declared traits do not conflict run concurrently
+- A terminal tool (e.g. ask/complete) or a failed call halts the batch
+- Calls not yet started at the halt are not executed and get a failed result explaining why
+- A terminal tool runs after every earlier call and before every later one
+- Every executed call beyond the first saves one LLM round trip
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from agentpress.tool import ToolResult
+from agentpress.tool_scheduler import ToolScheduler
+from utils.logger import logger
+
+# Tools that hand control back to the user and end the agent's turn
+TERMINAL_TOOL_NAMES = ("ask", "complete")
+
+
+class ToolCallBatch:
+    """Runs the tool calls of one LLM turn, halting on a terminal tool or a failure.
+
+    Without a scheduler, calls run one at a time in call order. With one, each
+    call waits only for the earlier calls it conflicts with; a halt then skips
+    the calls that have not started yet. Calls are submitted one at a time, so
+    tools detected while a response is still streaming start as soon as the
+    calls they wait for have finished.
+
+    Attributes:
+        terminal_tools (Tuple[str, ...]): Tool names that halt the batch after they run
+        scheduler (ToolScheduler, optional): Scheduler running independent calls concurrently
+        executed (int): Number of calls that were executed
+        skipped (int): Number of calls not executed because the batch was halted
+        halted_by (str, optional): Description of the call that halted the batch
+    """
+
+    def __init__(
+        self,
+        execute: Callable[[Dict[str, Any]], Awaitable[ToolResult]],
+        terminal_tools: Iterable[str] = TERMINAL_TOOL_NAMES,
+        scheduler: Optional[ToolScheduler] = None
+    ):
+        """Initialize the batch.
+
+        Args:
+            execute: Coroutine function executing one tool call
+            terminal_tools: Tool names that halt the batch after they run
+            scheduler: Optional scheduler; when given, calls without conflicting
+                traits run concurrently instead of one at a time
+        """
+        self.execute = execute
+        self.terminal_tools = tuple(terminal_tools)
+        self.scheduler = scheduler
+        self.executed = 0
+        self.skipped = 0
+        self.halted_by: Optional[str] = None
+        self._tasks: List[asyncio.Task] = []
+        self._last_terminal_task: Optional[asyncio.Task] = None
+
+    @property
+    def llm_turns_saved(self) -> int:
+        """LLM round trips saved compared to one tool call per turn."""
+        return max(self.executed - 1, 0)
+
+    def _is_terminal(self, tool_call: Dict[str, Any]) -> bool:
+        """Whether a call ends the agent's turn."""
+        return tool_call.get("function_name") in self.terminal_tools or tool_call.get("xml_tag_name") in self.terminal_tools
+
+    def submit(
+        self,
+        tool_call: Dict[str, Any],
+        execute: Optional[Callable[[Dict[str, Any]], Awaitable[ToolResult]]] = None
+    ) -> asyncio.Task:
+        """Schedule a tool call after the earlier calls it has to wait for.
+
+        Args:
+            tool_call: Tool call to execute
+            execute: Optional coroutine function overriding the batch's executor for this call
+
+        Returns:
+            Task resolving to the call's ToolResult
+        """
+        execute = execute or self.execute
+        if self.scheduler is None:
+            previous = self._tasks[-1:]
+            task = asyncio.create_task(self._run_after(tool_call, previous, execute))
+        else:
+            # Terminal calls may be read-only, so order them around the rest of the batch explicitly
+            if self._is_terminal(tool_call):
+                previous = list(self._tasks)
+            else:
+                previous = [self._last_terminal_task] if self._last_terminal_task else []
+            task = self.scheduler.submit(tool_call, execute=lambda call: self._run_after(call, previous, execute))
+            if self._is_terminal(tool_call):
+                self._last_terminal_task = task
+        self._tasks.append(task)
+        return task
+
+    async def _run_after(
+        self,
+        tool_call: Dict[str, Any],
+        previous: List[asyncio.Task],
+        execute: Callable[[Dict[str, Any]], Awaitable[ToolResult]]
+    ) -> ToolResult:
+        """Wait for the given earlier calls, then execute unless the batch has been halted."""
+        if previous:
+            await asyncio.wait(previous)
+
+        tool_name = tool_call.get("xml_tag_name") or tool_call.get("function_name", "unknown")
+        if self.halted_by:
+            self.skipped += 1
+            logger.info(f"Skipping tool {tool_name}: batch halted by {self.halted_by}")
+            return ToolResult(success=False, output=f"Not executed: {self.halted_by} ended this batch of tool calls")
+
+        try:
+            result = await execute(tool_call)
+        except Exception as e:
+            logger.error(f"Error executing tool {tool_name}: {str(e)}")
+            result = ToolResult(success=False, output=f"Error executing tool: {str(e)}")
+        self.executed += 1
+
+        if not result.success:
+            self.halted_by = self.halted_by or f"the failed {tool_name} call"
+        elif self._is_terminal(tool_call):
+            self.halted_by = self.halted_by or f"the terminal {tool_name} call"
+        return result
+
+    async def run(self, tool_calls: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], ToolResult]]:
+        """Run a batch of tool calls and wait for all of them.
+
+        Args:
+            tool_calls: Tool calls in the order the LLM made them
+
+        Returns:
+            List of (tool_call, result) tuples in call order
+        """
+        tasks = [self.submit(tool_call) for tool_call in tool_calls]
+        results = await asyncio.gather(*tasks)
+        return list(zip(tool_calls, results))
+
+    def summary(self) -> Dict[str, Any]:
+        """Describe the batch for the tool_batch status message."""
+        return {
+            "executed": self.executed,
+            "skipped": self.skipped,
+            "halted_by": self.halted_by,
+            "llm_turns_saved": self.llm_turns_saved,
+        }
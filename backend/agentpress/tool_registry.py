@@ -1,5 +1,9 @@
+import hashlib
+import json
+from collections import ChainMap
 from typing import Dict, Type, Any, List, Optional, Callable
-from agentpress.tool import Tool, SchemaType, ToolSchema
+from agentpress.tool import Tool, SchemaType, ToolSchema, ToolExecutionTraits, ToolExecutionLimits
+from agentpress.xml_tool_parser import XMLToolParser
 from utils.logger import logger
 
 
@@ -17,8 +21,12 @@ class ToolRegistry:
         register_tool: Register a tool with optional function filtering
         get_tool: Get a specific tool by name
         get_xml_tool: Get a tool by XML tag name
+        get_execution_traits: Get the concurrency traits of a tool function
+        get_execution_limits: Get the timeout and concurrency cap of a tool function
         get_openapi_schemas: Get OpenAPI schemas for function calling
         get_xml_examples: Get examples of XML tool usage
+        get_tool_set_hash: Get a hash of the schemas the registered tools expose to the LLM
+        overlay: Create a run-scoped registry on top of this one
     """
     
     _instance = None
@@ -29,6 +37,7 @@ class ToolRegistry:
             cls._instance = super().__new__(cls)
             cls._instance.tools = {}
             cls._instance.xml_tools = {}
+            cls._instance._tool_set_hash = None
             logger.debug("Initialized new ToolRegistry instance")
         return cls._instance
     
@@ -40,6 +49,9 @@ class ToolRegistry:
             function_names: Optional list of specific functions to register
             **kwargs: Additional arguments passed to tool initialization
             
+        Returns:
+            The created tool instance
+            
         Notes:
             - If function_names is None, all functions are registered
             - Handles both OpenAPI and XML schema registration
@@ -52,6 +64,7 @@ class ToolRegistry:
         
         registered_openapi = 0
         registered_xml = 0
+        self._tool_set_hash = None
         
         for func_name, schema_list in schemas.items():
             if function_names is None or func_name in function_names:
@@ -68,12 +81,14 @@ class ToolRegistry:
                         self.xml_tools[schema.xml_schema.tag_name] = {
                             "instance": tool_instance,
                             "method": func_name,
-                            "schema": schema
+                            "schema": schema,
+                            "parser": XMLToolParser(schema.xml_schema)  # Compiled once, reused per call
                         }
                         registered_xml += 1
                         logger.debug(f"Registered XML tag {schema.xml_schema.tag_name} -> {func_name} from {tool_class.__name__}")
         
         logger.debug(f"Tool registration complete for {tool_class.__name__}: {registered_openapi} OpenAPI functions, {registered_xml} XML tags")
+        return tool_instance
 
     def get_available_functions(self) -> Dict[str, Callable]:
         """Get all available tool functions.
@@ -121,13 +136,58 @@ class ToolRegistry:
             tag_name: XML tag name for the tool
             
         Returns:
-            Dict containing tool instance, method name, and schema
+            Dict containing tool instance, method name, schema, and compiled parser
         """
         tool = self.xml_tools.get(tag_name, {})
         if not tool:
             logger.warning(f"XML tool not found for tag: {tag_name}")
         return tool
 
+    def get_tool_instance(self, function_name: str) -> Optional[Tool]:
+        """Get the tool instance implementing a function.
+        
+        Args:
+            function_name: Name of the tool function (OpenAPI name or XML method name)
+            
+        Returns:
+            The tool instance, or None if the function is not registered
+        """
+        tool_info = self.tools.get(function_name)
+        if tool_info:
+            return tool_info['instance']
+        for tool_info in self.xml_tools.values():
+            if tool_info['method'] == function_name:
+                return tool_info['instance']
+        return None
+
+    def get_execution_traits(self, function_name: str) -> Optional[ToolExecutionTraits]:
+        """Get the concurrency traits declared for a tool function.
+        
+        Args:
+            function_name: Name of the tool function
+            
+        Returns:
+            The declared traits, or None if the tool declares none
+        """
+        tool_instance = self.get_tool_instance(function_name)
+        if tool_instance is None:
+            return None
+        return tool_instance.get_execution_traits(function_name)
+
+    def get_execution_limits(self, function_name: str) -> ToolExecutionLimits:
+        """Get the timeout and concurrency cap declared for a tool function.
+        
+        Args:
+            function_name: Name of the tool function
+            
+        Returns:
+            The effective limits; fields are None when nothing is declared
+        """
+        tool_instance = self.get_tool_instance(function_name)
+        if tool_instance is None:
+            return ToolExecutionLimits()
+        return tool_instance.get_execution_limits(function_name)
+
     def get_openapi_schemas(self) -> List[Dict[str, Any]]:
         """Get OpenAPI schemas for function calling.
         
@@ -155,3 +215,91 @@ class ToolRegistry:
                 examples[schema.xml_schema.tag_name] = schema.xml_schema.example
         logger.debug(f"Retrieved {len(examples)} XML examples")
         return examples
+
+    def get_tool_set_hash(self) -> str:
+        """Get a hash of the schemas and XML examples the registered tools expose to the LLM.
+        
+        Re-registering the same tools (e.g. with a new sandbox) keeps the hash, so
+        prompts assembled for the tool set stay valid across runs.
+        
+        Returns:
+            Hex digest, recomputed only after a registration
+        """
+        if self._tool_set_hash is None:
+            tool_set = {
+                "openapi": {name: tool_info['schema'].schema for name, tool_info in self.tools.items()},
+                "xml": {
+                    tag_name: [tool_info['method'], tool_info['schema'].xml_schema.example]
+                    for tag_name, tool_info in self.xml_tools.items()
+                },
+            }
+            encoded = json.dumps(tool_set, sort_keys=True, default=str).encode('utf-8')
+            self._tool_set_hash = hashlib.sha1(encoded).hexdigest()
+        return self._tool_set_hash
+
+    def overlay(self) -> "RunToolRegistry":
+        """Create a registry for one run that sees this registry's tools.
+        
+        Tools registered on the overlay (e.g. bound to the run's sandbox) are
+        only visible to the run, so concurrent runs do not replace each other's
+        tool instances.
+        
+        Returns:
+            A new run-scoped registry
+        """
+        return RunToolRegistry(self)
+
+
+class RunToolRegistry(ToolRegistry):
+    """Copy-on-write view of a shared registry, scoped to one agent run.
+    
+    Lookups fall through to the shared registry; registrations only change the
+    overlay. release() cleans up the tool instances created for the run.
+    
+    Attributes:
+        parent (ToolRegistry): Shared registry whose tools the run also sees
+    """
+    
+    def __new__(cls, parent: ToolRegistry):
+        """Create an overlay; unlike ToolRegistry, every call returns a new instance."""
+        return object.__new__(cls)
+    
+    def __init__(self, parent: ToolRegistry):
+        """Initialize an empty overlay over a shared registry.
+        
+        Args:
+            parent: Shared registry whose tools the run also sees
+        """
+        self.parent = parent
+        self.tools = ChainMap({}, parent.tools)
+        self.xml_tools = ChainMap({}, parent.xml_tools)
+        self._tool_set_hash = None
+        self._parent_tool_set_hash = None
+        self._instances: List[Tool] = []
+    
+    def register_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
+        """Register a tool for this run only; see ToolRegistry.register_tool."""
+        tool_instance = super().register_tool(tool_class, function_names, **kwargs)
+        self._instances.append(tool_instance)
+        return tool_instance
+    
+    def get_tool_set_hash(self) -> str:
+        """Get the tool set hash, recomputed after registrations here or in the parent."""
+        parent_hash = self.parent.get_tool_set_hash()
+        if parent_hash != self._parent_tool_set_hash:
+            self._parent_tool_set_hash = parent_hash
+            self._tool_set_hash = None
+        return super().get_tool_set_hash()
+    
+    async def release(self) -> None:
+        """Clean up the tool instances registered for the run and drop them from the overlay."""
+        instances, self._instances = self._instances, []
+        self.tools.maps[0].clear()
+        self.xml_tools.maps[0].clear()
+        self._tool_set_hash = None
+        for tool_instance in instances:
+            try:
+                await tool_instance.cleanup()
+            except Exception as e:
+                logger.warning(f"Failed to clean up tool {type(tool_instance).__name__}: {str(e)}")
+        logger.debug(f"Released {len(instances)} run-scoped tool instances")
@@ -0,0 +1,145 @@
+"""
+Dependency-aware scheduling of tool calls for AgentPress.
+
+The scheduler replaces the all-or-nothing sequential/parallel switch with
+per-call dependencies derived from each tool's ToolExecutionTraits:
+- Read-only calls never wait for anything
+- Calls mutating the same path run in call order
+- Calls needing an exclusive resource (e.g. the browser) run in call order
+  with every other call using that resource
+- Tools without declared traits are serialized against all other calls
+
+Calls are submitted one at a time, so tools detected while a response is still
+streaming can start as soon as the calls they conflict with have finished.
+"""
+
+import asyncio
+import posixpath
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from agentpress.tool import ToolExecutionTraits, ToolResult
+from agentpress.tool_registry import ToolRegistry
+from utils.logger import logger
+
+# Resource held by every call: shared by declared tools, exclusive for undeclared ones
+ALL_TOOLS_RESOURCE = "*"
+
+# (resource, exclusive) pairs held by one call
+ResourceClaims = FrozenSet[Tuple[str, bool]]
+
+
+class ToolScheduler:
+    """Runs tool calls concurrently unless their declared traits conflict.
+
+    Each submitted call becomes a task that first waits for the earlier calls
+    it conflicts with. Results are returned in submission order.
+    """
+
+    def __init__(self, tool_registry: ToolRegistry, execute: Callable[[Dict[str, Any]], Awaitable[ToolResult]]):
+        """Initialize the scheduler.
+
+        Args:
+            tool_registry: Registry used to look up the traits of each tool
+            execute: Coroutine function executing one tool call
+        """
+        self.tool_registry = tool_registry
+        self.execute = execute
+        self._submitted: List[Tuple[Dict[str, Any], ResourceClaims, asyncio.Task]] = []
+
+    def _resource_claims(self, tool_call: Dict[str, Any]) -> ResourceClaims:
+        """Translate a call's traits into the resources it holds while running."""
+        function_name = tool_call.get("function_name", "")
+        traits: Optional[ToolExecutionTraits] = self.tool_registry.get_execution_traits(function_name)
+        if traits is None:
+            return frozenset({(ALL_TOOLS_RESOURCE, True)})
+
+        claims = {(ALL_TOOLS_RESOURCE, False)}
+        claims.update((resource, True) for resource in traits.exclusive_resources)
+        claims.update((resource, False) for resource in traits.shared_resources)
+
+        arguments = tool_call.get("arguments")
+        if traits.path_param and isinstance(arguments, dict) and arguments.get(traits.path_param):
+            path = self._normalize_path(function_name, str(arguments[traits.path_param]))
+            # Readers of a path share it; writers need it to themselves
+            claims.add((f"path:{path}", not traits.read_only))
+
+        return frozenset(claims)
+
+    def _normalize_path(self, function_name: str, path: str) -> str:
+        """Normalize a path argument, using the tool's own clean_path when it has one."""
+        instance = self.tool_registry.get_tool_instance(function_name)
+        clean_path = getattr(instance, "clean_path", None)
+        if callable(clean_path):
+            try:
+                path = clean_path(path)
+            except Exception:
+                pass
+        return posixpath.normpath(path.strip().lstrip("/")) or "."
+
+    @staticmethod
+    def _conflicts(first: ResourceClaims, second: ResourceClaims) -> bool:
+        """Whether two calls use a common resource and at least one needs it exclusively."""
+        first_modes: Dict[str, bool] = {}
+        for resource, exclusive in first:
+            first_modes[resource] = first_modes.get(resource, False) or exclusive
+        for resource, exclusive in second:
+            if resource in first_modes and (exclusive or first_modes[resource]):
+                return True
+        return False
+
+    def submit(
+        self,
+        tool_call: Dict[str, Any],
+        execute: Optional[Callable[[Dict[str, Any]], Awaitable[ToolResult]]] = None
+    ) -> asyncio.Task:
+        """Schedule a tool call after the earlier calls it conflicts with.
+
+        Args:
+            tool_call: Tool call to execute
+            execute: Optional coroutine function overriding the scheduler's executor for this call
+
+        Returns:
+            Task resolving to the call's ToolResult
+        """
+        claims = self._resource_claims(tool_call)
+        dependencies = [
+            task for _, earlier_claims, task in self._submitted
+            if not task.done() and self._conflicts(earlier_claims, claims)
+        ]
+        if dependencies:
+            logger.debug(f"Tool {tool_call.get('function_name')} waits for {len(dependencies)} conflicting call(s)")
+
+        task = asyncio.create_task(self._run_after(tool_call, dependencies, execute or self.execute))
+        self._submitted.append((tool_call, claims, task))
+        return task
+
+    async def _run_after(
+        self,
+        tool_call: Dict[str, Any],
+        dependencies: List[asyncio.Task],
+        execute: Callable[[Dict[str, Any]], Awaitable[ToolResult]]
+    ) -> ToolResult:
+        """Wait for conflicting calls (whatever their outcome), then execute."""
+        if dependencies:
+            await asyncio.wait(dependencies)
+        return await execute(tool_call)
+
+    async def run(self, tool_calls: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], ToolResult]]:
+        """Schedule a batch of tool calls and wait for all of them.
+
+        Args:
+            tool_calls: Tool calls in the order the LLM made them
+
+        Returns:
+            List of (tool_call, result) tuples in call order
+        """
+        tasks = [self.submit(tool_call) for tool_call in tool_calls]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        processed_results = []
+        for tool_call, result in zip(tool_calls, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error executing tool {tool_call.get('function_name', 'unknown')}: {str(result)}")
+                result = ToolResult(success=False, output=f"Error executing tool: {str(result)}")
+            processed_results.append((tool_call, result))
+        return processed_results
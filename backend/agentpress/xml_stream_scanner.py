@@ -0,0 +1,145 @@
+"""
+Incremental scanner for XML tool calls in streamed LLM output.
+
+This module provides a resumable scanner that detects complete XML tool call
+chunks (e.g. <create-file ...>...</create-file>) as content arrives:
+- All registered tag names are matched in one pass with a single compiled alternation
+- Nesting depth of the current tag is tracked across deltas
+- Only newly received text (plus a small carry-over) is scanned on each feed
+- Each complete chunk is emitted exactly once
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable, List, Optional, Pattern, Tuple
+
+
+@lru_cache(maxsize=32)
+def _compile_tag_patterns(tag_names: Tuple[str, ...]) -> Tuple[Pattern, int]:
+    """Compile the opening-tag alternation for a set of tag names.
+
+    Longer names come first so that a tag which is a prefix of another
+    (e.g. "wait" and "wait-sequence") never shadows it.
+    """
+    ordered = sorted(tag_names, key=len, reverse=True)
+    alternation = "|".join(re.escape(name) for name in ordered)
+    open_pattern = re.compile(rf"<({alternation})(?=[\s/>])")
+    max_len = max(len(name) for name in ordered)
+    return open_pattern, max_len
+
+
+@lru_cache(maxsize=128)
+def _compile_inner_pattern(tag_name: str) -> Pattern:
+    """Compile the pattern matching nested opening or closing tags of one name."""
+    escaped = re.escape(tag_name)
+    return re.compile(rf"<{escaped}(?=[\s/>])|</{escaped}>")
+
+
+class XMLStreamScanner:
+    """Stateful scanner that extracts complete XML tool call chunks from a stream.
+
+    Feed each content delta with `feed()`; it returns the chunks completed by
+    that delta. Text outside of registered tags is discarded once it can no
+    longer be the start of a tag, so memory is bounded by the size of the
+    chunk currently being assembled.
+
+    Attributes:
+        tag_names (Tuple[str, ...]): Registered XML tag names being matched
+    """
+
+    def __init__(self, tag_names: Iterable[str]):
+        """Initialize the scanner.
+
+        Args:
+            tag_names: XML tag names to detect (e.g. ToolRegistry.xml_tools keys)
+        """
+        self.tag_names = tuple(sorted(set(tag_names)))
+        if self.tag_names:
+            self._open_pattern, max_len = _compile_tag_patterns(self.tag_names)
+            # "<" + longest name; the lookahead character may still be missing
+            self._open_holdback = max_len + 1
+        else:
+            self._open_pattern, self._open_holdback = None, 0
+
+        self._pending = ""                    # Unresolved tail carried into the next feed
+        self._current_tag: Optional[str] = None
+        self._inner_pattern: Optional[Pattern] = None
+        self._inner_holdback = 0
+        self._depth = 0
+        self._chunk_parts: List[str] = []     # Confirmed text of the chunk being assembled
+
+    @property
+    def in_tag(self) -> bool:
+        """Whether the scanner is currently inside an unfinished tool call."""
+        return self._current_tag is not None
+
+    def reset(self) -> None:
+        """Discard all buffered state."""
+        self._pending = ""
+        self._current_tag = None
+        self._inner_pattern = None
+        self._inner_holdback = 0
+        self._depth = 0
+        self._chunk_parts = []
+
+    def feed(self, delta: str) -> List[str]:
+        """Consume a content delta and return any XML chunks it completed.
+
+        Args:
+            delta: Newly received content
+
+        Returns:
+            List of complete XML chunks, in order of appearance
+        """
+        if not delta or self._open_pattern is None:
+            return []
+
+        text = self._pending + delta
+        self._pending = ""
+        pos = 0
+        chunks: List[str] = []
+
+        while True:
+            if self._current_tag is None:
+                match = self._open_pattern.search(text, pos)
+                if not match:
+                    # Keep only what could still become an opening tag
+                    self._pending = text[max(pos, len(text) - self._open_holdback):]
+                    break
+
+                self._current_tag = match.group(1)
+                self._inner_pattern = _compile_inner_pattern(self._current_tag)
+                # "</" + name + ">" needs len + 3 chars; keep everything that could start one
+                self._inner_holdback = len(self._current_tag) + 2
+                self._depth = 1
+                self._chunk_parts = [match.group(0)]
+                pos = match.end()
+                continue
+
+            match = self._inner_pattern.search(text, pos)
+            if not match:
+                cut = max(pos, len(text) - self._inner_holdback)
+                if cut > pos:
+                    self._chunk_parts.append(text[pos:cut])
+                self._pending = text[cut:]
+                break
+
+            self._chunk_parts.append(text[pos:match.end()])
+            pos = match.end()
+            if match.group(0).startswith("</"):
+                self._depth -= 1
+            else:
+                self._depth += 1
+
+            if self._depth == 0:
+                chunks.append("".join(self._chunk_parts))
+                self._current_tag = None
+                self._inner_pattern = None
+                self._chunk_parts = []
+
+        return chunks
+
+
+def extract_xml_chunks(content: str, tag_names: Iterable[str]) -> List[str]:
+    """Extract all complete XML chunks for the given tag names from a full string."""
+    return XMLStreamScanner(tag_names).feed(content)
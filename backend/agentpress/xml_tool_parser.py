@@ -0,0 +1,162 @@
+"""
+Compiled parsers for XML tool calls.
+
+Each XMLTagSchema is compiled once, at tool registration time, into an
+XMLToolParser holding:
+- Precompiled quote-style patterns for every attribute mapping
+- One pattern matching every element tag (and the root tag) of the schema
+- The mapping order and the set of required parameters
+
+Parsing a chunk then needs a single scan over it to produce both the
+arguments and the parsing details stored with the tool result.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+from agentpress.tool import XMLTagSchema
+from utils.logger import logger
+
+
+def _unescape(value: str) -> str:
+    """Unescape the common XML entities in an attribute value."""
+    value = value.replace('&quot;', '"').replace('&apos;', "'")
+    value = value.replace('&lt;', '<').replace('&gt;', '>')
+    value = value.replace('&amp;', '&')
+    return value
+
+
+class XMLToolParser:
+    """One-pass parser for the XML tag described by an XMLTagSchema.
+
+    Attributes:
+        schema (XMLTagSchema): The schema this parser was compiled from
+        tag_name (str): Root tag name of the tool
+        required_params (Tuple[str, ...]): Parameters that must be present
+    """
+
+    def __init__(self, schema: XMLTagSchema):
+        """Compile the schema into reusable patterns.
+
+        Args:
+            schema: XML schema of the tool
+        """
+        self.schema = schema
+        self.tag_name = schema.tag_name
+        self.mappings = list(schema.mappings)
+        self.required_params = tuple(m.param_name for m in self.mappings if m.required)
+
+        # Attribute paths are used verbatim as patterns, matching the previous per-call behaviour
+        self._attribute_patterns: Dict[str, Tuple[Pattern, ...]] = {}
+        element_names: List[str] = []
+        for mapping in self.mappings:
+            if mapping.node_type == "attribute" and mapping.path not in self._attribute_patterns:
+                self._attribute_patterns[mapping.path] = (
+                    re.compile(fr'{mapping.path}="([^"]*)"'),   # Double quotes
+                    re.compile(fr"{mapping.path}='([^']*)'"),   # Single quotes
+                    re.compile(fr'{mapping.path}=([^\s/>;]+)'),  # No quotes
+                )
+            elif mapping.node_type == "element" and mapping.path not in element_names:
+                element_names.append(mapping.path)
+
+        self._root_pattern = re.compile(rf"<{re.escape(self.tag_name)}(?=[\s/>])")
+        names = [self.tag_name] + [name for name in element_names if name != self.tag_name]
+        alternation = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+        self._tag_pattern = re.compile(rf"<(/?)({alternation})(?=[\s/>])")
+
+    def _scan_spans(self, xml_chunk: str) -> Dict[str, List[Tuple[int, int]]]:
+        """Scan the chunk once and collect the outermost content spans of every tag.
+
+        Returns:
+            Dict mapping tag name to a list of (content_start, content_end) spans
+        """
+        spans: Dict[str, List[Tuple[int, int]]] = {}
+        open_starts: Dict[str, int] = {}
+        depths: Dict[str, int] = {}
+
+        for match in self._tag_pattern.finditer(xml_chunk):
+            closing, name = match.group(1), match.group(2)
+            depth = depths.get(name, 0)
+            if not closing:
+                if depth == 0:
+                    tag_end = xml_chunk.find('>', match.end())
+                    if tag_end == -1:
+                        break
+                    open_starts[name] = tag_end + 1
+                depths[name] = depth + 1
+            elif depth > 0:
+                depths[name] = depth - 1
+                if depth == 1:
+                    spans.setdefault(name, []).append((open_starts.pop(name), match.start()))
+
+        return spans
+
+    def parse(self, xml_chunk: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Parse an XML chunk into tool arguments and parsing details.
+
+        Args:
+            xml_chunk: Complete XML chunk starting with the tool's root tag
+
+        Returns:
+            Tuple of (arguments, parsing_details) or None if required parameters are missing.
+            - parsing_details: Dict with 'attributes', 'elements', 'text_content', 'root_content', 'raw_chunk'
+        """
+        params: Dict[str, Any] = {}
+        parsing_details = {
+            "attributes": {},
+            "elements": {},
+            "text_content": None,
+            "root_content": None,
+            "raw_chunk": xml_chunk  # Store the original chunk for reference
+        }
+
+        root_match = self._root_pattern.search(xml_chunk)
+        if not root_match:
+            logger.error(f"Root tag <{self.tag_name}> not found in XML chunk")
+            return None
+
+        tag_end = xml_chunk.find('>', root_match.end())
+        opening_tag = xml_chunk[:tag_end] if tag_end != -1 else xml_chunk
+        spans = self._scan_spans(xml_chunk)
+        root_spans = spans.get(self.tag_name)
+        root_content = xml_chunk[root_spans[0][0]:root_spans[0][1]].strip() if root_spans else None
+
+        # Elements are matched in mapping order, each one after the previous match
+        cursor = 0
+        for mapping in self.mappings:
+            if mapping.node_type == "attribute":
+                for pattern in self._attribute_patterns[mapping.path]:
+                    match = pattern.search(opening_tag)
+                    if match:
+                        value = _unescape(match.group(1))
+                        params[mapping.param_name] = value
+                        parsing_details["attributes"][mapping.path] = value
+                        break
+
+            elif mapping.node_type == "element":
+                for start, end in spans.get(mapping.path, []):
+                    if start >= cursor:
+                        content = xml_chunk[start:end].strip()
+                        params[mapping.param_name] = content
+                        parsing_details["elements"][mapping.path] = content
+                        cursor = end
+                        break
+
+            elif mapping.node_type == "text":
+                if root_content is not None:
+                    params[mapping.param_name] = root_content
+                    parsing_details["text_content"] = root_content
+
+            elif mapping.node_type == "content":
+                if root_content is not None:
+                    params[mapping.param_name] = root_content
+                    parsing_details["root_content"] = root_content
+
+        missing = [name for name in self.required_params if name not in params]
+        if missing:
+            logger.error(f"Missing required parameters for <{self.tag_name}>: {missing}")
+            logger.error(f"Current params: {params}")
+            logger.error(f"XML chunk: {xml_chunk}")
+            return None
+
+        return params, parsing_details
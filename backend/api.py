@@ -54,6 +54,10 @@ async def lifespan(app: FastAPI):
     # Clean up database connection
     logger.info("Disconnecting from database")
     await db.disconnect()
+    
+    # Close the pooled LLM provider connections
+    from services.llm_http import llm_http_pools
+    await llm_http_pools.aclose()
 
 app = FastAPI(lifespan=lifespan)
 
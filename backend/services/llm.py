@@ -5,28 +5,68 @@ This module provides a unified interface for making API calls to different LLM p
 (OpenAI, Anthropic, Groq, etc.) using LiteLLM. It includes support for:
 - Streaming responses
 - Tool calls and function calling
-- Retry logic with exponential backoff
+- Retries honouring Retry-After, fallback models, circuit breakers and hedging (see services.llm_retry)
 - Model-specific configurations
+- Usage-based cost accounting from a local price table
+- Anthropic prompt cache breakpoints and cache hit rate tracking
+- Long-lived pooled HTTP clients per provider (see services.llm_http)
+- Request and token budgets shared by all instances (see services.llm_rate_limit)
+- Opt-in exact-match cache of temperature-0 responses (see services.llm_cache)
+- Recording responses to files and replaying them offline (see services.llm_transport)
 - Comprehensive error handling and logging
 """
 
-from typing import Union, Dict, Any, Optional, AsyncGenerator, List
+from typing import Union, Dict, Any, Optional, AsyncGenerator, List, Tuple
+from functools import lru_cache
 import os
-import json
 import asyncio
-from openai import OpenAIError
+import time
 import litellm
 from utils.logger import logger
+from services.llm_http import llm_http_pools, provider_of
+from services.llm_retry import RetryPolicy, RetriesExhausted, call_with_retries
+from services.llm_rate_limit import llm_rate_limiter, estimate_tokens
+from services.llm_cache import llm_response_cache, response_cache_key
+from services.llm_transport import llm_transport
 from datetime import datetime
-import traceback
 
 # litellm.set_verbose=True
 litellm.modify_params=True
 
-# Constants
-MAX_RETRIES = 3
-RATE_LIMIT_DELAY = 30
-RETRY_DELAY = 5
+# Send LLM calls through the shared pooled HTTP clients
+LLM_HTTP_POOLING = os.getenv('LLM_HTTP_POOLING', 'true').lower() != 'false'
+
+# Providers known to accept stream_options; LiteLLM translates it for Anthropic and Bedrock
+STREAM_USAGE_PROVIDERS = ("openai", "anthropic", "openrouter", "bedrock")
+
+# Anthropic accepts at most this many cache_control blocks per request
+ANTHROPIC_MAX_CACHE_BREAKPOINTS = 4
+
+# Prices in USD per million tokens: (input, output, cache read, cache write).
+# Keys are matched as substrings of the model name, longest key first.
+MODEL_PRICING: Dict[str, Tuple[float, float, float, float]] = {
+    "claude-3-7-sonnet": (3.00, 15.00, 0.30, 3.75),
+    "claude-3-5-sonnet": (3.00, 15.00, 0.30, 3.75),
+    "claude-3-5-haiku": (0.80, 4.00, 0.08, 1.00),
+    "claude-3-opus": (15.00, 75.00, 1.50, 18.75),
+    "gpt-4o-mini": (0.15, 0.60, 0.075, 0.15),
+    "gpt-4o": (2.50, 10.00, 1.25, 2.50),
+    "gpt-4.1-mini": (0.40, 1.60, 0.10, 0.40),
+    "gpt-4.1": (2.00, 8.00, 0.50, 2.00),
+    "deepseek-chat": (0.27, 1.10, 0.07, 0.27),
+}
+
+# Context windows in tokens, matched like MODEL_PRICING; other models use LiteLLM's model map.
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "claude-3-7-sonnet": 200000,
+    "claude-3-5-sonnet": 200000,
+    "claude-3-5-haiku": 200000,
+    "claude-3-opus": 200000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "deepseek-chat": 65536,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
 
 class LLMError(Exception):
     """Base exception for LLM-related errors."""
@@ -65,12 +105,225 @@ def setup_api_keys() -> None:
     else:
         logger.warning(f"Missing AWS credentials for Bedrock integration - access_key: {bool(aws_access_key)}, secret_key: {bool(aws_secret_key)}, region: {aws_region}")
 
-async def handle_error(error: Exception, attempt: int, max_attempts: int) -> None:
-    """Handle API errors with appropriate delays and logging."""
-    delay = RATE_LIMIT_DELAY if isinstance(error, litellm.exceptions.RateLimitError) else RETRY_DELAY
-    logger.warning(f"Error on attempt {attempt + 1}/{max_attempts}: {str(error)}")
-    logger.debug(f"Waiting {delay} seconds before retry...")
-    await asyncio.sleep(delay)
+@lru_cache(maxsize=64)
+def get_model_pricing(model_name: str) -> Optional[Tuple[float, float, float, float]]:
+    """Get per-token prices (input, output, cache read, cache write) for a model.
+
+    Looks up the local price table first and falls back to LiteLLM's model cost map.
+    """
+    normalized = model_name.lower()
+    for key in sorted(MODEL_PRICING, key=len, reverse=True):
+        if key in normalized:
+            return tuple(price / 1_000_000 for price in MODEL_PRICING[key])
+
+    model_info = litellm.model_cost.get(model_name) or litellm.model_cost.get(model_name.split("/", 1)[-1])
+    if not model_info or model_info.get("input_cost_per_token") is None:
+        return None
+    input_cost = model_info.get("input_cost_per_token") or 0.0
+    return (
+        input_cost,
+        model_info.get("output_cost_per_token") or 0.0,
+        model_info.get("cache_read_input_token_cost") or input_cost,
+        model_info.get("cache_creation_input_token_cost") or input_cost,
+    )
+
+@lru_cache(maxsize=64)
+def get_model_context_window(model_name: str) -> int:
+    """Get the input context window of a model in tokens.
+
+    Looks up the local table first, then LiteLLM's model map, and falls back to
+    DEFAULT_CONTEXT_WINDOW for unknown models.
+    """
+    normalized = model_name.lower()
+    for key in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if key in normalized:
+            return MODEL_CONTEXT_WINDOWS[key]
+
+    model_info = litellm.model_cost.get(model_name) or litellm.model_cost.get(model_name.split("/", 1)[-1]) or {}
+    return model_info.get("max_input_tokens") or DEFAULT_CONTEXT_WINDOW
+
+def normalize_usage(usage: Any) -> Dict[str, int]:
+    """Convert a provider usage block into token counts.
+
+    prompt_tokens includes cache reads but not cache writes, as LiteLLM reports them.
+
+    Returns:
+        Dict with prompt_tokens, completion_tokens, cache_read_input_tokens, cache_creation_input_tokens
+    """
+    def _get(obj: Any, key: str) -> Any:
+        if obj is None:
+            return None
+        return obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
+
+    cache_read = _get(usage, "cache_read_input_tokens")
+    if not cache_read:
+        cache_read = _get(_get(usage, "prompt_tokens_details"), "cached_tokens")
+
+    return {
+        "prompt_tokens": _get(usage, "prompt_tokens") or 0,
+        "completion_tokens": _get(usage, "completion_tokens") or 0,
+        "cache_read_input_tokens": cache_read or 0,
+        "cache_creation_input_tokens": _get(usage, "cache_creation_input_tokens") or 0,
+    }
+
+def calculate_cost(model_name: str, usage: Dict[str, int]) -> Optional[float]:
+    """Calculate the cost of a call from normalized token counts.
+
+    Args:
+        model_name: Name of the model that served the call
+        usage: Token counts as returned by normalize_usage
+
+    Returns:
+        Cost in USD, or None if the model has no known pricing
+    """
+    pricing = get_model_pricing(model_name)
+    if pricing is None:
+        return None
+    input_cost, output_cost, cache_read_cost, cache_write_cost = pricing
+    cache_read = usage.get("cache_read_input_tokens", 0)
+    uncached_prompt = max(usage.get("prompt_tokens", 0) - cache_read, 0)
+    return (
+        uncached_prompt * input_cost
+        + cache_read * cache_read_cost
+        + usage.get("cache_creation_input_tokens", 0) * cache_write_cost
+        + usage.get("completion_tokens", 0) * output_cost
+    )
+
+def prompt_cache_hit_rate(usage: Dict[str, int]) -> Optional[float]:
+    """Share of a call's prompt tokens read from the provider's prompt cache.
+
+    Args:
+        usage: Token counts as returned by normalize_usage
+
+    Returns:
+        Cache reads over all prompt tokens (including cache writes), or None without prompt tokens
+    """
+    total = usage.get("prompt_tokens", 0) + usage.get("cache_creation_input_tokens", 0)
+    if not total:
+        return None
+    return usage.get("cache_read_input_tokens", 0) / total
+
+class PromptCacheStats:
+    """Process-wide prompt cache token counts per model, for tracking the cache hit rate.
+
+    Attributes:
+        models (Dict[str, Dict[str, int]]): Per model: calls, prompt_tokens,
+            cache_read_input_tokens and cache_creation_input_tokens
+    """
+
+    def __init__(self):
+        self.models: Dict[str, Dict[str, int]] = {}
+
+    def record(self, model_name: str, usage: Dict[str, int]) -> None:
+        """Add the normalized usage of one call."""
+        totals = self.models.setdefault(model_name, {
+            "calls": 0, "prompt_tokens": 0, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0
+        })
+        totals["calls"] += 1
+        for key in ("prompt_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+            totals[key] += usage.get(key, 0)
+
+    def hit_rate(self, model_name: Optional[str] = None) -> Optional[float]:
+        """Cache hit rate of one model, or of all models if none is given."""
+        if model_name is not None:
+            totals = self.models.get(model_name)
+            return prompt_cache_hit_rate(totals) if totals else None
+        combined: Dict[str, int] = {}
+        for totals in self.models.values():
+            for key, value in totals.items():
+                combined[key] = combined.get(key, 0) + value
+        return prompt_cache_hit_rate(combined)
+
+prompt_cache_stats = PromptCacheStats()
+
+def _count_cache_controls(message: Dict[str, Any]) -> int:
+    """Count the cache_control blocks a caller already placed in a message."""
+    content = message.get("content")
+    if not isinstance(content, list):
+        return 0
+    return sum(1 for block in content if isinstance(block, dict) and "cache_control" in block)
+
+def _can_hold_breakpoint(message: Dict[str, Any]) -> bool:
+    """Whether a cache_control block can be placed on a message's text."""
+    if message.get("role") not in ("system", "user", "assistant"):
+        return False
+    content = message.get("content")
+    if isinstance(content, str):
+        return bool(content)
+    if isinstance(content, list):
+        return any(isinstance(block, dict) and block.get("type") == "text" and block.get("text") for block in content)
+    return False
+
+def plan_cache_breakpoints(
+    messages: List[Dict[str, Any]],
+    max_breakpoints: int = ANTHROPIC_MAX_CACHE_BREAKPOINTS
+) -> List[int]:
+    """Choose the messages whose prefixes are cached.
+
+    Breakpoints go on prefixes that only grow while a thread runs, so the prefix
+    written by one call is read by the next:
+    - The system prompt, shared by every call of the agent
+    - The last message, whose prefix the next call extends
+    - The ends of the most recent previous turns (the message before each
+      assistant response), which stay valid when the tail of the prompt changes
+      (e.g. a temporary message inserted before the last user message)
+
+    Messages that cannot hold a breakpoint (tool results, empty content) are
+    replaced by the nearest earlier message that can.
+
+    Args:
+        messages: Messages of the call, which are not modified
+        max_breakpoints: Provider limit, reduced by cache_control blocks already present
+
+    Returns:
+        Sorted indices of the messages to mark
+    """
+    budget = max_breakpoints - sum(_count_cache_controls(message) for message in messages)
+    if budget <= 0 or not messages:
+        return []
+
+    def eligible_at_or_before(index: int) -> int:
+        while index >= 0 and not _can_hold_breakpoint(messages[index]):
+            index -= 1
+        return index
+
+    candidates = []
+    if messages[0].get("role") == "system":
+        candidates.append(eligible_at_or_before(0))
+    candidates.append(eligible_at_or_before(len(messages) - 1))
+    for index in range(len(messages) - 1, 0, -1):
+        if messages[index].get("role") == "assistant":
+            candidates.append(eligible_at_or_before(index - 1))
+
+    planned: List[int] = []
+    for index in candidates:
+        if index >= 0 and index not in planned:
+            planned.append(index)
+        if len(planned) == budget:
+            break
+    return sorted(planned)
+
+def apply_cache_breakpoints(messages: List[Dict[str, Any]], breakpoints: List[int]) -> List[Dict[str, Any]]:
+    """Return messages with cache_control on the last text block of each breakpoint message.
+
+    Marked messages are copied; the caller's messages and content blocks are not changed.
+    """
+    marked = list(messages)
+    for index in breakpoints:
+        message = dict(messages[index])
+        content = message.get("content")
+        if isinstance(content, str):
+            message["content"] = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+        else:
+            content = list(content)
+            for position in range(len(content) - 1, -1, -1):
+                block = content[position]
+                if isinstance(block, dict) and block.get("type") == "text" and block.get("text"):
+                    content[position] = {**block, "cache_control": {"type": "ephemeral"}}
+                    break
+            message["content"] = content
+        marked[index] = message
+    return marked
 
 def prepare_params(
     messages: List[Dict[str, Any]],
@@ -98,6 +351,11 @@ def prepare_params(
         "stream": stream,
     }
 
+    # Ask for a usage block at the end of streamed responses for cost accounting.
+    # Other providers and custom API bases may reject the unknown parameter; their cost is estimated.
+    if stream and not api_base and provider_of(model_name) in STREAM_USAGE_PROVIDERS:
+        params["stream_options"] = {"include_usage": True}
+
     if api_key:
         params["api_key"] = api_key
     if api_base:
@@ -156,64 +414,16 @@ def prepare_params(
             params["model_id"] = "arn:aws:bedrock:us-west-2:935064898258:inference-profile/us.anthropic.claude-3-7-sonnet-20250219-v1:0"
             logger.debug(f"Auto-set model_id for Claude 3.7 Sonnet: {params['model_id']}")
 
-    # Apply Anthropic prompt caching (minimal implementation)
+    # Apply Anthropic prompt caching on copies of the breakpoint messages
     # Check model name *after* potential modifications (like adding bedrock/ prefix)
     effective_model_name = params.get("model", model_name) # Use model from params if set, else original
     if "claude" in effective_model_name.lower() or "anthropic" in effective_model_name.lower():
-        logger.debug("Applying minimal Anthropic prompt caching.")
-        messages = params["messages"] # Direct reference, modification affects params
-
-        # Ensure messages is a list
         if not isinstance(messages, list):
             logger.warning(f"Messages is not a list ({type(messages)}), skipping Anthropic cache control.")
             return params # Return early if messages format is unexpected
-
-        # 1. Process the first message if it's a system prompt with string content
-        if messages and messages[0].get("role") == "system":
-            content = messages[0].get("content")
-            if isinstance(content, str):
-                # Wrap the string content in the required list structure
-                messages[0]["content"] = [
-                    {"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}
-                ]
-                logger.debug("Applied cache_control to system message (converted from string).")
-            elif isinstance(content, list):
-                 # If content is already a list, check if the first text block needs cache_control
-                 for item in content:
-                     if isinstance(item, dict) and item.get("type") == "text":
-                         if "cache_control" not in item:
-                             item["cache_control"] = {"type": "ephemeral"}
-                             break # Apply to the first text block only for system prompt
-            else:
-                 logger.warning("System message content is not a string or list, skipping cache_control.")
-
-        # 2. Find and process the last user message
-        last_user_idx = -1
-        for i in range(len(messages) - 1, -1, -1):
-            if messages[i].get("role") == "user":
-                last_user_idx = i
-                break
-
-        if last_user_idx != -1:
-            last_user_message = messages[last_user_idx]
-            content = last_user_message.get("content")
-
-            if isinstance(content, str):
-                # Wrap the string content in the required list structure
-                last_user_message["content"] = [
-                    {"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}
-                ]
-                logger.debug(f"Applied cache_control to last user message (string content, index {last_user_idx}).")
-            elif isinstance(content, list):
-                # Modify text blocks within the list directly
-                for item in content:
-                    if isinstance(item, dict) and item.get("type") == "text":
-                        # Add cache_control if not already present
-                        if "cache_control" not in item:
-                           item["cache_control"] = {"type": "ephemeral"}
-
-            else:
-                logger.warning(f"Last user message (index {last_user_idx}) content is not a string or list ({type(content)}), skipping cache_control.")
+        breakpoints = plan_cache_breakpoints(messages)
+        params["messages"] = apply_cache_breakpoints(messages, breakpoints)
+        logger.debug(f"Applied Anthropic cache_control to messages {breakpoints}")
 
     # Add reasoning_effort for Anthropic models if enabled
     use_thinking = enable_thinking if enable_thinking is not None else False
@@ -241,7 +451,9 @@ async def make_llm_api_call(
     top_p: Optional[float] = None,
     model_id: Optional[str] = None,
     enable_thinking: Optional[bool] = False,
-    reasoning_effort: Optional[str] = 'low'
+    reasoning_effort: Optional[str] = 'low',
+    retry_policy: Optional[RetryPolicy] = None,
+    use_cache: Optional[bool] = None
 ) -> Union[Dict[str, Any], AsyncGenerator]:
     """
     Make an API call to a language model using LiteLLM.
@@ -261,56 +473,94 @@ async def make_llm_api_call(
         model_id: Optional ARN for Bedrock inference profiles
         enable_thinking: Whether to enable thinking
         reasoning_effort: Level of reasoning effort
+        retry_policy: Retries, fallback models and hedging; read from the environment if omitted
+        use_cache: Serve temperature-0 calls from the response cache; None follows LLM_RESPONSE_CACHE
         
     Returns:
-        Union[Dict[str, Any], AsyncGenerator]: API response or stream
+        Union[Dict[str, Any], AsyncGenerator]: API response or stream (starting with its first chunk)
         
     Raises:
-        LLMRetryError: If API call fails after retries
+        LLMRetryError: If API call fails after retries and fallbacks
         LLMError: For other API-related errors
     """
     logger.debug(f"Making LLM API call to model: {model_name} (Thinking: {enable_thinking}, Effort: {reasoning_effort})")
-    params = prepare_params(
-        messages=messages,
-        model_name=model_name,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        response_format=response_format,
-        tools=tools,
-        tool_choice=tool_choice,
-        api_key=api_key,
-        api_base=api_base,
-        stream=stream,
-        top_p=top_p,
-        model_id=model_id,
-        enable_thinking=enable_thinking,
-        reasoning_effort=reasoning_effort
-    )
+    policy = retry_policy or RetryPolicy.from_env(model_name)
+    prompt_tokens: Optional[int] = None
+    key: Optional[str] = None
     
-    last_error = None
-    for attempt in range(MAX_RETRIES):
-        try:
-            logger.debug(f"Attempt {attempt + 1}/{MAX_RETRIES}")
-            # logger.debug(f"API request parameters: {json.dumps(params, indent=2)}")
-            
-            response = await litellm.acompletion(**params)
-            logger.debug(f"Successfully received API response from {model_name}")
-            logger.debug(f"Response: {response}")
-            return response
-            
-        except (litellm.exceptions.RateLimitError, OpenAIError, json.JSONDecodeError) as e:
-            last_error = e
-            await handle_error(e, attempt, MAX_RETRIES)
-            
-        except Exception as e:
-            logger.error(f"Unexpected error during API call: {str(e)}", exc_info=True)
-            raise LLMError(f"API call failed: {str(e)}")
+    def request_key() -> str:
+        nonlocal key
+        if key is None:
+            key = response_cache_key(
+                model_name, messages, tools,
+                tool_choice=tool_choice if tools else None,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                response_format=response_format,
+                api_base=api_base,
+                model_id=model_id,
+                enable_thinking=enable_thinking or None,
+                reasoning_effort=reasoning_effort if enable_thinking else None,
+                fallback_models=list(policy.fallback_models) or None
+            )
+        return key
     
-    error_msg = f"Failed to make API call after {MAX_RETRIES} attempts"
-    if last_error:
-        error_msg += f". Last error: {str(last_error)}"
-    logger.error(error_msg, exc_info=True)
-    raise LLMRetryError(error_msg)
+    async def call(model: str):
+        nonlocal prompt_tokens
+        # Overrides of the call only apply to the requested model, not its fallbacks
+        requested = model == model_name
+        params = prepare_params(
+            messages=messages,
+            model_name=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format=response_format,
+            tools=tools,
+            tool_choice=tool_choice,
+            api_key=api_key if requested else None,
+            api_base=api_base if requested else None,
+            stream=stream,
+            top_p=top_p,
+            model_id=model_id if requested else None,
+            enable_thinking=enable_thinking,
+            reasoning_effort=reasoning_effort
+        )
+        
+        # Reuse the provider's pooled connections instead of a client per call
+        if LLM_HTTP_POOLING:
+            client = llm_http_pools.client_for(model, api_base=params.get("api_base"), api_key=params.get("api_key"))
+            if client is not None:
+                params["client"] = client
+        
+        # Queue until the model's shared request and token budget allows the call
+        if llm_rate_limiter.limit_for(model):
+            if prompt_tokens is None:
+                prompt_tokens = estimate_tokens(messages)
+            await llm_rate_limiter.acquire(model, prompt_tokens)
+        
+        started = time.monotonic()
+        response = await litellm.acompletion(**params)
+        logger.debug(f"Successfully received API response from {model}")
+        if llm_transport.recording:
+            response = await llm_transport.record(request_key(), model, response, stream, started)
+        return response
+    
+    async def upstream():
+        if llm_transport.replaying:
+            return await llm_transport.replay(request_key(), stream)
+        return await call_with_retries(call, model_name, policy, stream=stream)
+    
+    try:
+        if llm_response_cache.should_cache(use_cache, temperature, enable_thinking):
+            return await llm_response_cache.get_or_call(request_key(), upstream, stream=stream)
+        return await upstream()
+    except RetriesExhausted as e:
+        logger.error(str(e), exc_info=True)
+        raise LLMRetryError(str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error during API call: {str(e)}", exc_info=True)
+        raise LLMError(f"API call failed: {str(e)}")
 
 # Initialize API keys on module import
 setup_api_keys()
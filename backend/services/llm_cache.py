@@ -0,0 +1,408 @@
+"""
+Exact-match cache of deterministic LLM responses.
+
+Summaries and repeated evaluation runs send the same temperature-0 requests
+again and again. This cache stores their responses under a canonical hash of
+everything that determines the output (model, messages, tools and sampling
+parameters):
+- Only temperature-0 calls without extended thinking are cached; the cache is
+  opt-in with LLM_RESPONSE_CACHE (memory, disk or redis) or per call
+- Backends are pluggable: an in-process LRU, JSON files in a directory
+  (LLM_RESPONSE_CACHE_DIR) or Redis; entries expire after LLM_RESPONSE_CACHE_TTL
+  seconds
+- Concurrent identical requests are coalesced (single-flight): the first one
+  calls the provider, the others wait for its response instead of calling too
+- A hit for a streaming call is replayed as a synthetic stream of chunks, so
+  callers handle cached and live responses the same way
+
+Streamed responses are assembled and stored once their stream has been read to
+the end. Hits report the usage of the call that was cached, marked with
+_hidden_params["cache_hit"] (on every chunk of a replayed stream) so that they
+are not billed again.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import litellm
+from litellm.types.utils import ChatCompletionDeltaToolCall, Delta, Function, ModelResponseStream, StreamingChoices, Usage
+
+from services import redis
+from utils.logger import logger
+
+DEFAULT_TTL = 24 * 3600           # Seconds a cached response is served
+DEFAULT_MAX_ENTRIES = 512         # Responses kept by the in-memory backend
+DEFAULT_CACHE_DIR = ".llm_cache"  # Directory of the disk backend
+CACHE_KEY_VERSION = 1             # Bump to invalidate entries after a format change
+CACHE_KEY_PREFIX = "llm_cache"
+SINGLE_FLIGHT_TIMEOUT = 600.0     # Longest a coalesced request waits for the first one
+REPLAY_CHUNK_CHARS = 200          # Content characters per chunk of a replayed stream
+
+
+def response_cache_key(
+    model_name: str,
+    messages: List[Dict[str, Any]],
+    tools: Optional[List[Dict[str, Any]]] = None,
+    **params: Any
+) -> str:
+    """Hash everything that determines the response of a call.
+
+    Args:
+        model_name: Requested model
+        messages: Messages of the call
+        tools: Tool definitions of the call
+        **params: Sampling and routing parameters (temperature, max_tokens, top_p,
+            tool_choice, response_format, ...); None values are ignored
+
+    Returns:
+        Hex SHA-256 of the canonical JSON of the request
+    """
+    request = {
+        "version": CACHE_KEY_VERSION,
+        "model": model_name,
+        "messages": messages,
+        "tools": tools or [],
+        "params": {name: value for name, value in params.items() if value is not None},
+    }
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CacheBackend(ABC):
+    """Storage of serialized responses by key."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """Get the value stored under a key, or None if missing or expired."""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        """Store a value under a key for ttl seconds."""
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU of responses, lost when the process exits.
+
+    Attributes:
+        max_entries (int): Responses kept before the least recently used is evicted
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # key -> (expires_at, value)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class DiskCacheBackend(CacheBackend):
+    """One JSON file per response in a directory, shared by processes on the host.
+
+    Attributes:
+        directory (str): Directory holding the cache files
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Unreadable LLM cache file {path}: {str(e)}")
+            return None
+        if time.time() >= entry.get("expires_at", 0):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry.get("value")
+
+    def _write(self, key: str, value: str, ttl: float) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        # Write to a temporary file first so readers never see a partial entry
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": time.time() + ttl, "value": value}, f)
+        os.replace(temporary_path, path)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await asyncio.to_thread(self._write, key, value, ttl)
+
+
+class RedisCacheBackend(CacheBackend):
+    """Responses stored in Redis, shared by all instances."""
+
+    async def get(self, key: str) -> Optional[str]:
+        return await redis.get(f"{CACHE_KEY_PREFIX}:{key}")
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await redis.set(f"{CACHE_KEY_PREFIX}:{key}", value, ex=max(1, int(ttl)))
+
+
+def create_cache_backend(name: Optional[str] = None) -> CacheBackend:
+    """Create a backend by name (memory, disk or redis); memory for unknown names."""
+    name = (name or "memory").lower()
+    if name == "disk":
+        return DiskCacheBackend(os.getenv('LLM_RESPONSE_CACHE_DIR') or DEFAULT_CACHE_DIR)
+    if name == "redis":
+        return RedisCacheBackend()
+    if name != "memory":
+        logger.warning(f"Unknown LLM response cache backend '{name}', using memory")
+    return MemoryCacheBackend()
+
+
+def _serialize(response: Any) -> str:
+    return json.dumps(response.model_dump(warnings=False), default=str)
+
+
+def _deserialize(value: str) -> litellm.ModelResponse:
+    response = litellm.ModelResponse(**json.loads(value))
+    response._hidden_params["cache_hit"] = True
+    return response
+
+
+async def replay_stream(response: litellm.ModelResponse) -> AsyncGenerator[ModelResponseStream, None]:
+    """Replay a complete response as the chunks a provider would have streamed.
+
+    Content is split into chunks of REPLAY_CHUNK_CHARS, each tool call arrives
+    whole in one delta, and the last chunk carries the finish reason and usage.
+    Every chunk is marked as a cache hit.
+    """
+    choice = response.choices[0]
+    message = choice.message
+
+    def chunk(delta: Delta, finish_reason: Optional[str] = None, usage: Any = None) -> ModelResponseStream:
+        extra = {"usage": usage} if usage is not None else {}
+        replayed = ModelResponseStream(
+            id=response.id, created=response.created, model=response.model,
+            choices=[StreamingChoices(index=0, delta=delta, finish_reason=finish_reason)],
+            **extra
+        )
+        replayed._hidden_params["cache_hit"] = True
+        return replayed
+
+    content = message.content or ""
+    for start in range(0, len(content), REPLAY_CHUNK_CHARS):
+        role = "assistant" if start == 0 else None
+        yield chunk(Delta(role=role, content=content[start:start + REPLAY_CHUNK_CHARS]))
+    for index, tool_call in enumerate(message.tool_calls or []):
+        yield chunk(Delta(tool_calls=[ChatCompletionDeltaToolCall(
+            index=index, id=tool_call.id, type="function",
+            function=Function(name=tool_call.function.name, arguments=tool_call.function.arguments)
+        )]))
+    usage = getattr(response, "usage", None)
+    yield chunk(Delta(), finish_reason=choice.finish_reason or "stop", usage=Usage(**usage.model_dump()) if usage else None)
+
+
+class ResponseCache:
+    """Cache of deterministic LLM responses with single-flight calls.
+
+    Attributes:
+        backend (CacheBackend): Where responses are stored
+        ttl (float): Seconds a response is served
+        enabled (bool): Whether calls are cached unless they opt out
+        stats (Dict[str, int]): Hits, misses, coalesced calls, stores and backend errors
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None, ttl: float = DEFAULT_TTL, enabled: bool = True):
+        """Initialize the cache.
+
+        Args:
+            backend: Storage of responses; an in-memory LRU if omitted
+            ttl: Seconds a response is served
+            enabled: Whether calls are cached unless they opt out
+        """
+        self.backend = backend or MemoryCacheBackend()
+        self.ttl = ttl
+        self.enabled = enabled
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "errors": 0}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """Build the cache from LLM_RESPONSE_CACHE (memory, disk or redis; unset disables it),
+        LLM_RESPONSE_CACHE_TTL and LLM_RESPONSE_CACHE_DIR."""
+        backend_name = os.getenv('LLM_RESPONSE_CACHE', '').strip()
+        ttl = os.getenv('LLM_RESPONSE_CACHE_TTL')
+        try:
+            ttl_seconds = float(ttl) if ttl else DEFAULT_TTL
+        except ValueError:
+            logger.warning(f"Invalid value '{ttl}' for LLM_RESPONSE_CACHE_TTL, using {DEFAULT_TTL}")
+            ttl_seconds = DEFAULT_TTL
+        enabled = backend_name.lower() not in ("", "false", "off")
+        return cls(create_cache_backend(backend_name if enabled else None), ttl=ttl_seconds, enabled=enabled)
+
+    def should_cache(self, use_cache: Optional[bool], temperature: float, enable_thinking: Optional[bool]) -> bool:
+        """Whether a call is cached: it must be deterministic and opted in (use_cache=None follows the cache setting)."""
+        if temperature != 0 or enable_thinking:
+            return False
+        return self.enabled if use_cache is None else use_cache
+
+    async def _lookup(self, key: str) -> Optional[str]:
+        try:
+            return await self.backend.get(key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"LLM response cache lookup failed, calling the provider: {str(e)}")
+            return None
+
+    async def _store(self, key: str, value: str) -> None:
+        try:
+            await self.backend.set(key, value, self.ttl)
+            self.stats["stores"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Failed to store LLM response in cache: {str(e)}")
+
+    def _finish(self, key: str, flight: asyncio.Future, value: Optional[str]) -> None:
+        """Hand the result of a leading call to the calls waiting on it."""
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+        if not flight.done():
+            flight.set_result(value)
+
+    @staticmethod
+    def _hit(value: str, stream: bool) -> Any:
+        response = _deserialize(value)
+        return replay_stream(response) if stream else response
+
+    async def get_or_call(self, key: str, call: Callable[[], Awaitable[Any]], stream: bool = False) -> Any:
+        """Serve a call from the cache, from an identical call in flight, or from the provider.
+
+        Args:
+            key: Key of the request (see response_cache_key)
+            call: Coroutine function calling the provider
+            stream: Whether the caller expects a stream
+
+        Returns:
+            The response, or a stream of chunks for streaming calls
+        """
+        value = await self._lookup(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            logger.debug(f"LLM response cache hit {key[:12]}")
+            return self._hit(value, stream)
+
+        while (flight := self._in_flight.get(key)) is not None:
+            self.stats["coalesced"] += 1
+            logger.debug(f"Waiting for identical LLM call {key[:12]} in flight")
+            try:
+                value = await asyncio.wait_for(asyncio.shield(flight), timeout=SINGLE_FLIGHT_TIMEOUT)
+            except asyncio.TimeoutError:
+                # The leading call is stuck; do not wait for it any longer
+                return await call()
+            if value is not None:
+                return self._hit(value, stream)
+            # The leading call failed or its stream was not read to the end: the
+            # first waiter to get here leads the next attempt, the others wait for it
+
+        self.stats["misses"] += 1
+        flight = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = flight
+        try:
+            response = await call()
+        except BaseException:
+            self._finish(key, flight, None)
+            raise
+        if stream:
+            return _RecordingStream(self, key, flight, response)
+
+        value = _serialize(response)
+        await self._store(key, value)
+        self._finish(key, flight, value)
+        return response
+
+
+class _RecordingStream:
+    """Pass a stream through and cache the assembled response once it completes.
+
+    The calls coalesced on the stream's request are released when it ends, is
+    closed, or is dropped without being read, so they never wait for a stream
+    nobody consumes.
+    """
+
+    def __init__(self, cache: ResponseCache, key: str, flight: asyncio.Future, stream: Any):
+        self._cache = cache
+        self._key = key
+        self._flight = flight
+        self._stream = stream
+        self._chunks: List[Any] = []
+
+    def __aiter__(self) -> "_RecordingStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            await self._complete()
+            raise
+        except BaseException:
+            self._release(None)
+            raise
+        self._chunks.append(chunk)
+        return chunk
+
+    async def _complete(self) -> None:
+        """Store the assembled response, if the stream finished properly."""
+        value = None
+        try:
+            response = litellm.stream_chunk_builder(self._chunks) if self._chunks else None
+            if response is not None and response.choices and response.choices[0].finish_reason:
+                value = _serialize(response)
+                await self._cache._store(self._key, value)
+        finally:
+            self._release(value)
+
+    def _release(self, value: Optional[str]) -> None:
+        if not self._flight.done():
+            self._cache._finish(self._key, self._flight, value)
+
+    async def aclose(self) -> None:
+        self._release(None)
+        aclose = getattr(self._stream, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+    def __del__(self) -> None:
+        try:
+            self._release(None)
+        except RuntimeError:
+            pass  # The event loop is already closed
+
+
+# Shared by all LLM calls of the process
+llm_response_cache = ResponseCache.from_env()
@@ -0,0 +1,313 @@
+"""
+Pooled HTTP clients for LLM provider calls.
+
+LiteLLM creates or looks up its own HTTP client for each completion, so the
+process has no control over connection reuse, keep-alive, HTTP/2 or pool
+sizes. This module owns one long-lived httpx.AsyncClient per provider and base
+URL instead:
+- Clients are created lazily on the first call to a provider and base URL
+  (LLM_HTTP_POOLING=false leaves connection handling to LiteLLM)
+- Pool limits, keep-alive expiry, timeouts and HTTP/2 are configured from the
+  environment (LLM_HTTP_* variables)
+- Each pool counts requests in flight and requests that started while every
+  connection was busy, so saturation is visible before it becomes latency
+- The clients are handed to LiteLLM in the form its provider handler expects,
+  and closed once when the application shuts down
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from utils.logger import logger
+
+# Defaults, overridden by the LLM_HTTP_* environment variables
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60.0  # Seconds an idle connection is kept open
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 600.0  # Long generations stream for minutes
+
+# Base URLs used when neither the call nor the environment sets one
+PROVIDER_BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com",
+    "openrouter": "https://openrouter.ai/api/v1",
+}
+PROVIDER_BASE_URL_ENV = {
+    "openai": ("OPENAI_API_BASE", "OPENAI_BASE_URL"),
+    "anthropic": ("ANTHROPIC_API_BASE", "ANTHROPIC_BASE_URL"),
+    "openrouter": ("OPENROUTER_API_BASE",),
+}
+
+
+def _env_number(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Invalid value '{value}' for {name}, using {default}")
+        return default
+
+
+@dataclass(frozen=True)
+class PoolLimits:
+    """Connection pool settings of the LLM HTTP clients.
+
+    Attributes:
+        max_connections (int): Connections open at once per provider and base URL
+        max_keepalive_connections (int): Idle connections kept for reuse
+        keepalive_expiry (float): Seconds an idle connection is kept open
+        connect_timeout (float): Seconds to establish a connection
+        read_timeout (float): Seconds to wait for response data
+        http2 (bool): Whether HTTP/2 is negotiated (needs the h2 package)
+    """
+    max_connections: int = DEFAULT_MAX_CONNECTIONS
+    max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+    read_timeout: float = DEFAULT_READ_TIMEOUT
+    http2: bool = False
+
+    @classmethod
+    def from_env(cls) -> "PoolLimits":
+        """Read the settings from LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_MAX_KEEPALIVE,
+        LLM_HTTP_KEEPALIVE_EXPIRY, LLM_HTTP_CONNECT_TIMEOUT, LLM_HTTP_READ_TIMEOUT and LLM_HTTP_HTTP2."""
+        http2 = os.getenv('LLM_HTTP_HTTP2', 'false').lower() == 'true'
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("LLM_HTTP_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+                http2 = False
+        return cls(
+            max_connections=int(_env_number('LLM_HTTP_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)),
+            max_keepalive_connections=int(_env_number('LLM_HTTP_MAX_KEEPALIVE', DEFAULT_MAX_KEEPALIVE_CONNECTIONS)),
+            keepalive_expiry=_env_number('LLM_HTTP_KEEPALIVE_EXPIRY', DEFAULT_KEEPALIVE_EXPIRY),
+            connect_timeout=_env_number('LLM_HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=_env_number('LLM_HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+            http2=http2,
+        )
+
+
+@dataclass
+class PoolStats:
+    """Usage counters of one pooled client.
+
+    Attributes:
+        requests (int): Requests sent
+        in_flight (int): Requests holding a connection (until their response is closed)
+        peak_in_flight (int): Highest in_flight seen
+        saturated (int): Requests started while max_connections were in flight, so they waited for a connection
+        errors (int): Requests that failed without a response
+        created_at (float): When the client was created (time.time())
+    """
+    requests: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    saturated: int = 0
+    errors: int = 0
+    created_at: float = field(default_factory=time.time)
+
+
+class _CountedStream(httpx.AsyncByteStream):
+    """Response body that marks its request finished when closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close:
+                self._on_close()
+                self._on_close = None
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """Transport wrapper keeping the PoolStats of a pooled client."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, stats: PoolStats, max_connections: int, name: str):
+        self._transport = transport
+        self._stats = stats
+        self._max_connections = max_connections
+        self._name = name
+
+    def _finished(self) -> None:
+        self._stats.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self._stats
+        stats.requests += 1
+        if stats.in_flight >= self._max_connections:
+            stats.saturated += 1
+            if stats.saturated == 1 or stats.saturated % 100 == 0:
+                logger.warning(f"LLM HTTP pool {self._name} is saturated ({stats.in_flight} requests in flight, {stats.saturated} waited so far)")
+        stats.in_flight += 1
+        stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            stats.errors += 1
+            self._finished()
+            raise
+        response.stream = _CountedStream(response.stream, self._finished)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class _Pool:
+    """One pooled client and the LiteLLM client objects wrapping it."""
+
+    def __init__(self, name: str, base_url: str, limits: PoolLimits):
+        self.name = name
+        self.base_url = base_url
+        self.loop = asyncio.get_running_loop()  # Connections cannot move between event loops
+        self.stats = PoolStats()
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=limits.max_connections,
+                max_keepalive_connections=limits.max_keepalive_connections,
+                keepalive_expiry=limits.keepalive_expiry,
+            ),
+            http2=limits.http2,
+        )
+        self.client = httpx.AsyncClient(
+            transport=_CountingTransport(transport, self.stats, limits.max_connections, name),
+            timeout=httpx.Timeout(limits.read_timeout, connect=limits.connect_timeout),
+        )
+        self._litellm_clients: Dict[Optional[str], Any] = {}  # api_key -> client object for LiteLLM
+
+    def openai_client(self, api_key: Optional[str]) -> Any:
+        """Get an AsyncOpenAI client sending through the pool."""
+        client = self._litellm_clients.get(api_key)
+        if client is None:
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(
+                api_key=api_key or os.getenv('OPENAI_API_KEY'),
+                base_url=self.base_url,
+                http_client=self.client,
+                max_retries=0,  # Retries are handled by make_llm_api_call
+            )
+            self._litellm_clients[api_key] = client
+        return client
+
+    def http_handler(self) -> Any:
+        """Get a LiteLLM AsyncHTTPHandler sending through the pool."""
+        handler = self._litellm_clients.get(None)
+        if handler is None:
+            from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+            pooled_client = self.client
+
+            class PooledHTTPHandler(AsyncHTTPHandler):
+                def create_client(self, *args, **kwargs):
+                    # Hand out the pooled client instead of building a default one that would never be closed
+                    return pooled_client
+
+            handler = PooledHTTPHandler(client_alias=self.name)
+            # Marks the client as not owned by the handler, so only the pool closes it
+            handler.client = pooled_client
+            self._litellm_clients[None] = handler
+        return handler
+
+
+def provider_of(model_name: str) -> Optional[str]:
+    """Get the provider whose HTTP client serves a model, or None if LiteLLM should manage it."""
+    name = model_name.lower()
+    if name.startswith("bedrock/"):
+        return "bedrock"
+    if name.startswith("openrouter/"):
+        return "openrouter"
+    if name.startswith("anthropic/") or ("/" not in name and "claude" in name):
+        return "anthropic"
+    if name.startswith("openai/") or ("/" not in name and name.startswith(("gpt-", "o1", "o3", "o4"))):
+        return "openai"
+    return None
+
+
+class LLMHTTPPools:
+    """Long-lived pooled HTTP clients per LLM provider and base URL.
+
+    Attributes:
+        limits (PoolLimits): Settings of newly created pools
+    """
+
+    def __init__(self, limits: Optional[PoolLimits] = None):
+        """Initialize without clients; they are created on first use.
+
+        Args:
+            limits: Pool settings; read from the environment on first use if omitted
+        """
+        self.limits = limits
+        self._pools: Dict[Tuple[str, str], _Pool] = {}
+
+    def _base_url(self, provider: str, api_base: Optional[str]) -> str:
+        if api_base:
+            return api_base.rstrip('/')
+        if provider == "bedrock":
+            return f"https://bedrock-runtime.{os.getenv('AWS_REGION_NAME', 'us-east-1')}.amazonaws.com"
+        configured = next((os.getenv(name) for name in PROVIDER_BASE_URL_ENV[provider] if os.getenv(name)), None)
+        return (configured or PROVIDER_BASE_URLS[provider]).rstrip('/')
+
+    def client_for(self, model_name: str, api_base: Optional[str] = None, api_key: Optional[str] = None) -> Optional[Any]:
+        """Get the client object to pass to litellm.acompletion as client=.
+
+        Must be called from the event loop the call runs on.
+
+        Args:
+            model_name: Model of the call, which determines the provider
+            api_base: Base URL override of the call
+            api_key: API key override of the call (OpenAI clients carry their key)
+
+        Returns:
+            An AsyncOpenAI client or AsyncHTTPHandler using the pool, or None for
+            providers LiteLLM manages itself
+        """
+        provider = provider_of(model_name)
+        if provider is None:
+            return None
+        if self.limits is None:
+            self.limits = PoolLimits.from_env()
+
+        base_url = self._base_url(provider, api_base)
+        pool = self._pools.get((provider, base_url))
+        if pool is not None and pool.loop is not asyncio.get_running_loop():
+            logger.debug(f"Event loop of LLM HTTP pool {pool.name} changed, creating a new pool")
+            pool = None
+        if pool is None:
+            pool = _Pool(f"{provider}:{base_url}", base_url, self.limits)
+            self._pools[(provider, base_url)] = pool
+            logger.info(f"Created LLM HTTP pool {pool.name} (max {self.limits.max_connections} connections, HTTP/2: {self.limits.http2})")
+        if provider == "openai":
+            # Without a key LiteLLM reports the missing credentials itself
+            return pool.openai_client(api_key) if api_key or os.getenv('OPENAI_API_KEY') else None
+        return pool.http_handler()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get the usage counters of every pool, keyed by provider and base URL."""
+        return {pool.name: asdict(pool.stats) for pool in self._pools.values()}
+
+    async def aclose(self) -> None:
+        """Close every pooled client; new calls create fresh pools."""
+        pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            logger.info(f"Closing LLM HTTP pool {pool.name}: {asdict(pool.stats)}")
+        await asyncio.gather(*(pool.client.aclose() for pool in pools), return_exceptions=True)
+
+
+# Shared by all LLM calls of the process
+llm_http_pools = LLMHTTPPools()
@@ -0,0 +1,215 @@
+"""
+Distributed token-bucket rate limiting of LLM calls.
+
+Every API instance used to send LLM calls without knowing what the others were
+sending, so provider RPM/TPM limits were only discovered through 429 errors.
+This module keeps a pair of token buckets per configured provider or model,
+one for requests and one for estimated prompt tokens:
+- Bucket state lives in Redis and is updated by one Lua script, so all
+  instances draw from the same budget atomically, with Redis' clock
+- A call that does not fit waits (queues) until the buckets have refilled
+  enough, up to a maximum wait, after which it is sent anyway and the
+  provider's own limit applies
+- When Redis is unreachable, in-process buckets with the same limits are used
+  until Redis is tried again after a cool-down
+
+Limits are configured with LLM_RATE_LIMITS, a JSON object mapping a model name
+or a provider (anthropic, bedrock, openrouter, openai) to {"rpm": ..., "tpm": ...}.
+A model entry takes precedence over its provider's; calls to models without a
+limit are not throttled.
+"""
+
+import asyncio
+import json
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import redis
+from services.llm_http import provider_of
+from utils.logger import logger
+
+DEFAULT_MAX_QUEUE_SECONDS = 20.0  # Longest a call waits for its buckets
+REDIS_TIMEOUT = 1.0               # Seconds before a Redis call falls back to local buckets
+REDIS_RETRY_AFTER = 30.0          # Seconds local buckets are used after Redis failed
+BUCKET_KEY_PREFIX = "llm_rate"
+CHARS_PER_TOKEN = 4               # Rough estimate of prompt tokens from JSON size
+
+# KEYS: request bucket, token bucket
+# ARGV: request capacity, request refill per second, token capacity, token refill per second,
+#       request cost, token cost, key TTL in seconds
+# Returns 0 when both buckets had enough and were charged, else the milliseconds to wait
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local wait = 0
+local levels = {}
+for i = 1, 2 do
+  local capacity = tonumber(ARGV[i * 2 - 1])
+  local rate = tonumber(ARGV[i * 2])
+  local cost = math.min(tonumber(ARGV[4 + i]), capacity)
+  local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'updated_at')
+  local tokens = tonumber(bucket[1]) or capacity
+  local updated_at = tonumber(bucket[2]) or now
+  tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+  if tokens < cost then
+    wait = math.max(wait, (cost - tokens) / rate)
+  end
+  levels[i] = tokens - cost
+end
+if wait > 0 then
+  return math.ceil(wait * 1000)
+end
+for i = 1, 2 do
+  redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i]), 'updated_at', tostring(now))
+  redis.call('EXPIRE', KEYS[i], tonumber(ARGV[7]))
+end
+return 0
+"""
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Provider limits a bucket pair enforces.
+
+    Attributes:
+        rpm (float): Requests per minute
+        tpm (float): Estimated prompt tokens per minute
+    """
+    rpm: float
+    tpm: float
+
+    def bucket_args(self, tokens: int) -> List[Any]:
+        """Arguments of TOKEN_BUCKET_SCRIPT for one call estimated at tokens."""
+        # Keys expire once a full bucket would have refilled, twice over
+        return [self.rpm, self.rpm / 60, self.tpm, self.tpm / 60, 1, tokens, 120]
+
+
+def estimate_tokens(messages: Any) -> int:
+    """Estimate the prompt tokens of messages from the size of their JSON."""
+    return math.ceil(len(json.dumps(messages, default=str)) / CHARS_PER_TOKEN)
+
+
+class _LocalBuckets:
+    """In-process token bucket pairs, used while Redis is unavailable."""
+
+    def __init__(self):
+        self._levels: Dict[str, Tuple[float, float, float]] = {}  # key -> (requests, tokens, updated_at)
+
+    def try_acquire(self, key: str, limit: RateLimit, tokens: int) -> float:
+        """Charge one request and tokens if both fit; return 0, or the seconds to wait."""
+        now = time.monotonic()
+        requests_left, tokens_left, updated_at = self._levels.get(key, (limit.rpm, limit.tpm, now))
+        elapsed = max(0.0, now - updated_at)
+        requests_left = min(limit.rpm, requests_left + elapsed * limit.rpm / 60)
+        tokens_left = min(limit.tpm, tokens_left + elapsed * limit.tpm / 60)
+        cost = min(tokens, limit.tpm)
+
+        wait = 0.0
+        if requests_left < 1:
+            wait = max(wait, (1 - requests_left) * 60 / limit.rpm)
+        if tokens_left < cost:
+            wait = max(wait, (cost - tokens_left) * 60 / limit.tpm)
+        if wait > 0:
+            self._levels[key] = (requests_left, tokens_left, now)
+            return wait
+        self._levels[key] = (requests_left - 1, tokens_left - cost, now)
+        return 0.0
+
+
+class LLMRateLimiter:
+    """Queues LLM calls until the shared request and token budgets allow them.
+
+    Attributes:
+        limits (Dict[str, RateLimit]): Limits per model or provider
+        max_queue_seconds (float): Longest a call waits before it is sent anyway
+        stats (Dict[str, float]): Calls admitted, queued and sent over budget, and seconds waited
+    """
+
+    def __init__(self, limits: Optional[Dict[str, RateLimit]] = None, max_queue_seconds: float = DEFAULT_MAX_QUEUE_SECONDS):
+        """Initialize the limiter.
+
+        Args:
+            limits: Limits per model or provider; read from LLM_RATE_LIMITS if omitted
+            max_queue_seconds: Longest a call waits before it is sent anyway
+        """
+        self.limits = limits if limits is not None else self._limits_from_env()
+        self.max_queue_seconds = max_queue_seconds
+        self.stats: Dict[str, float] = {"admitted": 0, "queued": 0, "over_budget": 0, "waited_seconds": 0.0}
+        self._local = _LocalBuckets()
+        self._redis_down_until = 0.0
+
+    @staticmethod
+    def _limits_from_env() -> Dict[str, RateLimit]:
+        raw = os.getenv('LLM_RATE_LIMITS')
+        if not raw:
+            return {}
+        try:
+            return {name: RateLimit(rpm=float(limit['rpm']), tpm=float(limit['tpm'])) for name, limit in json.loads(raw).items()}
+        except (json.JSONDecodeError, AttributeError, KeyError, TypeError, ValueError):
+            logger.warning("LLM_RATE_LIMITS is not a JSON object of {\"rpm\": ..., \"tpm\": ...} limits, not rate limiting")
+            return {}
+
+    def limit_for(self, model_name: str) -> Optional[Tuple[str, RateLimit]]:
+        """Get the name of the budget a model draws from and its limit, or None if unlimited."""
+        for name in (model_name, provider_of(model_name)):
+            if name and name in self.limits:
+                return name, self.limits[name]
+        return None
+
+    async def _try_acquire(self, name: str, limit: RateLimit, tokens: int) -> float:
+        """Charge the budget if the call fits; return 0, or the seconds to wait."""
+        key = f"{{{BUCKET_KEY_PREFIX}:{name}}}"  # Hash tag keeps both buckets in one cluster slot
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                wait_ms = await asyncio.wait_for(
+                    redis.eval_script(TOKEN_BUCKET_SCRIPT, [f"{key}:requests", f"{key}:tokens"], limit.bucket_args(tokens)),
+                    timeout=REDIS_TIMEOUT
+                )
+                return int(wait_ms) / 1000
+            except Exception as e:
+                logger.warning(f"Redis rate limiter unavailable, using in-process buckets for {REDIS_RETRY_AFTER:.0f}s: {str(e)}")
+                self._redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+        return self._local.try_acquire(key, limit, tokens)
+
+    async def acquire(self, model_name: str, tokens: int) -> float:
+        """Wait until a call to a model fits its request and token budget.
+
+        Args:
+            model_name: Model the call goes to
+            tokens: Estimated prompt tokens of the call
+
+        Returns:
+            Seconds the call waited
+        """
+        limit = self.limit_for(model_name)
+        if limit is None:
+            return 0.0
+        name, rate_limit = limit
+
+        started = time.monotonic()
+        queued = False
+        while True:
+            wait = await self._try_acquire(name, rate_limit, tokens)
+            waited = time.monotonic() - started
+            if wait <= 0:
+                self.stats["admitted"] += 1
+                break
+            if waited + wait > self.max_queue_seconds:
+                self.stats["over_budget"] += 1
+                logger.warning(f"LLM budget {name} still exhausted after {waited:.1f}s (next slot in {wait:.1f}s), sending anyway")
+                break
+            if not queued:
+                queued = True
+                self.stats["queued"] += 1
+                logger.debug(f"Queueing call to {model_name} for {wait:.2f}s on budget {name}")
+            await asyncio.sleep(wait)
+
+        self.stats["waited_seconds"] += waited
+        return waited
+
+
+# Shared by all LLM calls of the process
+llm_rate_limiter = LLMRateLimiter()
@@ -0,0 +1,479 @@
+"""
+Retry engine for LLM API calls.
+
+make_llm_api_call used to sleep a fixed 30 seconds after any rate limit and 5
+seconds after other errors, then retry the same model. The engine here:
+- Waits as long as the provider asks (Retry-After, retry-after-ms and the
+  Anthropic/OpenAI rate limit reset headers), and otherwise backs off with
+  decorrelated jitter so concurrent runs do not retry in lockstep
+- Moves on through an ordered chain of fallback models (e.g. Anthropic direct,
+  then Bedrock, then OpenRouter) when a model keeps failing, asks for a wait
+  longer than the policy allows, or rejects the request outright
+- Skips providers whose circuit breaker is open after repeated failures, and
+  probes them again after a cool-down
+- Optionally hedges: if the first token (or the response) has not arrived
+  within a threshold, the next model in the chain is called as well and the
+  first to answer wins
+
+Streaming responses are returned with their first chunk already received, so
+errors raised when a stream starts are retried like any other.
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import litellm
+from openai import OpenAIError
+
+from services.llm_http import provider_of
+from utils.logger import logger
+
+# Defaults of the retry policy
+DEFAULT_MAX_ATTEMPTS = 3        # Attempts per model
+DEFAULT_BASE_DELAY = 1.0        # Seconds; first backoff is between this and 3x this
+DEFAULT_MAX_DELAY = 30.0        # Longest backoff without a provider-given wait
+DEFAULT_MAX_RETRY_AFTER = 60.0  # Longer provider-given waits move on to the next model
+
+# Circuit breaker defaults
+BREAKER_FAILURE_THRESHOLD = 5   # Consecutive failures that open the circuit
+BREAKER_RESET_TIMEOUT = 30.0    # Seconds before an open circuit lets a probe through
+
+# Errors that will not succeed when the same request is sent to the same model again
+NON_RETRYABLE_ERRORS = (
+    litellm.exceptions.BadRequestError,
+    litellm.exceptions.AuthenticationError,
+    litellm.exceptions.PermissionDeniedError,
+    litellm.exceptions.NotFoundError,
+)
+RETRYABLE_ERRORS = (litellm.exceptions.RateLimitError, OpenAIError, json.JSONDecodeError)
+
+_RATE_LIMIT_RESET_HEADERS = (
+    "anthropic-ratelimit-requests-reset",
+    "anthropic-ratelimit-tokens-reset",
+    "anthropic-ratelimit-input-tokens-reset",
+    "anthropic-ratelimit-output-tokens-reset",
+    "x-ratelimit-reset-requests",
+    "x-ratelimit-reset-tokens",
+)
+_DURATION_UNITS = (("ms", 0.001), ("h", 3600.0), ("m", 60.0), ("s", 1.0))
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How LLM calls are retried.
+
+    Attributes:
+        max_attempts (int): Attempts per model before moving to the next one
+        base_delay (float): Lower bound of a backoff in seconds
+        max_delay (float): Upper bound of a backoff in seconds
+        max_retry_after (float): Provider-requested waits longer than this move on to the next model, or end the call on the last one
+        fallback_models (Tuple[str, ...]): Models tried in order after the requested one
+        hedge_after (float): Seconds without a first token before the next model is called as well; None disables hedging
+    """
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    base_delay: float = DEFAULT_BASE_DELAY
+    max_delay: float = DEFAULT_MAX_DELAY
+    max_retry_after: float = DEFAULT_MAX_RETRY_AFTER
+    fallback_models: Tuple[str, ...] = ()
+    hedge_after: Optional[float] = None
+
+    @classmethod
+    def from_env(cls, model_name: str) -> "RetryPolicy":
+        """Build the policy of a model from the environment.
+
+        LLM_FALLBACK_MODELS is a JSON object mapping a model to its ordered
+        fallback models; LLM_HEDGE_AFTER is the hedging threshold in seconds.
+        """
+        fallback_models: Tuple[str, ...] = ()
+        raw_fallbacks = os.getenv('LLM_FALLBACK_MODELS')
+        if raw_fallbacks:
+            try:
+                fallback_models = tuple(json.loads(raw_fallbacks).get(model_name, ()))
+            except (json.JSONDecodeError, AttributeError):
+                logger.warning("LLM_FALLBACK_MODELS is not a JSON object of model lists, ignoring it")
+        hedge_after = os.getenv('LLM_HEDGE_AFTER')
+        return cls(fallback_models=fallback_models, hedge_after=float(hedge_after) if hedge_after else None)
+
+    def models_for(self, model_name: str) -> List[str]:
+        """The requested model followed by its fallbacks, without duplicates."""
+        return list(dict.fromkeys([model_name, *self.fallback_models]))
+
+
+def decorrelated_jitter(previous_delay: float, base_delay: float, max_delay: float) -> float:
+    """Next backoff: random between the base delay and three times the previous one, capped."""
+    return min(max_delay, random.uniform(base_delay, max(base_delay, previous_delay * 3)))
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse an OpenAI-style duration such as '1s', '20ms' or '6m0.5s'."""
+    remaining, total = value.strip(), 0.0
+    if not remaining:
+        return None
+    while remaining:
+        for unit, factor in _DURATION_UNITS:
+            number, separator, rest = remaining.partition(unit)
+            if separator and number.replace('.', '', 1).isdigit():
+                total += float(number) * factor
+                remaining = rest
+                break
+        else:
+            return None
+    return total
+
+
+def _parse_wait(value: str, now: float) -> Optional[float]:
+    """Parse a header value that is seconds, a duration, an RFC 3339 time or an HTTP date."""
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    duration = _parse_duration(value)
+    if duration is not None:
+        return duration
+    for parse in (lambda v: datetime.fromisoformat(v.replace("Z", "+00:00")), parsedate_to_datetime):
+        try:
+            moment = parse(value)
+        except (TypeError, ValueError):
+            continue
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return max(0.0, moment.timestamp() - now)
+    return None
+
+
+def _error_headers(error: Exception) -> Dict[str, str]:
+    """Collect the response headers attached to an LLM error, with lower-case names."""
+    headers: Dict[str, str] = {}
+    response = getattr(error, 'response', None)
+    for source in (getattr(response, 'headers', None), getattr(error, 'headers', None), getattr(error, 'litellm_response_headers', None)):
+        if source:
+            headers.update({str(name).lower(): str(value) for name, value in dict(source).items()})
+    return headers
+
+
+def retry_after_seconds(error: Exception, now: Optional[float] = None) -> Optional[float]:
+    """Get how long the provider asked to wait before retrying, if it said.
+
+    Args:
+        error: Error raised by the LLM call
+        now: Current time.time(), for reset timestamps
+
+    Returns:
+        Seconds to wait, or None if the error carries no wait hint
+    """
+    headers = _error_headers(error)
+    now = time.time() if now is None else now
+    if 'retry-after-ms' in headers:
+        try:
+            return max(0.0, float(headers['retry-after-ms']) / 1000)
+        except ValueError:
+            pass
+    if 'retry-after' in headers:
+        wait = _parse_wait(headers['retry-after'], now)
+        if wait is not None:
+            return wait
+    # Without Retry-After, wait for the latest reset of an exhausted limit
+    waits = [wait for wait in (_parse_wait(headers[name], now) for name in _RATE_LIMIT_RESET_HEADERS if name in headers) if wait is not None]
+    return max(waits) if waits and isinstance(error, litellm.exceptions.RateLimitError) else None
+
+
+class CircuitBreaker:
+    """Stops calls to a provider after repeated failures, until a probe succeeds.
+
+    Closed: calls go through. Open: calls are skipped until reset_timeout has
+    passed, then one probe call is let through (half-open); its success closes
+    the circuit, its failure opens it again.
+
+    Attributes:
+        name (str): Provider the breaker protects
+        failure_threshold (int): Consecutive failures that open the circuit
+        reset_timeout (float): Seconds before an open circuit lets a probe through
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"Circuit for {self.name} closed again")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                logger.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self) -> None:
+        """End a probe that had no outcome (e.g. a cancelled call), so the next call can probe."""
+        self._probing = False
+
+
+class CircuitBreakers:
+    """Circuit breakers per provider, created on first use."""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def for_model(self, model_name: str) -> CircuitBreaker:
+        """Get the breaker of the provider serving a model."""
+        name = provider_of(model_name) or model_name.split("/", 1)[0]
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    def states(self) -> Dict[str, str]:
+        return {name: breaker.state for name, breaker in self._breakers.items()}
+
+
+# Shared by all LLM calls of the process
+circuit_breakers = CircuitBreakers()
+
+
+async def _close_response(response: Any) -> None:
+    """Close a stream that will not be read to the end, releasing its connection."""
+    aclose = getattr(response, 'aclose', None)
+    if aclose is None:
+        return
+    try:
+        await aclose()
+    except Exception as e:
+        logger.debug(f"Error closing an LLM stream: {str(e)}")
+
+
+class _PrependedStream:
+    """A stream whose first chunk was already received.
+
+    Unlike an async generator, closing it before iteration starts still
+    closes the underlying stream.
+    """
+
+    def __init__(self, first: Any, stream: Any):
+        self._first: List[Any] = [first]
+        self._stream = stream
+
+    def __aiter__(self) -> "_PrependedStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._first:
+            return self._first.pop()
+        return await self._stream.__anext__()
+
+    async def aclose(self) -> None:
+        self._first.clear()
+        await _close_response(self._stream)
+
+
+async def _empty_stream() -> AsyncGenerator:
+    return
+    yield
+
+
+async def _first_response(call: Callable[[str], Awaitable[Any]], model_name: str, stream: bool) -> Any:
+    """Call a model and, for streams, wait for the first chunk."""
+    response = await call(model_name)
+    if not stream:
+        return response
+    iterator = response.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        return _empty_stream()
+    except BaseException:
+        await _close_response(iterator)
+        raise
+    return _PrependedStream(first, iterator)
+
+
+def _record_outcome(breaker: CircuitBreaker, error: BaseException) -> None:
+    """Record a failed call on a provider's breaker; errors that are not LLM API errors say nothing about it."""
+    if isinstance(error, NON_RETRYABLE_ERRORS):
+        breaker.record_success()
+    elif isinstance(error, RETRYABLE_ERRORS):
+        breaker.record_failure()
+
+
+async def _hedged_response(
+    call: Callable[[str], Awaitable[Any]],
+    model_name: str,
+    hedge_model: str,
+    hedge_after: float,
+    stream: bool,
+    breakers: CircuitBreakers
+) -> Tuple[str, Any]:
+    """Call a model, and a second one if the first has not answered within hedge_after.
+
+    Failures of the hedge model are recorded on its breaker here, as are those
+    of the requested model when the hedge answers; the caller records the rest.
+
+    Returns:
+        The model that answered first and its response; the other call is
+        cancelled, and its stream closed if it had already started
+
+    Raises:
+        Exception: The requested model's error, if neither model answered
+    """
+    tasks = {asyncio.create_task(_first_response(call, model_name, stream)): model_name}
+    primary_error: Optional[BaseException] = None
+    try:
+        done, _ = await asyncio.wait(tasks.keys(), timeout=hedge_after)
+        if not done:
+            logger.info(f"No answer from {model_name} after {hedge_after}s, hedging with {hedge_model}")
+            tasks[asyncio.create_task(_first_response(call, hedge_model, stream))] = hedge_model
+
+        while tasks:
+            done, _ = await asyncio.wait(tasks.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                answered_by = tasks.pop(task)
+                error = task.exception()
+                if error is None:
+                    if answered_by != model_name:
+                        logger.info(f"Hedged call answered first by {answered_by}")
+                        if primary_error is not None:
+                            _record_outcome(breakers.for_model(model_name), primary_error)
+                    return answered_by, task.result()
+                if answered_by == model_name:
+                    primary_error = error
+                else:
+                    _record_outcome(breakers.for_model(answered_by), error)
+        raise primary_error
+    finally:
+        for task in tasks:
+            task.cancel()
+        # A loser that already got its response holds a pooled connection until closed
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if not isinstance(result, BaseException):
+                await _close_response(result)
+
+
+async def call_with_retries(
+    call: Callable[[str], Awaitable[Any]],
+    model_name: str,
+    policy: RetryPolicy,
+    stream: bool = False,
+    breakers: Optional[CircuitBreakers] = None
+) -> Any:
+    """Call an LLM with retries, fallback models, circuit breakers and hedging.
+
+    Args:
+        call: Coroutine function making one API call to the given model
+        model_name: Requested model
+        policy: How the call is retried
+        stream: Whether the call returns a stream; its first chunk is awaited
+        breakers: Circuit breakers per provider; the process-wide ones if omitted
+
+    Returns:
+        The response; streams are async iterators starting with their first chunk
+
+    Raises:
+        RetriesExhausted: If every model of the chain failed or was skipped
+        Exception: Errors that are not LLM API errors, unchanged
+    """
+    breakers = breakers or circuit_breakers
+    models = policy.models_for(model_name)
+    errors: List[Tuple[str, Exception]] = []
+
+    for index, model in enumerate(models):
+        breaker = breakers.for_model(model)
+        probe = breaker.state == "half_open"
+        if not breaker.allow():
+            logger.warning(f"Skipping {model}: circuit for {breaker.name} is open")
+            continue
+        try:
+            delay = policy.base_delay
+            for attempt in range(policy.max_attempts):
+                hedge_model = None
+                if policy.hedge_after is not None:
+                    hedge_model = next((m for m in models[index + 1:] if breakers.for_model(m).state == "closed"), None)
+                try:
+                    logger.debug(f"Attempt {attempt + 1}/{policy.max_attempts} with {model}")
+                    if hedge_model:
+                        answered_by, response = await _hedged_response(call, model, hedge_model, policy.hedge_after, stream, breakers)
+                    else:
+                        answered_by, response = model, await _first_response(call, model, stream)
+                    breakers.for_model(answered_by).record_success()
+                    if answered_by != model_name:
+                        logger.info(f"LLM call for {model_name} answered by fallback {answered_by}")
+                    return response
+                except RETRYABLE_ERRORS as e:
+                    errors.append((model, e))
+                    logger.warning(f"Error from {model} on attempt {attempt + 1}/{policy.max_attempts}: {str(e)}")
+                    if isinstance(e, NON_RETRYABLE_ERRORS):
+                        # The provider is up; this request will not succeed on this model
+                        breaker.record_success()
+                        break
+                    breaker.record_failure()
+                    if attempt + 1 == policy.max_attempts or not breaker.allow():
+                        break
+
+                    wait = retry_after_seconds(e)
+                    if wait is None:
+                        delay = decorrelated_jitter(delay, policy.base_delay, policy.max_delay)
+                        wait = delay
+                    elif wait > policy.max_retry_after:
+                        next_step = "moving on to the next model" if index + 1 < len(models) else "giving up"
+                        logger.info(f"{model} asks to wait {wait:.1f}s, {next_step}")
+                        break
+                    logger.debug(f"Waiting {wait:.2f} seconds before retry...")
+                    await asyncio.sleep(wait)
+        finally:
+            if probe:
+                # A probe that ended without an outcome (cancelled, or an unexpected error) must not block the provider
+                breaker.release_probe()
+
+    raise RetriesExhausted(models, errors)
+
+
+class RetriesExhausted(Exception):
+    """Raised when every model of a call's chain failed or was skipped.
+
+    Attributes:
+        models (List[str]): The chain of models
+        errors (List[Tuple[str, Exception]]): (model, error) of every failed attempt
+    """
+
+    def __init__(self, models: List[str], errors: List[Tuple[str, Exception]]):
+        self.models = models
+        self.errors = errors
+        message = f"Failed to make API call with {', '.join(models)} after {len(errors)} attempts"
+        if errors:
+            message += f". Last error: {str(errors[-1][1])}"
+        elif models:
+            message += ". Every provider's circuit is open"
+        super().__init__(message)
@@ -0,0 +1,296 @@
+"""
+Record/replay transport for LLM calls.
+
+The agent loop (ThreadManager.run_thread, ResponseProcessor) could only be
+benchmarked against live providers. With LLM_TRANSPORT_MODE this module sits
+in front of litellm.acompletion:
+- live (default): calls go to the provider unchanged
+- record: calls go to the provider, and each response is written to a compact
+  gzipped JSON-lines file in LLM_TRANSPORT_DIR: the content, reasoning and
+  tool call deltas, finish reason and usage of every streamed chunk, each with
+  its offset from the start of the request
+- replay: no provider is called; the recording of the request is played back
+  through make_llm_api_call, with the recorded timing divided by
+  LLM_REPLAY_SPEED (1 keeps the recorded timing, 0 replays without waiting)
+
+Recordings are matched by the request key of services.llm_cache (model,
+messages, tools and sampling params). Prompts that change between runs (dates,
+sandbox output) never match exactly; LLM_REPLAY_MATCH=sequence replays the
+recordings in the order they were recorded instead.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+import litellm
+from litellm.types.utils import ChatCompletionDeltaToolCall, Delta, Function, ModelResponseStream, StreamingChoices, Usage
+
+from services.llm_cache import replay_stream
+from utils.logger import logger
+
+DEFAULT_TRANSPORT_DIR = "llm_recordings"
+RECORDING_FORMAT_VERSION = 1
+RECORDING_SUFFIX = ".jsonl.gz"
+TRANSPORT_MODES = ("live", "record", "replay")
+
+
+class ReplayMissError(Exception):
+    """Raised in replay mode when a request has no recording."""
+    pass
+
+
+def _compact_chunk(chunk: Any) -> Dict[str, Any]:
+    """Keep the parts of a streamed chunk the agent loop reads, without empty fields."""
+    compact: Dict[str, Any] = {}
+    choices = getattr(chunk, "choices", None)
+    if choices:
+        choice = choices[0]
+        delta = getattr(choice, "delta", None)
+        if getattr(delta, "content", None):
+            compact["c"] = delta.content
+        if getattr(delta, "reasoning_content", None):
+            compact["r"] = delta.reasoning_content
+        if getattr(delta, "tool_calls", None):
+            compact["t"] = [
+                [tool_call.index, tool_call.id, tool_call.function.name if tool_call.function else None,
+                 tool_call.function.arguments if tool_call.function else None]
+                for tool_call in delta.tool_calls
+            ]
+        if getattr(choice, "finish_reason", None):
+            compact["f"] = choice.finish_reason
+    usage = getattr(chunk, "usage", None)
+    if usage:
+        compact["u"] = usage.model_dump() if hasattr(usage, "model_dump") else dict(usage)
+    return compact
+
+
+def _expand_chunk(compact: Dict[str, Any], model: str) -> ModelResponseStream:
+    """Rebuild a streamed chunk from its compact form."""
+    delta = Delta(
+        content=compact.get("c"),
+        reasoning_content=compact.get("r"),
+        tool_calls=[
+            ChatCompletionDeltaToolCall(
+                index=index, id=call_id, type="function" if call_id else None,
+                function=Function(name=name, arguments=arguments or "")
+            )
+            for index, call_id, name, arguments in compact["t"]
+        ] if compact.get("t") else None,
+    )
+    extra = {"usage": Usage(**compact["u"])} if compact.get("u") else {}
+    choices = [StreamingChoices(index=0, delta=delta, finish_reason=compact.get("f"))]
+    return ModelResponseStream(model=model, choices=choices, **extra)
+
+
+class Recording:
+    """One recorded LLM call.
+
+    Attributes:
+        key (str): Request key the call was made with
+        model (str): Model that answered
+        stream (bool): Whether the response was streamed
+        events (List[Tuple[float, Dict[str, Any]]]): (milliseconds since the request started,
+            compact chunk) per streamed chunk, or a single (latency, {"response": ...}) entry
+    """
+
+    def __init__(self, key: str, model: str, stream: bool, events: Optional[List[Tuple[float, Dict[str, Any]]]] = None):
+        self.key = key
+        self.model = model
+        self.stream = stream
+        self.events = events or []
+
+    def dump(self, path: str) -> None:
+        """Write the recording as gzipped JSON lines: a header, then one line per event."""
+        header = {
+            "v": RECORDING_FORMAT_VERSION, "key": self.key, "model": self.model, "stream": self.stream,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+        }
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, separators=(",", ":")) + "\n")
+            for offset_ms, event in self.events:
+                f.write(json.dumps([round(offset_ms, 1), event], separators=(",", ":"), default=str) + "\n")
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            events = [tuple(json.loads(line)) for line in f if line.strip()]
+        return cls(header["key"], header["model"], header["stream"], events)
+
+    def response(self) -> litellm.ModelResponse:
+        """The complete response, assembled from the chunks of a streamed recording."""
+        if not self.stream:
+            return litellm.ModelResponse(**self.events[0][1]["response"])
+        return litellm.stream_chunk_builder([_expand_chunk(event, self.model) for _, event in self.events])
+
+
+class LLMTransport:
+    """Records LLM responses to files, or replays them instead of calling providers.
+
+    Attributes:
+        mode (str): live, record or replay
+        directory (str): Directory of the recordings
+        speed (float): Replay speed-up of the recorded timing; 0 replays without waiting
+        match (str): exact (by request key) or sequence (in recorded order)
+        stats (Dict[str, int]): Calls recorded and replayed, and replay misses
+    """
+
+    def __init__(self, mode: str = "live", directory: str = DEFAULT_TRANSPORT_DIR, speed: float = 1.0, match: str = "exact"):
+        """Initialize the transport.
+
+        Args:
+            mode: live, record or replay
+            directory: Directory of the recordings
+            speed: Replay speed-up of the recorded timing; 0 replays without waiting
+            match: exact (by request key) or sequence (in recorded order)
+        """
+        self.mode = mode
+        self.directory = directory
+        self.speed = speed
+        self.match = match
+        self.stats: Dict[str, int] = {"recorded": 0, "replayed": 0, "misses": 0}
+        self._sequence = 0           # Number of the next recording written
+        self._index: Optional[Dict[str, List[str]]] = None  # key -> unplayed recording paths, in order
+        self._ordered: List[str] = []  # Unplayed recording paths, in order
+
+    @classmethod
+    def from_env(cls) -> "LLMTransport":
+        """Build the transport from LLM_TRANSPORT_MODE, LLM_TRANSPORT_DIR, LLM_REPLAY_SPEED and LLM_REPLAY_MATCH."""
+        mode = os.getenv('LLM_TRANSPORT_MODE', 'live').lower()
+        if mode not in TRANSPORT_MODES:
+            logger.warning(f"Unknown LLM_TRANSPORT_MODE '{mode}', calling providers live")
+            mode = "live"
+        speed = os.getenv('LLM_REPLAY_SPEED')
+        try:
+            replay_speed = float(speed) if speed else 1.0
+        except ValueError:
+            logger.warning(f"Invalid value '{speed}' for LLM_REPLAY_SPEED, replaying at recorded speed")
+            replay_speed = 1.0
+        match = os.getenv('LLM_REPLAY_MATCH', 'exact').lower()
+        return cls(mode, os.getenv('LLM_TRANSPORT_DIR') or DEFAULT_TRANSPORT_DIR, replay_speed, match)
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    # --- Recording ---
+
+    def _next_path(self, key: str) -> str:
+        if self._sequence == 0 and os.path.isdir(self.directory):
+            # Continue the numbering of recordings already in the directory
+            self._sequence = sum(1 for name in os.listdir(self.directory) if name.endswith(RECORDING_SUFFIX))
+        path = os.path.join(self.directory, f"{self._sequence:06d}-{key[:16]}{RECORDING_SUFFIX}")
+        self._sequence += 1
+        return path
+
+    async def _save(self, recording: Recording) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._next_path(recording.key)
+        try:
+            await asyncio.to_thread(recording.dump, path)
+            self.stats["recorded"] += 1
+            logger.debug(f"Recorded LLM call {recording.key[:12]} from {recording.model} to {path}")
+        except OSError as e:
+            logger.warning(f"Failed to write LLM recording {path}: {str(e)}")
+
+    async def record(self, key: str, model: str, response: Any, stream: bool, started: float) -> Any:
+        """Record a provider response and hand it on unchanged.
+
+        Args:
+            key: Request key of the call
+            model: Model that answered
+            response: Response or stream returned by the provider
+            stream: Whether the response is a stream
+            started: time.monotonic() when the request was sent
+
+        Returns:
+            The response, or a stream passing the provider's chunks through
+        """
+        if not stream:
+            latency_ms = (time.monotonic() - started) * 1000
+            await self._save(Recording(key, model, False, [(latency_ms, {"response": response.model_dump(warnings=False)})]))
+            return response
+        return self._recording_stream(Recording(key, model, True), response, started)
+
+    async def _recording_stream(self, recording: Recording, stream: Any, started: float) -> AsyncGenerator:
+        async for chunk in stream:
+            recording.events.append(((time.monotonic() - started) * 1000, _compact_chunk(chunk)))
+            yield chunk
+        # Only complete streams are written; an abandoned one would replay as a truncated answer
+        await self._save(recording)
+
+    # --- Replay ---
+
+    def _load_index(self) -> None:
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(RECORDING_SUFFIX)) if os.path.isdir(self.directory) else []
+        self._ordered = [os.path.join(self.directory, name) for name in names]
+        self._index = {}
+        for path in self._ordered:
+            key_prefix = os.path.basename(path)[:-len(RECORDING_SUFFIX)].split("-", 1)[1]
+            self._index.setdefault(key_prefix, []).append(path)
+        logger.info(f"Loaded {len(self._ordered)} LLM recordings from {self.directory} (match: {self.match})")
+
+    def _take(self, key: str) -> Optional[str]:
+        """Pick the next unplayed recording for a request; the last one is replayed again when all were played."""
+        if self._index is None:
+            self._load_index()
+        if self.match == "sequence":
+            return self._ordered.pop(0) if self._ordered else None
+        paths = self._index.get(key[:16])
+        if not paths:
+            return None
+        return paths.pop(0) if len(paths) > 1 else paths[0]
+
+    async def _wait_until(self, offset_ms: float, replay_started: float) -> None:
+        if self.speed <= 0:
+            return
+        remaining = offset_ms / 1000 / self.speed - (time.monotonic() - replay_started)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    async def _replay_chunks(self, recording: Recording) -> AsyncGenerator[ModelResponseStream, None]:
+        replay_started = time.monotonic()
+        for offset_ms, event in recording.events:
+            await self._wait_until(offset_ms, replay_started)
+            yield _expand_chunk(event, recording.model)
+
+    async def replay(self, key: str, stream: bool) -> Any:
+        """Play back the recording of a request.
+
+        Args:
+            key: Request key of the call
+            stream: Whether the caller expects a stream
+
+        Returns:
+            The recorded response, or a stream of its chunks at the replay speed
+
+        Raises:
+            ReplayMissError: If no recording matches the request
+        """
+        path = self._take(key)
+        if path is None:
+            self.stats["misses"] += 1
+            raise ReplayMissError(f"No LLM recording for request {key[:16]} in {self.directory}")
+        recording = await asyncio.to_thread(Recording.load, path)
+        self.stats["replayed"] += 1
+        logger.debug(f"Replaying LLM call {key[:12]} from {path}")
+
+        if stream and recording.stream:
+            return self._replay_chunks(recording)
+        # A response recorded in the other mode is converted after the recorded latency
+        await self._wait_until(recording.events[-1][0] if recording.events else 0, time.monotonic())
+        response = recording.response()
+        return replay_stream(response) if stream else response
+
+
+# Shared by all LLM calls of the process
+llm_transport = LLMTransport.from_env()
@@ -167,6 +167,21 @@ async def keys(pattern):
     redis_client = await get_client()
     return await with_retry(redis_client.keys, pattern)
 
+_scripts = {}  # Lua source -> script registered on the current client
+
+async def eval_script(script, keys, args):
+    """Run a Lua script atomically with automatic retry.
+    
+    The script is loaded once per client and then called by its SHA (EVALSHA),
+    reloading it if the server lost it.
+    """
+    redis_client = await get_client()
+    registered = _scripts.get(script)
+    if registered is None or registered.registered_client is not redis_client:
+        registered = redis_client.register_script(script)
+        _scripts[script] = registered
+    return await with_retry(registered, keys=keys, args=args)
+
 async def create_pubsub():
     """Create a Redis pubsub object."""
     redis_client = await get_client()
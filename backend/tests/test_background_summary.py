@@ -0,0 +1,69 @@
+"""
+Tests for proactive background summarization.
+
+Checks that a background summary is installed just after the messages it
+covers, so messages added while it ran stay in context, and that only one
+summary runs per thread.
+"""
+
+import asyncio
+import json
+
+from agentpress.context_manager import ContextManager
+from agentpress.message_cache import ThreadMessageCache, parse_timestamp
+
+
+def _row(message_id, second, text, type="user"):
+    return {
+        "message_id": message_id,
+        "type": type,
+        "content": json.dumps({"role": "user", "content": text}),
+        "created_at": f"2025-04-20T10:00:{second:02d}.000000+00:00",
+    }
+
+
+def test_summary_replaces_only_the_summarized_messages(monkeypatch):
+    cache = ThreadMessageCache()
+    cache.load("t", [_row("a", 1, "first"), _row("b", 2, "second"), _row("c", 3, "third")])
+    messages = cache.get("t")
+    summarized_until = cache.high_water_mark("t")
+
+    manager = ContextManager(token_threshold=1000)
+    release = asyncio.Event()
+
+    async def create_summary(thread_id, messages, model):
+        await release.wait()
+        return {"role": "user", "content": f"summary of {len(messages)}"}
+
+    async def add_message(thread_id, type, content, is_llm_message, metadata, created_at):
+        cache.add_rows(thread_id, [{
+            "message_id": "s", "type": type, "content": json.dumps(content), "created_at": created_at
+        }])
+
+    monkeypatch.setattr(manager, "create_summary", create_summary)
+
+    async def run():
+        assert manager.start_background_summary("t", messages, summarized_until, add_message, token_count=800)
+        assert not manager.start_background_summary("t", messages, summarized_until, add_message)
+        # The agent keeps going while the summary is created
+        cache.add_rows("t", [_row("d", 4, "during")])
+        release.set()
+        installed = await manager.wait_for_background_summary("t")
+        await asyncio.sleep(0)
+        return installed
+
+    assert asyncio.run(run()) is True
+    assert [message["content"] for message in cache.get("t")] == ["summary of 3", "during"]
+    assert "t" not in manager._background_summaries
+    assert manager.proactive_threshold == 700
+
+
+def test_no_summary_for_short_threads_or_idle_threads():
+    manager = ContextManager(token_threshold=1000)
+    until = parse_timestamp("2025-04-20T10:00:00+00:00")
+
+    async def run():
+        started = manager.start_background_summary("t", [{"role": "user", "content": "hi"}], until, None)
+        return started, await manager.wait_for_background_summary("t")
+
+    assert asyncio.run(run()) == (False, None)
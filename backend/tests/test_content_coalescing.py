@@ -0,0 +1,136 @@
+"""
+Tests for coalescing of streamed content frames.
+
+Checks that adjacent content deltas are merged per size or time window, that
+pending content is flushed before tool and status frames, on error and on
+finish, and that streaming is unchanged when both windows are off.
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+from agentpress.response_processor import ProcessorConfig, ResponseProcessor
+from agentpress.tool import Tool, xml_schema
+from agentpress.tool_registry import ToolRegistry
+
+
+class _NoopTool(Tool):
+    @xml_schema(tag_name="noop", mappings=[])
+    async def noop(self):
+        return self.success_response("done")
+
+
+def _chunk(content=None, finish_reason=None, tool_calls=None):
+    delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=finish_reason)])
+
+
+def _run(chunks, error=None, **config):
+    """Stream the chunks (a float means sleep that many seconds) and return the frames as (kind, value)."""
+    ToolRegistry._instance = None
+    registry = ToolRegistry()
+    registry.register_tool(_NoopTool)
+
+    async def add_message(thread_id, type, content, is_llm_message=False, metadata=None):
+        return {"message_id": "m", "type": type, "content": content}
+
+    processor = ResponseProcessor(registry, add_message)
+
+    async def llm_stream():
+        for chunk in chunks:
+            if isinstance(chunk, float):
+                await asyncio.sleep(chunk)
+            else:
+                yield chunk
+        if error:
+            raise error
+
+    async def run():
+        frames = []
+        processor_config = ProcessorConfig(xml_tool_calling=True, **config)
+        async for frame in processor.process_streaming_response(llm_stream(), "thread", [], "gpt-4o", processor_config):
+            if frame["type"] == "assistant" and frame["message_id"] is None:
+                frames.append(("content", json.loads(frame["content"])["content"]))
+            elif frame["type"] == "status":
+                content = frame["content"]
+                content = json.loads(content) if isinstance(content, str) else content
+                frames.append(("status", content.get("status_type")))
+        return frames
+
+    return asyncio.run(run())
+
+
+def _content(frames):
+    return [value for kind, value in frames if kind == "content"]
+
+
+def test_both_windows_off_yields_every_delta():
+    frames = _run([_chunk("a"), _chunk("b"), _chunk("c"), _chunk(finish_reason="stop")])
+    assert _content(frames) == ["a", "b", "c"]
+
+
+def test_size_window_merges_until_enough_bytes():
+    chunks = [_chunk(text) for text in ["ab", "cd", "ef", "g"]] + [_chunk(finish_reason="stop")]
+    frames = _run(chunks, content_coalesce_bytes=4)
+    assert _content(frames) == ["abcd", "efg"]
+
+
+def test_time_window_ends_during_a_provider_pause():
+    chunks = [_chunk("a"), _chunk("b"), 0.1, _chunk("c"), _chunk("d"), _chunk(finish_reason="stop")]
+    frames = _run(chunks, content_coalesce_ms=50)
+    # The window closes while the stream is paused, so "c" starts a new frame
+    assert _content(frames) == ["ab", "cd"]
+
+
+def test_buffered_content_arrives_before_the_stream_resumes():
+    ToolRegistry._instance = None
+
+    async def add_message(thread_id, type, content, is_llm_message=False, metadata=None):
+        return {"message_id": "m", "type": type, "content": content}
+
+    processor = ResponseProcessor(ToolRegistry(), add_message)
+
+    async def run():
+        delivered = asyncio.Event()
+
+        async def llm_stream():
+            yield _chunk("a")
+            await delivered.wait()  # Resumes only once "a" has reached the client
+            yield _chunk(finish_reason="stop")
+
+        config = ProcessorConfig(xml_tool_calling=True, content_coalesce_ms=20)
+        frames = processor.process_streaming_response(llm_stream(), "thread", [], "gpt-4o", config)
+        async for frame in frames:
+            if frame["type"] == "assistant" and frame["message_id"] is None:
+                delivered.set()
+                return json.loads(frame["content"])["content"]
+
+    assert asyncio.run(asyncio.wait_for(run(), timeout=2)) == "a"
+
+
+def test_content_is_flushed_before_tool_started():
+    chunks = [_chunk("before "), _chunk("<noop></noop>"), _chunk(" after"), _chunk(finish_reason="stop")]
+    frames = _run(chunks, content_coalesce_bytes=1024, execute_on_stream=True)
+    started = frames.index(("status", "tool_started"))
+    assert frames[started - 1] == ("content", "before <noop></noop>")
+    assert ("content", " after") in frames[started:]
+
+
+def test_content_is_flushed_before_tool_call_chunk_status():
+    tool_call = SimpleNamespace(id="call_1", index=0, type="function", function=SimpleNamespace(name="noop", arguments=""))
+    chunks = [_chunk("thinking"), _chunk(tool_calls=[tool_call]), _chunk(finish_reason="stop")]
+    frames = _run(chunks, content_coalesce_bytes=1024, native_tool_calling=True, execute_tools=False)
+    chunk_status = frames.index(("status", "tool_call_chunk"))
+    assert frames[chunk_status - 1] == ("content", "thinking")
+
+
+def test_content_is_flushed_on_finish():
+    frames = _run([_chunk("a"), _chunk("b"), _chunk(finish_reason="stop")], content_coalesce_bytes=1024)
+    assert _content(frames) == ["ab"]
+    assert frames.index(("content", "ab")) < frames.index(("status", "finish"))
+
+
+def test_content_is_flushed_on_error():
+    frames = _run([_chunk("a"), _chunk("b")], error=RuntimeError("boom"), content_coalesce_bytes=1024)
+    assert frames.index(("content", "ab")) < frames.index(("status", "error"))
@@ -0,0 +1,59 @@
+"""
+Tests for the LLM-free context packer.
+
+Checks that messages within budget are untouched, that superseded browser
+results, long tool results and old tool results are shrunk in that order, and
+that the most recent turns are kept verbatim.
+"""
+
+import asyncio
+
+from agentpress.context_packer import PackingPolicy, pack_messages
+from agentpress.token_counting import count_message_tokens
+
+
+def _result(tag, text):
+    return {"role": "user", "content": f"<tool_result> <{tag}> ToolResult(success=True, output='{text}') </{tag}> </tool_result>"}
+
+
+def _thread():
+    return [
+        {"role": "user", "content": "Build the report"},
+        {"role": "assistant", "content": "<browser-navigate-to>a</browser-navigate-to>"},
+        _result("browser-navigate-to", "page a " * 300),
+        {"role": "assistant", "content": "<execute-command>ls</execute-command>"},
+        _result("execute-command", "line\n" * 3000),
+        {"role": "assistant", "content": "<browser-navigate-to>b</browser-navigate-to>"},
+        _result("browser-navigate-to", "page b " * 300),
+        {"role": "assistant", "content": "<read-file>x</read-file>"},
+        _result("read-file", "recent " * 800),
+    ]
+
+
+def _total(messages):
+    return sum(asyncio.run(count_message_tokens("gpt-4o", messages)))
+
+
+def test_messages_within_budget_are_returned_unchanged():
+    messages = _thread()
+    packed = asyncio.run(pack_messages(messages, "gpt-4o", 10 ** 6))
+    assert packed.messages is messages and not packed.actions
+
+
+def test_policies_apply_in_order_until_the_budget_is_met():
+    messages = _thread()
+    policy = PackingPolicy(keep_recent_turns=2)
+    # Stubbing the superseded browser result alone is enough
+    budget = _total(messages) - 200
+    packed = asyncio.run(pack_messages(messages, "gpt-4o", budget, policy))
+    assert packed.actions == {"superseded_browser_results": 1}
+    assert "superseded by a later browser action" in packed.messages[2]["content"]
+    assert packed.tokens_after <= budget and packed.messages[4] is messages[4]
+
+    # A tight budget also truncates and then masks old tool output, never the recent turns
+    packed = asyncio.run(pack_messages(messages, "gpt-4o", 500, policy))
+    assert set(packed.actions) == {"superseded_browser_results", "truncated_tool_results", "masked_tool_results"}
+    assert "older tool output" in packed.messages[4]["content"]
+    assert packed.messages[4]["content"].startswith("<tool_result> <execute-command> ToolResult(success=True")
+    assert packed.messages[6:] == messages[6:]
+    assert messages == _thread()
@@ -0,0 +1,30 @@
+"""
+Tests for the incremental JSON argument assembler used by native tool call streaming.
+"""
+
+import json
+
+from agentpress.json_stream import JSONStreamAssembler
+
+ARGUMENTS = json.dumps({"path": "a/b.py", "text": "brace } quote \" backslash \\ [x]", "items": [1, {"k": "v"}]})
+
+
+def test_completion_detected_for_every_split_size():
+    for size in range(1, len(ARGUMENTS) + 1):
+        assembler = JSONStreamAssembler()
+        states = [assembler.feed(ARGUMENTS[i:i + size]) for i in range(0, len(ARGUMENTS), size)]
+        assert states[-1] is True, f"split size {size}"
+        assert not any(states[:-1]), f"split size {size}"
+        assert assembler.parse() == json.loads(ARGUMENTS)
+
+
+def test_incomplete_and_invalid_arguments_parse_to_none():
+    assembler = JSONStreamAssembler()
+    assembler.feed('{"a": "1"')
+    assert not assembler.complete
+    assert assembler.parse() is None
+
+    assembler = JSONStreamAssembler()
+    assembler.feed('{"a": 1,}')
+    assert assembler.complete
+    assert assembler.parse() is None
@@ -0,0 +1,195 @@
+"""
+Tests for the LLM response cache.
+
+Checks the canonical request key, the memory and disk backends, hits and
+single-flight coalescing through make_llm_api_call, replay of hits as streams,
+that streamed responses are cached once complete, and that coalesced calls
+are released when the leading call fails or its stream is dropped.
+"""
+
+import asyncio
+
+import litellm
+import pytest
+from litellm.types.utils import Delta, ModelResponseStream, StreamingChoices
+
+from services import llm as llm_module
+from services import llm_cache
+from services.llm import make_llm_api_call
+from services.llm_cache import DiskCacheBackend, MemoryCacheBackend, ResponseCache, response_cache_key
+
+MESSAGES = [{"role": "system", "content": "Summarize."}, {"role": "user", "content": "PLEASE PROVIDE THE SUMMARY NOW."}]
+
+
+def _response(content="The summary.", tool_calls=None):
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    return litellm.ModelResponse(
+        model="gpt-4o",
+        choices=[{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+        usage={"prompt_tokens": 120, "completion_tokens": 8, "total_tokens": 128},
+    )
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ResponseCache(MemoryCacheBackend(), ttl=60)
+    monkeypatch.setattr(llm_module, "llm_response_cache", cache)
+    monkeypatch.setattr(llm_module, "LLM_HTTP_POOLING", False)
+    return cache
+
+
+def test_key_is_canonical_and_covers_sampling_params():
+    key = response_cache_key("gpt-4o", MESSAGES, temperature=0, max_tokens=100, top_p=None)
+    assert key == response_cache_key("gpt-4o", [dict(reversed(list(m.items()))) for m in MESSAGES], max_tokens=100, temperature=0)
+    assert key != response_cache_key("gpt-4o", MESSAGES, temperature=0, max_tokens=200)
+    assert key != response_cache_key("gpt-4o-mini", MESSAGES, temperature=0, max_tokens=100)
+    assert key != response_cache_key("gpt-4o", MESSAGES, tools=[{"type": "function"}], temperature=0, max_tokens=100)
+
+
+def test_memory_backend_evicts_least_recently_used_and_expires(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(llm_cache.time, "monotonic", lambda: now[0])
+    backend = MemoryCacheBackend(max_entries=2)
+
+    async def main():
+        await backend.set("a", "1", ttl=10)
+        await backend.set("b", "2", ttl=10)
+        await backend.get("a")
+        await backend.set("c", "3", ttl=10)
+        present = [await backend.get(key) for key in "abc"]
+        now[0] = 11
+        return present, await backend.get("a")
+
+    assert asyncio.run(main()) == (["1", None, "3"], None)
+
+
+def test_disk_backend_persists_entries_with_ttl(tmp_path):
+    async def main():
+        await DiskCacheBackend(str(tmp_path)).set("key", "value", ttl=60)
+        await DiskCacheBackend(str(tmp_path)).set("old", "value", ttl=-1)
+        reader = DiskCacheBackend(str(tmp_path))
+        return await reader.get("key"), await reader.get("old"), await reader.get("missing")
+
+    assert asyncio.run(main()) == ("value", None, None)
+
+
+def test_only_deterministic_opted_in_calls_are_cached():
+    cache = ResponseCache(enabled=False)
+    assert not cache.should_cache(None, 0, False)
+    assert cache.should_cache(True, 0, False)
+    assert not cache.should_cache(True, 0.7, False)
+    assert not cache.should_cache(True, 0, True)
+    assert ResponseCache().should_cache(None, 0, None) and not ResponseCache().should_cache(False, 0, None)
+
+
+def test_identical_concurrent_calls_share_one_upstream_call(monkeypatch, cache):
+    calls = []
+
+    async def acompletion(**params):
+        calls.append(params["model"])
+        await asyncio.sleep(0.01)
+        return _response()
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", acompletion)
+
+    async def main():
+        first = await asyncio.gather(*(make_llm_api_call(MESSAGES, "gpt-4o", max_tokens=100) for _ in range(5)))
+        later = await make_llm_api_call(MESSAGES, "gpt-4o", max_tokens=100)
+        uncached = await make_llm_api_call(MESSAGES, "gpt-4o", max_tokens=100, temperature=0.5)
+        return first + [later, uncached]
+
+    responses = asyncio.run(main())
+    assert len(calls) == 2
+    assert {response.choices[0].message.content for response in responses} == {"The summary."}
+    assert cache.stats["misses"] == 1 and cache.stats["coalesced"] == 4 and cache.stats["hits"] == 1
+
+
+def test_hits_are_replayed_as_streams(monkeypatch, cache):
+    tool_call = {"id": "call_1", "type": "function", "function": {"name": "ask", "arguments": "{\"text\": \"hi\"}"}}
+
+    async def acompletion(**params):
+        return _response("x" * 450, tool_calls=[tool_call])
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", acompletion)
+
+    async def main():
+        await make_llm_api_call(MESSAGES, "gpt-4o")
+        stream = await make_llm_api_call(MESSAGES, "gpt-4o", stream=True)
+        return [chunk async for chunk in stream]
+
+    chunks = asyncio.run(main())
+    deltas = [chunk.choices[0].delta for chunk in chunks]
+    assert "".join(delta.content or "" for delta in deltas) == "x" * 450
+    assert [call.function.name for delta in deltas for call in (delta.tool_calls or [])] == ["ask"]
+    assert chunks[-1].choices[0].finish_reason == "tool_calls"
+    assert chunks[-1].usage.prompt_tokens == 120
+    assert all(chunk._hidden_params["cache_hit"] for chunk in chunks)
+
+
+def test_streamed_responses_are_cached_once_complete(monkeypatch, cache):
+    calls = []
+
+    async def stream():
+        for text in ("Hello", " world"):
+            yield ModelResponseStream(model="gpt-4o", choices=[StreamingChoices(index=0, delta=Delta(content=text))])
+        yield ModelResponseStream(model="gpt-4o", choices=[StreamingChoices(index=0, delta=Delta(), finish_reason="stop")])
+
+    async def acompletion(**params):
+        calls.append(params["stream"])
+        return stream()
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", acompletion)
+
+    async def main():
+        live = await make_llm_api_call(MESSAGES, "gpt-4o", stream=True)
+        live_text = "".join([chunk.choices[0].delta.content or "" async for chunk in live])
+        cached = await make_llm_api_call(MESSAGES, "gpt-4o")
+        return live_text, cached.choices[0].message.content
+
+    assert asyncio.run(main()) == ("Hello world", "Hello world")
+    assert calls == [True]
+
+
+def test_dropped_stream_releases_the_coalesced_calls():
+    cache = ResponseCache(MemoryCacheBackend(), ttl=60)
+    calls = []
+
+    async def stream():
+        yield ModelResponseStream(model="gpt-4o", choices=[StreamingChoices(index=0, delta=Delta(content="Hi"), finish_reason="stop")])
+
+    async def call():
+        calls.append(1)
+        return stream()
+
+    async def main():
+        unread = await cache.get_or_call("key", call, stream=True)
+        waiter = asyncio.create_task(cache.get_or_call("key", call, stream=True))
+        await asyncio.sleep(0)
+        del unread  # Dropped without being read
+        response = await asyncio.wait_for(waiter, timeout=1)
+        return [chunk.choices[0].delta.content async for chunk in response]
+
+    assert asyncio.run(main()) == ["Hi"]
+    assert len(calls) == 2 and cache.stats["stores"] == 1
+
+
+def test_failed_leader_hands_the_call_to_one_waiter():
+    cache = ResponseCache(MemoryCacheBackend(), ttl=60)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise litellm.exceptions.RateLimitError("slow down", "openai", "gpt-4o")
+        return _response()
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_call("key", call) for _ in range(4)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert isinstance(results[0], litellm.exceptions.RateLimitError)
+    assert {result.choices[0].message.content for result in results[1:]} == {"The summary."}
+    assert len(calls) == 2 and cache.stats["stores"] == 1
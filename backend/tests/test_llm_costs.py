@@ -0,0 +1,108 @@
+"""
+Tests for usage-based cost accounting.
+
+Checks that provider usage blocks are normalized, that calls are priced from
+the local price table with cache reads and writes, that streamed calls only
+ask for a usage block from providers known to accept it, and that responses
+served from the LLM response cache are not billed.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from agentpress import response_processor
+from agentpress.response_processor import ResponseProcessor
+from agentpress.tool_registry import ToolRegistry
+from services.llm import PromptCacheStats, calculate_cost, normalize_usage, prepare_params
+
+
+def test_normalize_usage_reads_anthropic_cache_fields():
+    usage = SimpleNamespace(prompt_tokens=1000, completion_tokens=50,
+                            cache_read_input_tokens=800, cache_creation_input_tokens=100)
+    assert normalize_usage(usage) == {
+        "prompt_tokens": 1000, "completion_tokens": 50,
+        "cache_read_input_tokens": 800, "cache_creation_input_tokens": 100,
+    }
+
+
+def test_normalize_usage_reads_openai_cached_tokens_and_missing_fields():
+    usage = {"prompt_tokens": 500, "completion_tokens": 20, "prompt_tokens_details": {"cached_tokens": 300}}
+    assert normalize_usage(usage) == {
+        "prompt_tokens": 500, "completion_tokens": 20,
+        "cache_read_input_tokens": 300, "cache_creation_input_tokens": 0,
+    }
+    assert normalize_usage(None)["prompt_tokens"] == 0
+
+
+def test_calculate_cost_prices_cache_reads_and_writes():
+    usage = {"prompt_tokens": 1_000_000, "completion_tokens": 1_000_000,
+             "cache_read_input_tokens": 400_000, "cache_creation_input_tokens": 200_000}
+    # claude-3-7-sonnet: 3.00 input, 15.00 output, 0.30 cache read, 3.75 cache write per million
+    expected = 0.6 * 3.00 + 0.4 * 0.30 + 0.2 * 3.75 + 1.0 * 15.00
+    assert calculate_cost("anthropic/claude-3-7-sonnet-latest", usage) == pytest.approx(expected)
+
+
+def test_calculate_cost_matches_the_longest_price_key_and_skips_unknown_models():
+    usage = {"prompt_tokens": 1_000_000, "completion_tokens": 0}
+    assert calculate_cost("gpt-4o-mini", usage) == pytest.approx(0.15)
+    assert calculate_cost("unknown-provider/unknown-model", usage) is None
+
+
+def test_stream_usage_is_only_requested_from_known_providers():
+    messages = [{"role": "user", "content": "hi"}]
+    assert prepare_params(messages, "gpt-4o", stream=True)["stream_options"] == {"include_usage": True}
+    assert "stream_options" not in prepare_params(messages, "gpt-4o", stream=False)
+    assert "stream_options" not in prepare_params(messages, "ollama/llama3", stream=True)
+    assert "stream_options" not in prepare_params(messages, "gpt-4o", stream=True, api_base="http://proxy.local")
+
+
+def test_non_streaming_cost_falls_back_to_litellm_response_cost():
+    ToolRegistry._instance = None
+    rows = []
+
+    async def add_message(thread_id, type, content, is_llm_message=False, metadata=None):
+        rows.append({"type": type, "content": content})
+        return {"message_id": str(len(rows)), "type": type, "content": content}
+
+    processor = ResponseProcessor(ToolRegistry(), add_message)
+    message = SimpleNamespace(content="hello", tool_calls=None)
+    response = SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None,
+                               _hidden_params={"response_cost": 0.25})
+
+    async def run():
+        async for _ in processor.process_non_streaming_response(response, "thread", [], "unknown-model", prompt_token_count=10):
+            pass
+
+    asyncio.run(run())
+    cost = next(row["content"] for row in rows if row["type"] == "cost")
+    assert cost["cost"] == 0.25
+    assert cost["usage_source"] == "estimated"
+    assert cost["prompt_tokens"] == 10
+
+
+def test_cached_responses_cost_nothing_and_skip_the_prompt_cache_stats(monkeypatch):
+    ToolRegistry._instance = None
+    rows = []
+    stats = PromptCacheStats()
+    monkeypatch.setattr(response_processor, "prompt_cache_stats", stats)
+
+    async def add_message(thread_id, type, content, is_llm_message=False, metadata=None):
+        rows.append({"type": type, "content": content})
+        return {"message_id": str(len(rows)), "type": type, "content": content}
+
+    processor = ResponseProcessor(ToolRegistry(), add_message)
+    message = SimpleNamespace(content="hello", tool_calls=None)
+    usage = SimpleNamespace(prompt_tokens=1000, completion_tokens=50)
+    response = SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage,
+                               _hidden_params={"cache_hit": True})
+
+    async def run():
+        async for _ in processor.process_non_streaming_response(response, "thread", [], "gpt-4o"):
+            pass
+
+    asyncio.run(run())
+    cost = next(row["content"] for row in rows if row["type"] == "cost")
+    assert cost["cost"] == 0 and cost["usage_source"] == "cache" and cost["prompt_tokens"] == 1000
+    assert stats.models == {}
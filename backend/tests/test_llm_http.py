@@ -0,0 +1,85 @@
+"""
+Tests for the pooled LLM HTTP clients.
+
+Checks that clients are created once per provider and base URL in the form
+LiteLLM expects, that requests in flight and pool saturation are counted until
+responses are closed, and that closing drops the pools.
+"""
+
+import asyncio
+
+import httpx
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+
+from services.llm_http import LLMHTTPPools, PoolLimits, provider_of
+
+
+def _mock(pools, model_name):
+    """Get the httpx client of a model's pool, answering requests locally."""
+    client = pools.client_for(model_name)
+    pool = next(pool for pool in pools._pools.values() if pool.client in (getattr(client, "client", None), getattr(client, "_client", None)))
+    pool.client._transport._transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, stream=httpx.ByteStream(b'{"ok": true}'))
+    )
+    return pool.client
+
+
+def test_models_are_routed_to_provider_pools():
+    assert provider_of("anthropic/claude-3-7-sonnet-latest") == "anthropic"
+    assert provider_of("claude-3-5-haiku") == "anthropic"
+    assert provider_of("bedrock/anthropic.claude-3-7-sonnet") == "bedrock"
+    assert provider_of("openrouter/deepseek/deepseek-chat") == "openrouter"
+    assert provider_of("gpt-4o") == "openai"
+    assert provider_of("groq/llama3-70b") is None
+
+
+def test_clients_are_created_once_per_provider_and_base_url():
+    async def main():
+        pools = LLMHTTPPools(PoolLimits())
+        first = pools.client_for("anthropic/claude-3-7-sonnet-latest")
+        assert pools.client_for("claude-3-5-haiku") is first
+        assert isinstance(first, AsyncHTTPHandler)
+        assert type(pools.client_for("gpt-4o", api_key="test")).__name__ == "AsyncOpenAI"
+        pools.client_for("openrouter/x", api_base="https://proxy.example.com/v1/")
+        pools.client_for("openrouter/y")
+        assert len(pools.stats()) == 4
+        await pools.aclose()
+        assert pools.stats() == {}
+
+    asyncio.run(main())
+
+
+def test_requests_in_flight_and_saturation_are_counted():
+    async def main():
+        pools = LLMHTTPPools(PoolLimits(max_connections=1))
+        client = _mock(pools, "openrouter/x")
+        assert (await client.get("https://openrouter.ai/api/v1/models")).json() == {"ok": True}
+        async with client.stream("GET", "https://openrouter.ai/api/v1/a"):
+            async with client.stream("GET", "https://openrouter.ai/api/v1/b"):
+                stats = next(iter(pools.stats().values()))
+                assert stats["in_flight"] == 2 and stats["saturated"] == 1
+        stats = next(iter(pools.stats().values()))
+        assert stats["requests"] == 3 and stats["in_flight"] == 0 and stats["peak_in_flight"] == 2
+        await pools.aclose()
+
+    asyncio.run(main())
+
+
+def test_handler_uses_the_pooled_client_without_building_its_own(monkeypatch):
+    created = []
+    original = httpx.AsyncClient.__init__
+
+    def tracking_init(self, *args, **kwargs):
+        created.append(self)
+        original(self, *args, **kwargs)
+
+    async def main():
+        pools = LLMHTTPPools(PoolLimits())
+        monkeypatch.setattr(httpx.AsyncClient, "__init__", tracking_init)
+        handler = pools.client_for("anthropic/claude-3-7-sonnet-latest")
+        pool = next(iter(pools._pools.values()))
+        assert handler.client is pool.client
+        assert created == [pool.client]
+        await pools.aclose()
+
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Tests for the LLM rate limiter.
+
+Checks budget lookup by model and provider, queueing on the shared Redis
+buckets, the fallback to in-process buckets when Redis fails, and that calls
+waiting too long are sent anyway.
+"""
+
+import asyncio
+
+import pytest
+
+from services import llm_rate_limit
+from services.llm_rate_limit import LLMRateLimiter, RateLimit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock advanced by asyncio.sleep."""
+    now = [1000.0]
+
+    async def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(llm_rate_limit.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(llm_rate_limit.asyncio, "sleep", sleep)
+    return now
+
+
+def test_model_budgets_take_precedence_over_provider_budgets():
+    limiter = LLMRateLimiter({"anthropic": RateLimit(50, 40000), "claude-3-5-haiku": RateLimit(100, 80000)})
+    assert limiter.limit_for("claude-3-5-haiku")[0] == "claude-3-5-haiku"
+    assert limiter.limit_for("anthropic/claude-3-7-sonnet-latest")[0] == "anthropic"
+    assert limiter.limit_for("gpt-4o") is None
+
+
+def test_calls_queue_on_the_shared_redis_buckets(monkeypatch, clock):
+    calls = []
+    waits_ms = iter([1500, 0])
+
+    async def eval_script(script, keys, args):
+        calls.append((keys, args))
+        return next(waits_ms)
+
+    monkeypatch.setattr(llm_rate_limit.redis, "eval_script", eval_script)
+    limiter = LLMRateLimiter({"anthropic": RateLimit(60, 6000)})
+    waited = asyncio.run(limiter.acquire("claude-3-7-sonnet", 300))
+
+    assert waited == 1.5
+    assert calls[0][0] == ["{llm_rate:anthropic}:requests", "{llm_rate:anthropic}:tokens"]
+    assert calls[0][1][:6] == [60, 1.0, 6000, 100.0, 1, 300]
+    assert limiter.stats["admitted"] == 1 and limiter.stats["queued"] == 1
+
+
+def test_local_buckets_are_used_while_redis_is_down(monkeypatch, clock):
+    attempts = []
+
+    async def eval_script(script, keys, args):
+        attempts.append(keys)
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(llm_rate_limit.redis, "eval_script", eval_script)
+    limiter = LLMRateLimiter({"gpt-4o": RateLimit(rpm=3, tpm=100000)}, max_queue_seconds=60)
+
+    async def main():
+        return [await limiter.acquire("gpt-4o", 10) for _ in range(4)]
+
+    # Three requests fit the bucket; the fourth waits for one request to refill (20s at 3 rpm)
+    assert asyncio.run(main()) == [0.0, 0.0, 0.0, 20.0]
+    assert len(attempts) == 1  # Redis is not retried during the cool-down
+
+
+def test_calls_waiting_too_long_are_sent_anyway(monkeypatch, clock):
+    async def eval_script(script, keys, args):
+        return 90000
+
+    monkeypatch.setattr(llm_rate_limit.redis, "eval_script", eval_script)
+    limiter = LLMRateLimiter({"gpt-4o": RateLimit(rpm=1, tpm=1000)}, max_queue_seconds=20)
+    assert asyncio.run(limiter.acquire("gpt-4o", 10)) == 0.0
+    assert limiter.stats["over_budget"] == 1
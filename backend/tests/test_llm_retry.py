@@ -0,0 +1,259 @@
+"""
+Tests for the LLM retry engine.
+
+Checks parsing of provider wait hints, backoff bounds, retries and fallback
+chains, circuit breakers, hedged streaming calls, and the errors raised by
+make_llm_api_call.
+"""
+
+import asyncio
+import time
+
+import httpx
+import litellm
+import pytest
+
+from services import llm as llm_module
+from services import llm_retry
+from services.llm import LLMError, LLMRetryError, make_llm_api_call
+from services.llm_retry import (
+    CircuitBreaker,
+    CircuitBreakers,
+    RetriesExhausted,
+    RetryPolicy,
+    call_with_retries,
+    decorrelated_jitter,
+    retry_after_seconds,
+)
+
+
+def _rate_limit(headers=None):
+    response = httpx.Response(429, headers=headers or {}, request=httpx.Request("POST", "https://api.anthropic.com"))
+    return litellm.exceptions.RateLimitError("slow down", "anthropic", "claude", response=response)
+
+
+def _bad_request():
+    return litellm.exceptions.BadRequestError("prompt is too long", "claude", "anthropic")
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(llm_retry.asyncio, "sleep", sleep)
+    return waits
+
+
+def test_provider_wait_hints_are_parsed():
+    now = time.time()
+    assert retry_after_seconds(_rate_limit({"retry-after": "7"})) == 7
+    assert retry_after_seconds(_rate_limit({"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(_rate_limit({"x-ratelimit-reset-tokens": "1m30s", "x-ratelimit-reset-requests": "20ms"})) == 90
+    reset = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now + 12))
+    assert 10 <= retry_after_seconds(_rate_limit({"anthropic-ratelimit-tokens-reset": reset}), now=now) <= 12
+    assert retry_after_seconds(_rate_limit()) is None
+
+
+def test_decorrelated_jitter_stays_within_bounds():
+    delays = [decorrelated_jitter(4.0, 1.0, 10.0) for _ in range(200)]
+    assert all(1.0 <= delay <= 10.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_rate_limits_are_retried_after_the_requested_wait(sleeps):
+    calls = []
+
+    async def call(model):
+        calls.append(model)
+        if len(calls) < 3:
+            raise _rate_limit({"retry-after": "2"})
+        return "response"
+
+    result = asyncio.run(call_with_retries(call, "claude-3-7-sonnet", RetryPolicy(), breakers=CircuitBreakers()))
+    assert result == "response" and calls == ["claude-3-7-sonnet"] * 3
+    assert sleeps == [2.0, 2.0]
+
+
+def test_fallback_models_are_tried_in_order(sleeps):
+    calls = []
+
+    async def call(model):
+        calls.append(model)
+        if model == "anthropic/claude-3-7-sonnet-latest":
+            raise _bad_request()
+        if model.startswith("bedrock/"):
+            raise _rate_limit({"retry-after": "600"})  # Longer than the policy waits
+        return model
+
+    policy = RetryPolicy(fallback_models=("bedrock/anthropic.claude-3-7-sonnet", "openrouter/anthropic/claude-3.7-sonnet"))
+    result = asyncio.run(call_with_retries(call, "anthropic/claude-3-7-sonnet-latest", policy, breakers=CircuitBreakers()))
+    assert result == "openrouter/anthropic/claude-3.7-sonnet"
+    assert calls == ["anthropic/claude-3-7-sonnet-latest", "bedrock/anthropic.claude-3-7-sonnet", "openrouter/anthropic/claude-3.7-sonnet"]
+    assert sleeps == []
+
+
+def test_circuit_breaker_opens_and_probes_after_cool_down(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(llm_retry.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker("anthropic", failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    clock[0] += 30
+    assert breaker.allow() and not breaker.allow()  # A single probe
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_open_circuits_are_skipped(sleeps):
+    breakers = CircuitBreakers()
+    for _ in range(llm_retry.BREAKER_FAILURE_THRESHOLD):
+        breakers.for_model("claude-3-7-sonnet").record_failure()
+
+    async def call(model):
+        return model
+
+    policy = RetryPolicy(fallback_models=("openrouter/anthropic/claude-3.7-sonnet",))
+    assert asyncio.run(call_with_retries(call, "claude-3-7-sonnet", policy, breakers=breakers)) == "openrouter/anthropic/claude-3.7-sonnet"
+
+
+def test_slow_first_token_is_hedged_with_the_next_model():
+    async def stream(model, delay):
+        await asyncio.sleep(delay)
+        yield f"{model} first"
+        yield f"{model} second"
+
+    async def call(model):
+        return stream(model, 1.0 if model == "claude-3-7-sonnet" else 0.0)
+
+    async def main():
+        policy = RetryPolicy(fallback_models=("openrouter/anthropic/claude-3.7-sonnet",), hedge_after=0.05)
+        response = await call_with_retries(call, "claude-3-7-sonnet", policy, stream=True, breakers=CircuitBreakers())
+        return [chunk async for chunk in response]
+
+    assert asyncio.run(main()) == ["openrouter/anthropic/claude-3.7-sonnet first", "openrouter/anthropic/claude-3.7-sonnet second"]
+
+
+def test_long_provider_wait_on_the_last_model_gives_up(sleeps):
+    async def call(model):
+        raise _rate_limit({"retry-after": "600"})
+
+    with pytest.raises(RetriesExhausted):
+        asyncio.run(call_with_retries(call, "claude-3-7-sonnet", RetryPolicy(), breakers=CircuitBreakers()))
+    assert sleeps == []
+
+
+def _half_open(breakers, model):
+    breaker = breakers.for_model(model)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout  # The cool-down has passed
+    return breaker
+
+
+def test_probe_without_an_outcome_is_released():
+    breakers = CircuitBreakers()
+    breaker = _half_open(breakers, "claude-3-7-sonnet")
+
+    async def hanging(model):
+        await asyncio.sleep(10)
+
+    async def cancelled():
+        task = asyncio.create_task(call_with_retries(hanging, "claude-3-7-sonnet", RetryPolicy(), breakers=breakers))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled())
+    assert breaker.allow()  # The next call may probe
+    breaker.release_probe()
+
+    async def broken(model):
+        raise ValueError("bad params")
+
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_retries(broken, "claude-3-7-sonnet", RetryPolicy(), breakers=breakers))
+    assert breaker.allow()
+
+
+def test_hedged_probe_is_released_when_the_hedge_wins():
+    breakers = CircuitBreakers()
+    breaker = _half_open(breakers, "claude-3-7-sonnet")
+
+    async def call(model):
+        if model == "claude-3-7-sonnet":
+            await asyncio.sleep(10)
+        return model
+
+    policy = RetryPolicy(fallback_models=("openrouter/anthropic/claude-3.7-sonnet",), hedge_after=0.01)
+    assert asyncio.run(call_with_retries(call, "claude-3-7-sonnet", policy, breakers=breakers)) == "openrouter/anthropic/claude-3.7-sonnet"
+    assert breaker.state == "half_open" and breaker.allow()
+
+
+def test_hedged_primary_failure_is_recorded_when_the_hedge_wins():
+    breakers = CircuitBreakers()
+
+    async def call(model):
+        if model == "claude-3-7-sonnet":
+            await asyncio.sleep(0.02)
+            raise _rate_limit()
+        await asyncio.sleep(0.05)
+        return model
+
+    policy = RetryPolicy(fallback_models=("openrouter/anthropic/claude-3.7-sonnet",), hedge_after=0.01)
+    assert asyncio.run(call_with_retries(call, "claude-3-7-sonnet", policy, breakers=breakers)) == "openrouter/anthropic/claude-3.7-sonnet"
+    assert breakers.for_model("claude-3-7-sonnet").failures == 1
+
+
+def test_hedge_loser_stream_is_closed():
+    closed = []
+
+    async def stream(model):
+        try:
+            yield f"{model} first"
+            yield f"{model} second"
+        finally:
+            closed.append(model)
+
+    async def main():
+        answer = asyncio.Event()
+
+        async def call(model):
+            await answer.wait()  # Both models answer at once
+            return stream(model)
+
+        asyncio.get_running_loop().call_later(0.05, answer.set)
+        policy = RetryPolicy(fallback_models=("openrouter/anthropic/claude-3.7-sonnet",), hedge_after=0.01)
+        response = await call_with_retries(call, "claude-3-7-sonnet", policy, stream=True, breakers=CircuitBreakers())
+        assert len(closed) == 1
+        chunks = [chunk async for chunk in response]
+        return chunks
+
+    chunks = asyncio.run(main())
+    assert len(chunks) == 2 and sorted(closed) == ["claude-3-7-sonnet", "openrouter/anthropic/claude-3.7-sonnet"]
+
+
+def test_make_llm_api_call_raises_after_retries_and_on_unexpected_errors(monkeypatch, sleeps):
+    monkeypatch.setattr(llm_module, "LLM_HTTP_POOLING", False)
+    monkeypatch.setattr(llm_retry, "circuit_breakers", CircuitBreakers())
+
+    async def rate_limited(**params):
+        raise _rate_limit()
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", rate_limited)
+    with pytest.raises(LLMRetryError):
+        asyncio.run(make_llm_api_call([{"role": "user", "content": "hi"}], "gpt-4o", retry_policy=RetryPolicy(max_attempts=2)))
+    assert len(sleeps) == 1
+
+    async def broken(**params):
+        raise ValueError("bad params")
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", broken)
+    with pytest.raises(LLMError):
+        asyncio.run(make_llm_api_call([{"role": "user", "content": "hi"}], "gpt-4o"))
@@ -0,0 +1,160 @@
+"""
+Tests for the record/replay LLM transport.
+
+Records streamed and complete responses through make_llm_api_call, then
+replays them without a provider: chunk contents, tool call deltas, finish
+reasons, usage and timing, matched by request or in recorded order.
+"""
+
+import asyncio
+import os
+
+import litellm
+import pytest
+from litellm.types.utils import ChatCompletionDeltaToolCall, Delta, Function, ModelResponseStream, StreamingChoices, Usage
+
+from services import llm as llm_module
+from services import llm_transport as transport_module
+from services.llm import LLMError, make_llm_api_call
+from services.llm_transport import LLMTransport
+
+MESSAGES = [{"role": "user", "content": "List the files."}]
+
+
+def _chunk(delta, finish_reason=None, usage=None):
+    extra = {"usage": usage} if usage else {}
+    return ModelResponseStream(model="gpt-4o", choices=[StreamingChoices(index=0, delta=delta, finish_reason=finish_reason)], **extra)
+
+
+async def _provider_stream():
+    yield _chunk(Delta(role="assistant", content="Listing"))
+    yield _chunk(Delta(content=" files."))
+    yield _chunk(Delta(tool_calls=[ChatCompletionDeltaToolCall(index=0, id="call_1", type="function", function=Function(name="ls", arguments=""))]))
+    yield _chunk(Delta(tool_calls=[ChatCompletionDeltaToolCall(index=0, function=Function(arguments="{\"path\": \".\"}"))]))
+    yield _chunk(Delta(), finish_reason="tool_calls", usage=Usage(prompt_tokens=50, completion_tokens=12, total_tokens=62))
+
+
+def _summary(chunks):
+    deltas = [chunk.choices[0].delta for chunk in chunks]
+    return (
+        "".join(delta.content or "" for delta in deltas),
+        [(call.index, call.id, call.function.name, call.function.arguments) for delta in deltas for call in (delta.tool_calls or [])],
+        chunks[-1].choices[0].finish_reason,
+        chunks[-1].usage.prompt_tokens,
+    )
+
+
+@pytest.fixture
+def live(monkeypatch):
+    monkeypatch.setattr(llm_module, "LLM_HTTP_POOLING", False)
+
+    def use(transport):
+        monkeypatch.setattr(llm_module, "llm_transport", transport)
+        return transport
+    return use
+
+
+def _record_stream(monkeypatch, live, directory):
+    transport = live(LLMTransport("record", str(directory)))
+
+    async def acompletion(**params):
+        return _provider_stream()
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", acompletion)
+
+    async def main():
+        stream = await make_llm_api_call(MESSAGES, "gpt-4o", stream=True)
+        return [chunk async for chunk in stream]
+
+    return transport, asyncio.run(main())
+
+
+def test_streams_are_recorded_and_replayed_chunk_for_chunk(monkeypatch, live, tmp_path):
+    recorder, live_chunks = _record_stream(monkeypatch, live, tmp_path)
+    assert recorder.stats["recorded"] == 1
+    assert len(os.listdir(tmp_path)) == 1
+
+    async def no_provider(**params):
+        raise AssertionError("replay must not call the provider")
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", no_provider)
+    replayer = live(LLMTransport("replay", str(tmp_path), speed=0))
+
+    async def main():
+        stream = await make_llm_api_call(MESSAGES, "gpt-4o", stream=True)
+        return [chunk async for chunk in stream]
+
+    replayed = asyncio.run(main())
+    assert _summary(replayed) == _summary(live_chunks) == (
+        "Listing files.", [(0, "call_1", "ls", ""), (0, None, None, "{\"path\": \".\"}")], "tool_calls", 50
+    )
+    assert replayer.stats["replayed"] == 1
+
+
+def test_replay_follows_recorded_timing_at_the_requested_speed(monkeypatch, live, tmp_path):
+    _record_stream(monkeypatch, live, tmp_path)
+    path = os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    recording = transport_module.Recording.load(path)
+    assert len(recording.events) == 5
+    # First chunk 400ms after the request, then one every 100ms
+    recording.events = [(offset, event) for offset, (_, event) in zip([400, 500, 600, 700, 800], recording.events)]
+    recording.dump(path)
+
+    now = [0.0]
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(round(seconds, 3))
+        now[0] += seconds
+
+    monkeypatch.setattr(transport_module.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(transport_module.asyncio, "sleep", sleep)
+    live(LLMTransport("replay", str(tmp_path), speed=4))
+
+    async def main():
+        stream = await make_llm_api_call(MESSAGES, "gpt-4o", stream=True)
+        return [chunk async for chunk in stream]
+
+    asyncio.run(main())
+    assert waits == [0.1, 0.025, 0.025, 0.025, 0.025]
+
+
+def test_complete_responses_replay_for_streaming_callers_and_misses_fail(monkeypatch, live, tmp_path):
+    live(LLMTransport("record", str(tmp_path)))
+
+    async def acompletion(**params):
+        return litellm.ModelResponse(
+            model="gpt-4o", choices=[{"index": 0, "message": {"role": "assistant", "content": "Done."}, "finish_reason": "stop"}],
+            usage={"prompt_tokens": 9, "completion_tokens": 2, "total_tokens": 11},
+        )
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", acompletion)
+    asyncio.run(make_llm_api_call(MESSAGES, "gpt-4o"))
+    live(LLMTransport("replay", str(tmp_path), speed=0))
+
+    async def main():
+        stream = await make_llm_api_call(MESSAGES, "gpt-4o", stream=True)
+        return [chunk async for chunk in stream]
+
+    assert _summary(asyncio.run(main())) == ("Done.", [], "stop", 9)
+    with pytest.raises(LLMError, match="No LLM recording"):
+        asyncio.run(make_llm_api_call([{"role": "user", "content": "Something else"}], "gpt-4o"))
+
+
+def test_sequence_matching_replays_in_recorded_order(monkeypatch, live, tmp_path):
+    live(LLMTransport("record", str(tmp_path)))
+    answers = iter(["first", "second"])
+
+    async def acompletion(**params):
+        return litellm.ModelResponse(model="gpt-4o", choices=[{"index": 0, "message": {"role": "assistant", "content": next(answers)}}])
+
+    monkeypatch.setattr(llm_module.litellm, "acompletion", acompletion)
+    asyncio.run(make_llm_api_call([{"role": "user", "content": "Run at 10:00"}], "gpt-4o"))
+    asyncio.run(make_llm_api_call([{"role": "user", "content": "Run at 10:01"}], "gpt-4o"))
+
+    live(LLMTransport("replay", str(tmp_path), speed=0, match="sequence"))
+
+    async def main():
+        return [(await make_llm_api_call([{"role": "user", "content": f"Run at 11:0{i}"}], "gpt-4o")).choices[0].message.content for i in range(2)]
+
+    assert asyncio.run(main()) == ["first", "second"]
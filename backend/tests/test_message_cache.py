@@ -0,0 +1,102 @@
+"""
+Tests for the per-thread LLM message cache.
+
+Checks deduplication and ordering of rows from add_message and delta fetches,
+summary-aware truncation, LRU eviction by size, and that callers get list copies.
+"""
+
+import json
+
+from agentpress.message_cache import ThreadMessageCache
+from services.llm import apply_cache_breakpoints
+
+
+def _row(message_id, second, text, type="user", role="user"):
+    return {
+        "message_id": message_id,
+        "type": type,
+        "content": json.dumps({"role": role, "content": text}),
+        "created_at": f"2025-04-20T10:00:{second:02d}.000000+00:00",
+    }
+
+
+def _texts(cache, thread_id):
+    return [message["content"] for message in cache.get(thread_id)]
+
+
+def test_rows_are_deduplicated_and_kept_in_created_at_order():
+    cache = ThreadMessageCache()
+    cache.load("t", [_row("a", 1, "first"), _row("c", 3, "third")])
+    # A delta fetch returns a row already added and one committed late
+    cache.add_rows("t", [_row("b", 2, "second"), _row("c", 3, "third")])
+    assert _texts(cache, "t") == ["first", "second", "third"]
+
+
+def test_rows_of_uncached_threads_are_ignored():
+    cache = ThreadMessageCache()
+    cache.add_rows("t", [_row("a", 1, "first")])
+    assert cache.get("t") is None
+    assert cache.delta_since("t") is None
+
+
+def test_summary_drops_earlier_messages():
+    cache = ThreadMessageCache()
+    cache.load("t", [_row("a", 1, "first"), _row("b", 2, "second")])
+    cache.add_rows("t", [_row("s", 3, "summary", type="summary"), _row("d", 4, "after")])
+    # A late row from before the summary is not part of the context
+    cache.add_rows("t", [_row("x", 2, "late")])
+    assert _texts(cache, "t") == ["summary", "after"]
+
+
+def test_tool_call_arguments_are_normalized_to_strings():
+    cache = ThreadMessageCache()
+    row = _row("a", 1, "", type="assistant", role="assistant")
+    row["content"] = {"role": "assistant", "content": "", "tool_calls": [
+        {"id": "1", "type": "function", "function": {"name": "echo", "arguments": {"text": "hi"}}}
+    ]}
+    cache.load("t", [row])
+    assert cache.get("t")[0]["tool_calls"][0]["function"]["arguments"] == '{"text": "hi"}'
+
+
+def test_least_recently_used_threads_are_evicted_by_size():
+    cache = ThreadMessageCache(max_bytes=250)
+    cache.load("old", [_row("a", 1, "x" * 60)])
+    cache.load("new", [_row("b", 1, "y" * 60)])
+    cache.get("old")
+    cache.load("newest", [_row("c", 1, "z" * 60)])
+    assert "old" in cache and "newest" in cache
+    assert "new" not in cache
+
+
+def test_callers_get_a_list_copy_and_decorating_copies_leaves_the_cache_unchanged():
+    cache = ThreadMessageCache()
+    cache.load("t", [_row("a", 1, "first"), _row("b", 2, "second")])
+    messages = cache.get("t")
+    messages.append({"role": "user", "content": "temporary"})
+    apply_cache_breakpoints(messages, [0, 1])
+    assert _texts(cache, "t") == ["first", "second"]
+
+
+def test_message_ids_of_dropped_messages_are_pruned():
+    cache = ThreadMessageCache()
+    cache.load("t", [_row("a", 1, "first"), _row("b", 2, "second")])
+    cache.add_rows("t", [_row("s", 3, "summary", type="summary"), _row("x", 1, "late")])
+    assert cache._threads["t"].message_ids == {"s"}
+
+
+def test_token_totals_are_running_sums():
+    cache = ThreadMessageCache()
+    stored = _row("a", 1, "first")
+    stored["metadata"] = json.dumps({"token_counts": {"gpt-4o": 7}})
+    cache.load("t", [stored, _row("b", 2, "second")])
+    assert cache.token_total("t", "gpt-4o") is None
+
+    uncounted = cache.uncounted_messages("t", "gpt-4o")
+    assert [message["content"] for _, message in uncounted] == ["second"]
+    cache.set_token_counts("t", "gpt-4o", [(key, 5) for key, _ in uncounted])
+    assert cache.token_total("t", "gpt-4o") == 12
+
+    summary = _row("s", 3, "summary", type="summary")
+    summary["metadata"] = {"token_counts": {"gpt-4o": 4}}
+    cache.add_rows("t", [summary])
+    assert cache.token_total("t", "gpt-4o") == 4
@@ -0,0 +1,97 @@
+"""
+Tests for the write-behind message queue.
+
+Uses an in-memory stand-in for the Supabase client to check that rows are
+returned immediately, written in order, batched, and retried after a failure.
+"""
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from agentpress.message_writer import MessageFlushError, MessageWriteBehindQueue
+
+
+class _FakeQuery:
+    def __init__(self, db, rows):
+        self.db, self.rows = db, rows
+
+    async def execute(self):
+        await asyncio.sleep(0)
+        if self.db.failures:
+            self.db.failures -= 1
+            raise RuntimeError("insert failed")
+        self.db.batches.append([row['type'] for row in self.rows])
+
+
+class _FakeDB:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        return self
+
+    def upsert(self, rows, returning=None):
+        return _FakeQuery(self, list(rows))
+
+
+def test_rows_are_returned_immediately_with_increasing_timestamps():
+    async def run():
+        db = _FakeDB()
+        queue = MessageWriteBehindQueue(db, "thread", flush_interval=10)
+        rows = [queue.enqueue("status", {"i": i}) for i in range(5)]
+        assert db.batches == []
+        assert len({row['message_id'] for row in rows}) == 5
+        assert [row['created_at'] for row in rows] == sorted(row['created_at'] for row in rows)
+        assert len({row['created_at'] for row in rows}) == 5
+        await queue.close()
+        return db.batches
+
+    assert asyncio.run(run()) == [["status"] * 5]
+
+
+def test_full_batch_flushes_and_failed_batch_is_retried_in_order():
+    async def run():
+        db = _FakeDB(failures=1)
+        queue = MessageWriteBehindQueue(db, "thread", flush_interval=10, max_batch_size=2)
+        queue.enqueue("a", {})
+        queue.enqueue("b", {})
+        await asyncio.sleep(0.05)  # Batch-size flush fails once
+        queue.enqueue("c", {})
+        await queue.close()
+        return db.batches
+
+    assert asyncio.run(run()) == [["a", "b", "c"]]
+
+
+def test_close_retries_then_writes_rows_individually():
+    async def run():
+        db = _FakeDB(failures=3)  # Every bulk attempt on close fails
+        queue = MessageWriteBehindQueue(db, "thread", flush_interval=10)
+        queue.enqueue("a", {})
+        queue.enqueue("b", {})
+        with patch("agentpress.message_writer.CLOSE_FLUSH_BACKOFF", 0):
+            await queue.close()
+        return db.batches
+
+    assert asyncio.run(run()) == [["a"], ["b"]]
+
+
+def test_close_raises_when_rows_cannot_be_written():
+    async def run():
+        db = _FakeDB(failures=4)  # Bulk attempts and the first single-row write fail
+        queue = MessageWriteBehindQueue(db, "thread", flush_interval=10)
+        queue.enqueue("a", {})
+        queue.enqueue("b", {})
+        with patch("agentpress.message_writer.CLOSE_FLUSH_BACKOFF", 0):
+            with pytest.raises(MessageFlushError):
+                await queue.close()
+        return db.batches
+
+    assert asyncio.run(run()) == [["b"]]
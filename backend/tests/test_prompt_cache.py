@@ -0,0 +1,92 @@
+"""
+Tests for the prompt assembly cache.
+
+Checks that prompts are assembled once per prompt version and tool set, that
+re-registering the same tools keeps the cache valid, and that callers cannot
+change the cached system message.
+"""
+
+import asyncio
+
+from litellm import token_counter
+
+from agent.prompt import SYSTEM_PROMPT_VERSION, get_datetime_context, get_system_prompt
+from agentpress.prompt_cache import PromptAssemblyCache
+from agentpress.token_counting import REPLY_PRIMING_TOKENS
+from agentpress.tool import Tool, openapi_schema, xml_schema
+from agentpress.tool_registry import ToolRegistry
+
+SYSTEM_PROMPT = {"role": "system", "content": "You are a careful agent."}
+
+
+class _EchoTool(Tool):
+    @openapi_schema({"type": "function", "function": {"name": "echo", "parameters": {"type": "object"}}})
+    @xml_schema(tag_name="echo", mappings=[], example="<echo>hi</echo>")
+    async def echo(self):
+        return self.success_response("echo")
+
+
+class _OtherTool(Tool):
+    @xml_schema(tag_name="other", mappings=[], example="<other/>")
+    async def other(self):
+        return self.success_response("other")
+
+
+def _registry():
+    ToolRegistry._instance = None
+    registry = ToolRegistry()
+    registry.register_tool(_EchoTool)
+    return registry
+
+
+def test_prompt_is_assembled_once_per_version_and_tool_set():
+    registry = _registry()
+    cache = PromptAssemblyCache()
+
+    async def run():
+        first = await cache.get(SYSTEM_PROMPT, registry, "gpt-4o", include_xml_examples=True)
+        registry.register_tool(_EchoTool)  # Same tools, e.g. a new run with a new sandbox
+        second = await cache.get(dict(SYSTEM_PROMPT), registry, "gpt-4o", include_xml_examples=True)
+        registry.register_tool(_OtherTool)
+        third = await cache.get(SYSTEM_PROMPT, registry, "gpt-4o", include_xml_examples=True)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert second is first and third is not first
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert "<echo> Example: <echo>hi</echo>" in first.content and "<other>" in third.content
+    assert [schema["function"]["name"] for schema in first.openapi_schemas()] == ["echo"]
+
+    message = first.system_message()
+    assert first.token_count == token_counter(model="gpt-4o", messages=[message]) - REPLY_PRIMING_TOKENS
+
+
+def test_system_message_copies_are_not_shared():
+    registry = _registry()
+    cache = PromptAssemblyCache()
+    prompt = {"role": "system", "content": [{"type": "text", "text": "You are a careful agent."}]}
+    assembled = asyncio.run(cache.get(prompt, registry, "gpt-4o", prompt_version="v1"))
+
+    # prepare_params adds cache_control blocks to the message it is given
+    assembled.system_message()["content"][0]["cache_control"] = {"type": "ephemeral"}
+    assert "cache_control" not in assembled.system_message()["content"][0]
+    assert "cache_control" not in prompt["content"][0]
+
+
+def test_agent_runs_share_one_assembled_prompt():
+    registry = _registry()
+    cache = PromptAssemblyCache()
+
+    async def run():
+        # Two runs build their system message separately, as run_agent does
+        first = await cache.get({"role": "system", "content": get_system_prompt()}, registry, "gpt-4o",
+                                include_xml_examples=True, prompt_version=SYSTEM_PROMPT_VERSION)
+        second = await cache.get({"role": "system", "content": get_system_prompt()}, registry, "gpt-4o",
+                                 include_xml_examples=True, prompt_version=SYSTEM_PROMPT_VERSION)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert second is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    # The volatile date and time are sent outside the cached system block
+    assert get_datetime_context().split(",")[0] not in first.content
@@ -0,0 +1,65 @@
+"""
+Tests for Anthropic prompt cache breakpoint planning.
+
+Checks that breakpoints land on the system prompt, the last message and the
+ends of previous turns, stay within the provider limit, and that preparing
+parameters leaves the caller's messages unchanged.
+"""
+
+import copy
+
+from services.llm import (
+    PromptCacheStats,
+    apply_cache_breakpoints,
+    plan_cache_breakpoints,
+    prepare_params,
+)
+
+
+def _tool_loop(turns):
+    messages = [{"role": "system", "content": "system"}, {"role": "user", "content": "task"}]
+    for turn in range(turns):
+        messages.append({"role": "assistant", "content": f"step {turn}"})
+        messages.append({"role": "user", "content": f"result {turn}"})
+    return messages
+
+
+def test_breakpoints_cover_system_last_message_and_previous_turns():
+    messages = _tool_loop(4)
+    # 0 system, 1 task, then assistant at 2/4/6/8 and results at 3/5/7/9
+    assert plan_cache_breakpoints(messages) == [0, 5, 7, 9]
+
+
+def test_breakpoints_skip_messages_without_text_and_respect_existing_ones():
+    messages = _tool_loop(2)
+    messages[3] = {"role": "tool", "tool_call_id": "1", "content": "result"}
+    assert plan_cache_breakpoints(messages) == [0, 1, 2, 5]
+
+    messages[1] = {"role": "user", "content": [{"type": "text", "text": "task", "cache_control": {"type": "ephemeral"}}]}
+    assert len(plan_cache_breakpoints(messages)) == 3
+
+
+def test_prepare_params_does_not_mutate_messages():
+    messages = _tool_loop(2)
+    messages[-1] = {"role": "user", "content": [{"type": "text", "text": "look"}, {"type": "image_url", "image_url": {"url": "x"}}]}
+    original = copy.deepcopy(messages)
+
+    params = prepare_params(messages, "anthropic/claude-3-7-sonnet-latest")
+    assert messages == original
+    marked = [m for m in params["messages"] if isinstance(m["content"], list) and any("cache_control" in b for b in m["content"])]
+    assert len(marked) == 4
+    assert "cache_control" in params["messages"][-1]["content"][0]
+
+
+def test_apply_leaves_unmarked_messages_shared():
+    messages = _tool_loop(1)
+    marked = apply_cache_breakpoints(messages, [0])
+    assert marked[1] is messages[1] and marked[0] is not messages[0]
+
+
+def test_hit_rate_counts_cache_writes_as_prompt_tokens():
+    stats = PromptCacheStats()
+    stats.record("claude", {"prompt_tokens": 100, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 900})
+    stats.record("claude", {"prompt_tokens": 1000, "cache_read_input_tokens": 900, "cache_creation_input_tokens": 0})
+    assert stats.hit_rate("claude") == 0.45
+    assert stats.hit_rate() == 0.45 and stats.hit_rate("gpt-4o") is None
@@ -0,0 +1,99 @@
+"""
+Tests for retrieval memory over thread history.
+
+Checks that similar texts get similar hashed vectors, that rows are indexed
+incrementally and only for loaded threads, that searches only return chunks
+from before the given time, and that snippets are formatted in thread order.
+"""
+
+import json
+from datetime import datetime, timezone
+
+from agentpress.retrieval_memory import (
+    HashingVectorizer,
+    RetrievalMemory,
+    build_query,
+    chunk_text,
+    format_retrieved_context,
+)
+
+
+def _row(message_id, minute, text, type="assistant", role="assistant"):
+    return {
+        "message_id": message_id,
+        "type": type,
+        "content": json.dumps({"role": role, "content": text}),
+        "created_at": f"2025-04-20T10:{minute:02d}:00.000000+00:00",
+    }
+
+
+def _at(minute):
+    return datetime(2025, 4, 20, 10, minute, tzinfo=timezone.utc)
+
+
+def _history():
+    return [
+        _row("a", 1, "The database password is stored in /workspace/config/secrets.env for the staging server."),
+        _row("b", 2, "Rendered the bakery landing page with a blue palette and a hero image."),
+        _row("c", 3, "Deployment to staging failed because port 8080 was already in use."),
+        _row("s", 4, "Summary of the work so far.", type="summary", role="user"),
+        _row("d", 5, "Now writing the README for the project."),
+    ]
+
+
+def test_similar_texts_have_similar_vectors():
+    vectors = HashingVectorizer().transform([
+        "staging deployment failed on port 8080",
+        "why did the staging deployment fail",
+        "blue palette for the bakery landing page",
+        "",
+    ])
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+    assert abs(float(vectors[0] @ vectors[0]) - 1.0) < 1e-5
+    assert not vectors[3].any()
+
+
+def test_long_texts_are_cut_into_overlapping_chunks():
+    chunks = chunk_text("x" * 2500, chunk_chars=1000, overlap_chars=200)
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 900]
+    assert chunk_text("   ") == []
+
+
+def test_search_returns_relevant_chunks_from_before_the_summary():
+    memory = RetrievalMemory()
+    memory.add_rows("t", _history())
+    assert "t" not in memory  # Rows of threads that are not loaded are ignored
+
+    memory.load("t", _history())
+    snippets = memory.search("t", "where is the database password for staging", before=_at(4), top_k=1)
+    assert [snippet.message_id for snippet in snippets] == ["a"]
+
+    # Messages after the summary are already in context and never returned
+    snippets = memory.search("t", "README for the project", before=_at(4), top_k=4)
+    assert "d" not in [snippet.message_id for snippet in snippets]
+
+
+def test_rows_are_indexed_incrementally_and_once():
+    memory = RetrievalMemory()
+    memory.load("t", _history()[:2])
+    memory.add_rows("t", [_row("c", 3, "Deployment to staging failed because port 8080 was already in use.")] * 2)
+    snippets = memory.search("t", "staging deployment port 8080 in use", before=_at(4), top_k=4)
+    assert [snippet.message_id for snippet in snippets].count("c") == 1
+
+
+def test_snippets_are_formatted_in_thread_order():
+    memory = RetrievalMemory()
+    memory.load("t", _history())
+    snippets = memory.search("t", "staging password deployment port", before=_at(4), top_k=2)
+    assert [snippet.message_id for snippet in snippets] == ["a", "c"]
+
+    message = format_retrieved_context(snippets)
+    assert message["role"] == "user"
+    assert message["content"].index("secrets.env") < message["content"].index("port 8080")
+    assert format_retrieved_context([]) is None
+
+
+def test_query_uses_the_last_messages_and_temporary_message():
+    messages = [{"role": "user", "content": f"message {index}"} for index in range(5)]
+    query = build_query(messages, {"role": "user", "content": "temporary"})
+    assert "message 0" not in query and "message 4" in query and "temporary" in query
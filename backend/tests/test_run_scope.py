@@ -0,0 +1,68 @@
+"""
+Tests for run-scoped tool registries.
+
+Checks that tools registered by concurrent runs stay bound to their run, that
+the shared registry is untouched, and that releasing a run cleans up its tools.
+"""
+
+import asyncio
+
+from agentpress.thread_manager import ThreadManager
+from agentpress.tool import Tool, xml_schema
+from agentpress.tool_registry import ToolRegistry
+
+
+class _SandboxTool(Tool):
+    cleaned_up = []
+
+    def __init__(self, sandbox):
+        super().__init__()
+        self.sandbox = sandbox
+
+    @xml_schema(tag_name="where", mappings=[], example="<where/>")
+    async def where(self):
+        return self.success_response(self.sandbox)
+
+    async def cleanup(self):
+        type(self).cleaned_up.append(self.sandbox)
+
+
+class _SharedTool(Tool):
+    @xml_schema(tag_name="shared", mappings=[])
+    async def shared(self):
+        return self.success_response("shared")
+
+
+def test_runs_get_their_own_tool_instances():
+    ToolRegistry._instance = None
+    manager = ThreadManager()
+    manager.add_tool(_SharedTool)
+    first, second = manager.create_run_scope(), manager.create_run_scope()
+    first.add_tool(_SandboxTool, sandbox="sandbox-1")
+    second.add_tool(_SandboxTool, sandbox="sandbox-2")
+
+    async def where(scope):
+        tool = scope.tool_registry.get_xml_tool("where")
+        return (await getattr(tool["instance"], tool["method"])()).output
+
+    assert asyncio.run(where(first)) == "sandbox-1"
+    assert asyncio.run(where(second)) == "sandbox-2"
+    assert "shared" in first.tool_registry.xml_tools and "where" not in manager.tool_registry.xml_tools
+    assert first.response_processor.tool_registry is first.tool_registry
+    assert first.tool_registry.get_tool_set_hash() == second.tool_registry.get_tool_set_hash()
+    # Shared state stays shared
+    assert first._message_cache is manager._message_cache
+
+
+def test_release_cleans_up_run_tools_only():
+    ToolRegistry._instance = None
+    manager = ThreadManager()
+    manager.add_tool(_SharedTool)
+    scope = manager.create_run_scope()
+    scope.add_tool(_SandboxTool, sandbox="sandbox-3")
+    _SandboxTool.cleaned_up.clear()
+
+    asyncio.run(scope.release())
+    asyncio.run(manager.release())
+    assert _SandboxTool.cleaned_up == ["sandbox-3"]
+    assert "where" not in scope.tool_registry.xml_tools and "shared" in scope.tool_registry.xml_tools
@@ -0,0 +1,74 @@
+"""
+Tests for map-reduce summarization of long histories.
+
+Checks that long histories are split into token-bounded segments summarized
+with bounded concurrency, that partial summaries are merged, and that
+persisted segment summaries are reused.
+"""
+
+import asyncio
+
+from agentpress import context_manager as context_manager_module
+from agentpress.context_manager import ContextManager
+
+
+def _history(count):
+    return [{"role": "user", "content": f"message {index} " + "word " * 40} for index in range(count)]
+
+
+def _manager(monkeypatch, segment_tokens=200):
+    manager = ContextManager()
+    calls = {"segments": 0, "reduces": 0, "running": 0, "peak": 0}
+    persisted = {}
+
+    async def call_summarizer(system_content, model, max_tokens):
+        calls["running"] += 1
+        calls["peak"] = max(calls["peak"], calls["running"])
+        await asyncio.sleep(0.01)
+        calls["running"] -= 1
+        if "PART SUMMARIES" in system_content:
+            calls["reduces"] += 1
+            return "merged"
+        calls["segments"] += 1
+        return f"segment summary {calls['segments']}"
+
+    async def load_segment_summaries(thread_id):
+        return dict(persisted)
+
+    async def save_segment_summary(thread_id, segment_key, summary, message_count):
+        persisted[segment_key] = summary
+
+    monkeypatch.setattr(manager, "_call_summarizer", call_summarizer)
+    monkeypatch.setattr(manager, "_load_segment_summaries", load_segment_summaries)
+    monkeypatch.setattr(manager, "_save_segment_summary", save_segment_summary)
+    monkeypatch.setattr(context_manager_module, "SUMMARY_SEGMENT_TOKENS", segment_tokens)
+    monkeypatch.setattr(context_manager_module, "SUMMARY_MAX_PARALLEL_SEGMENTS", 2)
+    return manager, calls, persisted
+
+
+def test_long_history_is_summarized_in_segments_and_merged(monkeypatch):
+    manager, calls, persisted = _manager(monkeypatch)
+    segments = asyncio.run(manager._split_into_segments(_history(12), "gpt-4o", 200))
+    assert len(segments) > 2 and sum(len(segment) for segment in segments) == 12
+
+    summary = asyncio.run(manager.create_summary("t", _history(12), "gpt-4o"))
+    assert "merged" in summary["content"]
+    assert calls["segments"] == len(segments) and len(persisted) == len(segments)
+    assert calls["peak"] <= 2
+
+
+def test_persisted_segment_summaries_are_reused(monkeypatch):
+    manager, calls, persisted = _manager(monkeypatch)
+    asyncio.run(manager.create_summary("t", _history(12), "gpt-4o"))
+    summarized = calls["segments"]
+
+    # More messages: the complete segments are unchanged and reused
+    asyncio.run(manager.create_summary("t", _history(14), "gpt-4o"))
+    assert calls["segments"] - summarized <= 1
+
+
+def test_short_history_takes_a_single_call(monkeypatch):
+    manager, calls, persisted = _manager(monkeypatch, segment_tokens=100000)
+    summary = asyncio.run(manager.create_summary("t", _history(3), "gpt-4o"))
+    assert summary["content"].count("segment summary 1") == 1
+    assert calls["reduces"] == 0 and not persisted
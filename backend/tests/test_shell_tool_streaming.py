@@ -0,0 +1,70 @@
+"""
+Tests for streaming output of sandbox shell commands.
+
+Checks that execute_command yields new command output as progress while the
+command runs, and that a command past its timeout is killed.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+sb_shell_tool = pytest.importorskip("agent.tools.sb_shell_tool")
+
+
+class _FakeProcess:
+    """Sandbox process API whose command prints one line per poll and exits after the given number of polls."""
+
+    def __init__(self, lines, exit_after):
+        self.lines = lines
+        self.exit_after = exit_after
+        self.polls = 0
+        self.deleted = []
+
+    def create_session(self, session_id):
+        pass
+
+    def delete_session(self, session_id):
+        self.deleted.append(session_id)
+
+    def execute_session_command(self, session_id, req):
+        assert req.var_async
+        return SimpleNamespace(cmd_id="cmd")
+
+    def get_session_command(self, session_id, command_id):
+        self.polls += 1
+        return SimpleNamespace(exit_code=0 if self.exit_after is not None and self.polls >= self.exit_after else None)
+
+    def get_session_command_logs(self, session_id, command_id):
+        return "".join(self.lines[:self.polls])
+
+
+def _run(process, **kwargs):
+    tool = sb_shell_tool.SandboxShellTool.__new__(sb_shell_tool.SandboxShellTool)
+    tool.sandbox = SimpleNamespace(process=process)
+    tool._sessions = {}
+    tool._kill_tasks = set()
+    tool.workspace_path = "/workspace"
+
+    async def collect():
+        updates = [update async for update in tool.execute_command("make", **kwargs)]
+        await asyncio.gather(*tool._kill_tasks)
+        return updates
+
+    return asyncio.run(collect())
+
+
+def test_output_is_streamed_while_the_command_runs(monkeypatch):
+    monkeypatch.setattr(sb_shell_tool, "COMMAND_POLL_INTERVAL", 0)
+    updates = _run(_FakeProcess(["building\n", "linking\n", "done\n"], exit_after=3))
+    assert [update.output for update in updates[:-1]] == ["building\n", "linking\n", "done\n"]
+    assert updates[-1].success and '"exit_code": 0' in updates[-1].output
+
+
+def test_command_past_its_timeout_is_killed(monkeypatch):
+    monkeypatch.setattr(sb_shell_tool, "COMMAND_POLL_INTERVAL", 0)
+    process = _FakeProcess(["working\n"], exit_after=None)
+    updates = _run(process, timeout=0)
+    assert not updates[-1].success and "timed out" in updates[-1].output
+    assert len(process.deleted) == 1
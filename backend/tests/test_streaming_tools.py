@@ -0,0 +1,58 @@
+"""
+Tests for streaming (async generator) tools.
+
+Checks that progress items are forwarded as they are produced and that only
+the final result is returned from tool execution.
+"""
+
+import asyncio
+
+from agentpress.response_processor import ResponseProcessor
+from agentpress.tool import Tool, ToolProgress, ToolResult, openapi_schema
+from agentpress.tool_registry import ToolRegistry
+
+
+def _schema(name):
+    return openapi_schema({"type": "function", "function": {"name": name, "parameters": {"type": "object"}}})
+
+
+class _StreamingTool(Tool):
+    @_schema("count")
+    async def count(self, upto: int):
+        for i in range(upto):
+            yield self.progress(f"step {i}")
+        yield self.success_response("counted")
+
+    @_schema("echo_lines")
+    async def echo_lines(self):
+        yield "first"
+        yield ToolProgress(output="second")
+
+
+def _execute(function_name, arguments):
+    ToolRegistry._instance = None
+    registry = ToolRegistry()
+    registry.register_tool(_StreamingTool)
+
+    async def add_message(**kwargs):
+        return None
+
+    processor = ResponseProcessor(registry, add_message)
+    progress = []
+    result = asyncio.run(processor._execute_tool(
+        {"function_name": function_name, "arguments": arguments},
+        progress_callback=lambda item: progress.append(item.output)
+    ))
+    return result, progress
+
+
+def test_progress_is_forwarded_and_final_result_returned():
+    result, progress = _execute("count", {"upto": 3})
+    assert progress == ["step 0", "step 1", "step 2"]
+    assert result == ToolResult(success=True, output="counted")
+
+
+def test_progress_is_aggregated_when_no_result_is_yielded():
+    result, progress = _execute("echo_lines", {})
+    assert progress == ["first", "second"]
+    assert result == ToolResult(success=True, output="first\nsecond")
@@ -0,0 +1,71 @@
+"""
+Tests for the pluggable summarizer backends.
+
+Checks that the extractive summarizer keeps tool names, paths, URLs and
+decisions within the token target, that the tiered summarizer falls back to the
+LLM only when the extractive summary does not fit, and that the backend is
+selected from the environment.
+"""
+
+import asyncio
+
+from agentpress.context_manager import ContextManager
+from agentpress.summarizers import (
+    ExtractiveSummarizer,
+    LLMSummarizer,
+    TieredSummarizer,
+    create_summarizer,
+)
+
+
+def _history():
+    messages = [
+        {"role": "user", "content": "Please build a landing page for the bakery and publish it."},
+        {"role": "assistant", "content": "I will create the page at /workspace/site/index.html first. <create-file file_path=\"site/index.html\">...</create-file>"},
+        {"role": "user", "content": "<tool_result> <create-file> ToolResult(success=True, output='File created') </create-file> </tool_result>"},
+    ]
+    for index in range(30):
+        messages.append({"role": "assistant", "content": f"Checking layout variant {index} of the hero section for spacing issues."})
+        messages.append({"role": "user", "content": f"Result for execute-command: ToolResult(success=True, output='layout {index} ok')"})
+    messages.append({"role": "assistant", "content": "We decided to use the blue palette. The site is live at https://bakery.example.com/preview now."})
+    return messages
+
+
+async def _fake_llm(thread_id, messages, model):
+    return "llm summary"
+
+
+def test_extractive_summary_keeps_key_facts_within_target():
+    summary = asyncio.run(ExtractiveSummarizer().summarize("t", _history(), "gpt-4o", 200))
+    assert "create-file" in summary and "execute-command" in summary
+    assert "/workspace/site/index.html" in summary
+    assert "https://bakery.example.com/preview" in summary
+    assert "decided to use the blue palette" in summary
+    assert len(summary) <= 200 * 4
+
+
+def test_sentence_scores_favour_distinctive_terms():
+    scores = ExtractiveSummarizer.score_sentences([
+        "the the the the",
+        "the page uses a blue palette",
+        "the the the the",
+    ])
+    assert scores[1] > scores[0] and scores[0] == scores[2]
+
+
+def test_tiered_summarizer_falls_back_when_extractive_does_not_fit():
+    tiered = TieredSummarizer(ExtractiveSummarizer(), LLMSummarizer(_fake_llm))
+    assert asyncio.run(tiered.summarize("t", _history(), "gpt-4o", 400)) != "llm summary"
+    # The key facts alone do not fit five tokens
+    assert asyncio.run(tiered.summarize("t", _history(), "gpt-4o", 5)) == "llm summary"
+
+
+def test_backend_is_selected_from_the_environment(monkeypatch):
+    monkeypatch.setenv("CONTEXT_SUMMARIZER_BACKEND", "extractive")
+    assert isinstance(create_summarizer(_fake_llm), ExtractiveSummarizer)
+    monkeypatch.setenv("CONTEXT_SUMMARIZER_BACKEND", "bogus")
+    assert isinstance(create_summarizer(_fake_llm), LLMSummarizer)
+
+    manager = ContextManager(summarizer_backend="extractive")
+    summary = asyncio.run(manager.create_summary("t", _history(), "gpt-4o"))
+    assert summary["role"] == "user" and "CONVERSATION HISTORY SUMMARY" in summary["content"]
@@ -0,0 +1,95 @@
+"""
+Tests for memoized per-message token counting.
+
+Checks that per-message counts add up to litellm's count of the whole prompt,
+that messages are only tokenized once per model, and that counts stored with
+message rows are used instead of tokenizing again.
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+from litellm import token_counter
+
+from agentpress import token_counting
+from agentpress.thread_manager import ThreadManager
+from agentpress.token_counting import count_message_tokens, count_prompt_tokens
+from agentpress.tool_registry import ToolRegistry
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Summarize the plot of Hamlet in two sentences."},
+    {"role": "assistant", "content": "A prince seeks revenge for his father's murder. Nearly everyone dies."},
+]
+
+
+def test_prompt_count_matches_litellm():
+    assert asyncio.run(count_prompt_tokens("gpt-4o", MESSAGES)) == token_counter(model="gpt-4o", messages=MESSAGES)
+
+
+def test_messages_are_tokenized_once_per_model(monkeypatch):
+    tokenized = []
+    original = token_counting._count_uncached
+
+    def counting(model, messages):
+        tokenized.extend(message["content"] for message in messages)
+        return original(model, messages)
+
+    monkeypatch.setattr(token_counting, "_count_uncached", counting)
+    message = {"role": "user", "content": "A message counted only once"}
+    first = asyncio.run(count_message_tokens("gpt-4o", [message]))
+    second = asyncio.run(count_message_tokens("gpt-4o", [dict(message), MESSAGES[1]]))
+    assert second[0] == first[0]
+    assert tokenized.count(message["content"]) == 1
+
+
+class _FakeQuery:
+    def __init__(self, rows, selects):
+        self.rows, self.selects = rows, selects
+
+    def select(self, columns):
+        self.selects.append(columns)
+        return self
+
+    def __getattr__(self, name):
+        # eq/gte/order/limit filters are irrelevant for these rows
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        return SimpleNamespace(data=self.rows)
+
+
+class _FakeDB:
+    def __init__(self, rows):
+        self.rows, self.selects = rows, []
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        return _FakeQuery(self.rows, self.selects)
+
+
+def test_thread_token_count_uses_counts_stored_with_the_rows(monkeypatch):
+    ToolRegistry._instance = None
+    manager = ThreadManager()
+    rows = [{
+        "message_id": "m1", "type": "user", "created_at": "2025-04-20T10:00:01+00:00",
+        "content": json.dumps({"role": "user", "content": "hello"}),
+        "metadata": json.dumps({"token_counts": {"gpt-4o": 42}}),
+    }]
+    manager.db = _FakeDB(rows)
+
+    def fail(model, messages):
+        raise AssertionError("stored counts must not be recounted")
+
+    monkeypatch.setattr(token_counting, "_count_uncached", fail)
+
+    async def run():
+        messages = await manager.get_llm_messages("thread")
+        return await manager.get_thread_token_count("thread", "gpt-4o", messages)
+
+    assert asyncio.run(run()) == 42
+    assert all("metadata" in columns for columns in manager.db.selects if "content" in columns)
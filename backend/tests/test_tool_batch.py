@@ -0,0 +1,102 @@
+"""
+Tests for ordered tool call batches.
+
+Checks that batched calls run one at a time in call order, or concurrently
+through a scheduler when their traits allow, that a terminal tool or a failed
+call halts the rest of the batch, and that the number of saved LLM turns is
+reported.
+"""
+
+import asyncio
+
+from agentpress.tool import ToolExecutionTraits, ToolResult
+from agentpress.tool_batch import ToolCallBatch
+from agentpress.tool_scheduler import ToolScheduler
+
+
+def _call(label, function_name="step", fail=False):
+    return {"function_name": function_name, "arguments": {"label": label, "fail": fail}}
+
+
+def _run(tool_calls):
+    timeline = []
+
+    async def execute(tool_call):
+        label = tool_call["arguments"]["label"]
+        timeline.append(("start", label))
+        await asyncio.sleep(0.01)
+        timeline.append(("end", label))
+        return ToolResult(success=not tool_call["arguments"]["fail"], output=label)
+
+    batch = ToolCallBatch(execute)
+    results = asyncio.run(batch.run(tool_calls))
+    return batch, results, timeline
+
+
+def test_calls_run_in_order_one_at_a_time():
+    batch, results, timeline = _run([_call("a"), _call("b"), _call("c")])
+    assert timeline == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"), ("start", "c"), ("end", "c")]
+    assert [result.output for _, result in results] == ["a", "b", "c"]
+    assert batch.summary() == {"executed": 3, "skipped": 0, "halted_by": None, "llm_turns_saved": 2}
+
+
+def test_failure_halts_the_rest_of_the_batch():
+    batch, results, timeline = _run([_call("a"), _call("b", fail=True), _call("c"), _call("d")])
+    assert ("start", "c") not in timeline
+    assert [result.success for _, result in results] == [True, False, False, False]
+    assert "Not executed" in results[2][1].output
+    assert (batch.executed, batch.skipped, batch.llm_turns_saved) == (2, 2, 1)
+
+
+def test_terminal_tool_halts_the_rest_of_the_batch():
+    batch, results, timeline = _run([_call("a"), _call("done", function_name="complete"), _call("c")])
+    assert ("start", "c") not in timeline
+    assert results[1][1].success and not results[2][1].success
+    assert batch.halted_by == "the terminal complete call"
+
+
+class _TraitsRegistry:
+    """Registry stand-in: "read" and the terminal tools are read-only, other tools undeclared."""
+
+    def get_execution_traits(self, function_name):
+        return ToolExecutionTraits(read_only=True) if function_name in ("read", "complete") else None
+
+    def get_tool_instance(self, function_name):
+        return None
+
+
+def _run_scheduled(tool_calls):
+    timeline = []
+
+    async def execute(tool_call):
+        label = tool_call["arguments"]["label"]
+        timeline.append(("start", label))
+        await asyncio.sleep(0.01)
+        timeline.append(("end", label))
+        return ToolResult(success=not tool_call["arguments"]["fail"], output=label)
+
+    batch = ToolCallBatch(execute, scheduler=ToolScheduler(_TraitsRegistry(), execute))
+    results = asyncio.run(batch.run(tool_calls))
+    return batch, results, timeline
+
+
+def test_scheduled_batch_runs_independent_calls_concurrently():
+    batch, results, timeline = _run_scheduled([_call("a", "read"), _call("b", "read"), _call("c")])
+    assert timeline[:2] == [("start", "a"), ("start", "b")]
+    assert timeline.index(("start", "c")) > timeline.index(("end", "b"))
+    assert [result.output for _, result in results] == ["a", "b", "c"]
+    assert batch.executed == 3
+
+
+def test_scheduled_batch_runs_terminal_tool_last_and_skips_later_calls():
+    batch, results, timeline = _run_scheduled([_call("a", "read"), _call("done", "complete"), _call("b", "read")])
+    assert timeline.index(("start", "done")) > timeline.index(("end", "a"))
+    assert ("start", "b") not in timeline
+    assert batch.halted_by == "the terminal complete call"
+    assert not results[2][1].success
+
+
+def test_scheduled_batch_failure_skips_calls_not_yet_started():
+    batch, results, timeline = _run_scheduled([_call("a", fail=True), _call("b"), _call("c", "read")])
+    assert ("start", "b") not in timeline and ("start", "c") not in timeline
+    assert (batch.executed, batch.skipped) == (1, 2)
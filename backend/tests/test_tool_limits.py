@@ -0,0 +1,148 @@
+"""
+Tests for tool execution limits and cancellation.
+
+Checks that declared timeouts and concurrency caps are enforced and that a
+cancelled stream cancels in-flight tools and records them as tool errors.
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from agentpress.response_processor import ProcessorConfig, ResponseProcessor
+from agentpress.tool import Tool, openapi_schema, xml_schema
+from agentpress.tool_registry import ToolRegistry
+
+
+class _LimitedTool(Tool):
+    running = 0
+    peak = 0
+    cancelled = 0
+
+    @openapi_schema({"type": "function", "function": {"name": "hang", "parameters": {"type": "object"}}}, timeout=0.05)
+    async def hang(self):
+        await asyncio.sleep(10)
+        return self.success_response("never")
+
+    @openapi_schema({"type": "function", "function": {"name": "capped", "parameters": {"type": "object"}}}, max_concurrency=2)
+    async def capped(self):
+        cls = type(self)
+        cls.running += 1
+        cls.peak = max(cls.peak, cls.running)
+        await asyncio.sleep(0.02)
+        cls.running -= 1
+        return self.success_response("ok")
+
+    @openapi_schema({"type": "function", "function": {"name": "blocking", "parameters": {"type": "object"}}}, timeout=0.05, max_concurrency=1)
+    async def blocking(self, seconds: float):
+        await self.run_blocking(time.sleep, seconds)
+        return self.success_response("slept")
+
+    @xml_schema(tag_name="stuck", mappings=[])
+    async def stuck(self):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            type(self).cancelled += 1
+            raise
+        return self.success_response("never")
+
+
+def _processor(rows):
+    ToolRegistry._instance = None
+    registry = ToolRegistry()
+    registry.register_tool(_LimitedTool)
+
+    async def add_message(thread_id, type, content, is_llm_message=False, metadata=None):
+        row = {"message_id": str(len(rows)), "type": type, "content": content}
+        rows.append(row)
+        return row
+
+    return ResponseProcessor(registry, add_message)
+
+
+def test_timeout_fails_the_call():
+    processor = _processor([])
+    result = asyncio.run(processor._execute_tool({"function_name": "hang", "arguments": {}}))
+    assert not result.success
+    assert "timed out" in result.output
+
+
+def test_max_concurrency_caps_parallel_calls():
+    processor = _processor([])
+    _LimitedTool.peak = 0
+    calls = [{"function_name": "capped", "arguments": {}} for _ in range(6)]
+    results = asyncio.run(processor._execute_tools(calls, "parallel"))
+    assert all(result.success for _, result in results)
+    assert _LimitedTool.peak == 2
+
+
+def test_cancelling_the_stream_cancels_tools_and_records_errors():
+    rows = []
+    processor = _processor(rows)
+    _LimitedTool.cancelled = 0
+
+    async def llm_stream():
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="<stuck></stuck>"), finish_reason=None)])
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason="stop")])
+
+    async def run():
+        frames = []
+
+        async def consume():
+            config = ProcessorConfig(xml_tool_calling=True, execute_on_stream=True, tool_execution_strategy="scheduled")
+            async for frame in processor.process_streaming_response(llm_stream(), "thread", [], "gpt-4o", config, prompt_token_count=0):
+                frames.append(frame)
+
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        consumer.cancel()
+        started = asyncio.get_running_loop().time()
+        try:
+            await consumer
+        except asyncio.CancelledError:
+            pass
+        return frames, asyncio.get_running_loop().time() - started
+
+    frames, elapsed = asyncio.run(run())
+    assert elapsed < 0.5
+    assert _LimitedTool.cancelled == 1
+    errors = [row for row in rows if row["type"] == "status" and row["content"].get("status_type") == "tool_error"]
+    assert len(errors) == 1 and "cancelled" in errors[0]["content"]["message"]
+    # The run end is recorded but never yielded after the cancellation
+    assert rows[-1]["content"] == {"status_type": "thread_run_end"}
+    assert not any(frame.get("content") == {"status_type": "thread_run_end"} for frame in frames)
+
+
+def test_timed_out_blocking_call_returns_only_after_its_thread():
+    processor = _processor([])
+
+    async def run():
+        started = time.monotonic()
+        result = await processor._execute_tool({"function_name": "blocking", "arguments": {"seconds": 0.2}})
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(run())
+    assert not result.success and "timed out" in result.output
+    assert elapsed >= 0.2
+
+
+def test_cancelled_blocking_call_keeps_its_slot_until_the_thread_returns():
+    processor = _processor([])
+
+    async def run():
+        first = asyncio.create_task(processor._execute_tool({"function_name": "blocking", "arguments": {"seconds": 0.03}}))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        cancelled_at = time.monotonic()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        # The second call waits for the first call's thread before it gets the only slot
+        result = await processor._execute_tool({"function_name": "blocking", "arguments": {"seconds": 0}})
+        return result, time.monotonic() - cancelled_at
+
+    result, elapsed = asyncio.run(run())
+    assert result.success
+    assert elapsed >= 0.015
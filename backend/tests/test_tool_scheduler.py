@@ -0,0 +1,111 @@
+"""
+Tests for the dependency-aware tool scheduler.
+
+Checks that read-only calls overlap, that calls on the same path or on an
+exclusive resource run in call order, that undeclared tools are serialized,
+and that results come back in call order.
+"""
+
+import asyncio
+
+from agentpress.tool import Tool, ToolExecutionTraits, ToolResult, execution_traits, openapi_schema
+from agentpress.tool_registry import ToolRegistry
+from agentpress.tool_scheduler import ToolScheduler
+
+
+def _schema(name):
+    return openapi_schema({"type": "function", "function": {"name": name, "parameters": {"type": "object"}}})
+
+
+class _SchedulingTool(Tool):
+    @execution_traits(read_only=True)
+    @_schema("search")
+    async def search(self, label: str) -> ToolResult:
+        return self.success_response(label)
+
+    @execution_traits(path_param="file_path", shared_resources=["workspace"])
+    @_schema("write_file")
+    async def write_file(self, label: str, file_path: str) -> ToolResult:
+        return self.success_response(label)
+
+    @execution_traits(exclusive_resources=["workspace"])
+    @_schema("run_command")
+    async def run_command(self, label: str) -> ToolResult:
+        return self.success_response(label)
+
+    @_schema("undeclared")
+    async def undeclared(self, label: str) -> ToolResult:
+        return self.success_response(label)
+
+
+class _BrowserTool(Tool):
+    default_execution_traits = ToolExecutionTraits(exclusive_resources=("browser",))
+
+    @_schema("click")
+    async def click(self, label: str) -> ToolResult:
+        return self.success_response(label)
+
+
+def _make_scheduler(timeline):
+    ToolRegistry._instance = None
+    registry = ToolRegistry()
+    registry.register_tool(_SchedulingTool)
+    registry.register_tool(_BrowserTool)
+
+    async def execute(tool_call):
+        label = tool_call["arguments"]["label"]
+        timeline.append(("start", label))
+        await asyncio.sleep(0.01)
+        timeline.append(("end", label))
+        return ToolResult(success=True, output=label)
+
+    return ToolScheduler(registry, execute)
+
+
+def _call(name, label, **arguments):
+    return {"function_name": name, "arguments": {"label": label, **arguments}}
+
+
+def _run(tool_calls):
+    timeline = []
+    results = asyncio.run(_make_scheduler(timeline).run(tool_calls))
+    return [result.output for _, result in results], timeline
+
+
+def _ran_before(timeline, first, second):
+    return timeline.index(("end", first)) < timeline.index(("start", second))
+
+
+def test_independent_calls_overlap_and_results_keep_call_order():
+    outputs, timeline = _run([
+        _call("search", "s1"),
+        _call("write_file", "w1", file_path="a.txt"),
+        _call("write_file", "w2", file_path="b.txt"),
+        _call("click", "c1"),
+    ])
+    assert outputs == ["s1", "w1", "w2", "c1"]
+    assert [event for event, _ in timeline[:4]] == ["start"] * 4
+
+
+def test_conflicting_calls_run_in_call_order():
+    _, timeline = _run([
+        _call("write_file", "w1", file_path="/a.txt"),
+        _call("write_file", "w2", file_path="a.txt"),
+        _call("click", "c1"),
+        _call("click", "c2"),
+        _call("run_command", "r1"),
+    ])
+    assert _ran_before(timeline, "w1", "w2")
+    assert _ran_before(timeline, "c1", "c2")
+    assert _ran_before(timeline, "w2", "r1")
+    assert not _ran_before(timeline, "w1", "c1")
+
+
+def test_undeclared_tools_are_serialized():
+    _, timeline = _run([
+        _call("search", "s1"),
+        _call("undeclared", "u1"),
+        _call("search", "s2"),
+    ])
+    assert _ran_before(timeline, "s1", "u1")
+    assert _ran_before(timeline, "u1", "s2")
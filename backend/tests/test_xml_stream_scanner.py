@@ -0,0 +1,66 @@
+"""
+Tests for the incremental XML stream scanner.
+
+Verifies that complete tool call chunks are emitted exactly once regardless of
+how the content is split into deltas, including nested and prefix-sharing tags.
+"""
+
+from agentpress.xml_stream_scanner import XMLStreamScanner, extract_xml_chunks
+
+TAGS = ["create-file", "wait", "wait-sequence", "ask"]
+
+CONTENT = """
+Let me create the file now.
+<create-file file_path="index.html">
+<html><body>
+<create-file>nested</create-file>
+</body></html>
+</create-file>
+Some text with a <div> that is not a tool.
+<wait-sequence count="2">ignored label</wait-sequence>
+<wait seconds="1">This is wait 1</wait>
+<ask>Done?</ask>
+trailing <wai
+"""
+
+EXPECTED = [
+    '<create-file file_path="index.html">\n<html><body>\n<create-file>nested</create-file>\n</body></html>\n</create-file>',
+    '<wait-sequence count="2">ignored label</wait-sequence>',
+    '<wait seconds="1">This is wait 1</wait>',
+    '<ask>Done?</ask>',
+]
+
+
+def _feed_in_pieces(content: str, size: int):
+    scanner = XMLStreamScanner(TAGS)
+    chunks = []
+    for i in range(0, len(content), size):
+        chunks.extend(scanner.feed(content[i:i + size]))
+    return chunks, scanner
+
+
+def test_whole_content():
+    assert extract_xml_chunks(CONTENT, TAGS) == EXPECTED
+
+
+def test_every_split_size_emits_each_chunk_once():
+    for size in range(1, 40):
+        chunks, _ = _feed_in_pieces(CONTENT, size)
+        assert chunks == EXPECTED, f"split size {size}"
+
+
+def test_unfinished_chunk_is_held_until_closed():
+    scanner = XMLStreamScanner(TAGS)
+    assert scanner.feed("<ask>Are you") == []
+    assert scanner.in_tag
+    assert scanner.feed(" sure?</as") == []
+    assert scanner.feed("k> after") == ["<ask>Are you sure?</ask>"]
+    assert not scanner.in_tag
+
+
+def test_prefix_tag_is_not_matched_inside_longer_name():
+    assert extract_xml_chunks("<waiting>no</waiting><wait>yes</wait>", TAGS) == ["<wait>yes</wait>"]
+
+
+def test_no_registered_tags():
+    assert XMLStreamScanner([]).feed("<ask>hi</ask>") == []
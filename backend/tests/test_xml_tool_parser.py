@@ -0,0 +1,58 @@
+"""
+Tests for the compiled XML tool parser.
+
+Verifies attribute quote styles, element and content mappings, nested tags of
+the same name, and rejection of chunks missing required parameters.
+"""
+
+from agentpress.tool import XMLTagSchema
+from agentpress.xml_tool_parser import XMLToolParser
+
+
+def _schema(tag_name, *mappings):
+    schema = XMLTagSchema(tag_name=tag_name)
+    for param_name, node_type, path, required in mappings:
+        schema.add_mapping(param_name, node_type, path, required)
+    return schema
+
+
+def test_attributes_in_every_quote_style():
+    parser = XMLToolParser(_schema(
+        "create-file",
+        ("file_path", "attribute", "file_path", True),
+        ("mode", "attribute", "mode", False),
+        ("file_contents", "content", ".", True),
+    ))
+    for opening in ('file_path="a &amp; b.py"', "file_path='a &amp; b.py'"):
+        params, details = parser.parse(f"<create-file {opening} mode=w>\nprint(1)\n</create-file>")
+        assert params == {"file_path": "a & b.py", "mode": "w", "file_contents": "print(1)"}
+        assert details["root_content"] == "print(1)"
+
+
+def test_elements_and_nested_root_tag():
+    parser = XMLToolParser(_schema(
+        "str-replace",
+        ("file_path", "attribute", "file_path", True),
+        ("old_str", "element", "old_str", True),
+        ("new_str", "element", "new_str", True),
+    ))
+    chunk = (
+        '<str-replace file_path="x.xml"><old_str><str-replace>a</str-replace></old_str>'
+        "<new_str>b</new_str></str-replace>"
+    )
+    params, details = parser.parse(chunk)
+    assert params == {
+        "file_path": "x.xml",
+        "old_str": "<str-replace>a</str-replace>",
+        "new_str": "b",
+    }
+    assert details["raw_chunk"] == chunk
+
+
+def test_missing_required_parameter_returns_none():
+    parser = XMLToolParser(_schema(
+        "see-image",
+        ("file_path", "attribute", "file_path", True),
+    ))
+    assert parser.parse('<see-image file_path="a.png"></see-image>')[0] == {"file_path": "a.png"}
+    assert parser.parse("<see-image></see-image>") is None
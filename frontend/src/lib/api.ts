@@ -345,6 +345,7 @@ export const getMessages = async (threadId: string): Promise<Message[]> => {
     .eq('thread_id', threadId)
     .neq('type', 'cost')
     .neq('type', 'summary')
+    .neq('type', 'summary_segment')
     .order('created_at', { ascending: true });
   
   if (error) {